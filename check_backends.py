@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Regression check of the optimiser and of the two backends: each sketch is
+compiled at -O0, -O1 and -O2 and run for a few loops on the VirtualMachine
+and as a CompiledProgram. The global variables and the outputs of every run
+must match those of the unoptimised sketch on the virtual machine. Without
+sketches, a sample sketch is checked.
+
+Usage: python check_backends.py [sketch.c ...] [--loops=N]
+'''
+
+import sys
+from preprocessor import PreprocessorError
+from program import get_option_value, get_preprocessor
+from python_code_generator import CompiledProgram
+from syntactic_and_semantic_analyser import SyntacticAndSemanticAnalyser
+from virtual_machine import ExecutionError, VirtualMachine
+
+DEFAULT_LOOPS = 5
+OPTIMISATION_LEVELS = [0, 1, 2]
+BACKENDS = [VirtualMachine, CompiledProgram]
+SAMPLE_SKETCH = u'''int pinMode(int p, int m) { return 0; }
+int digitalWrite(int p, int v) { return 0; }
+int analogRead(int p) { return 0; }
+int delay(int ms) { return 0; }
+int millis() { return 0; }
+int led = 13;
+int calls = 0;
+int limit = 3 * 4 + 1;
+float ratio = 2.5 * limit;
+int counted() {
+    calls = calls + 1;
+    return calls * 10;
+}
+int first = counted();
+int after = limit * 2;
+int total = 0;
+int quot = 0;
+int rem = 0;
+unsigned int mask = 10;
+float average = 0;
+int factorial(int n) {
+    if (n <= 1) {
+        return 1;
+    }
+    return n * factorial(n - 1);
+}
+int scale(int x) {
+    return x * 8 + 0;
+}
+void setup() {
+    pinMode(led, OUTPUT);
+    total = factorial(5) + first + after;
+}
+void loop() {
+    int i;
+    int step;
+    step = limit / 2;
+    for (i = 0; i < 4; i = i + 1) {
+        total = total + scale(i) + step * 1;
+    }
+    while (i < 10) {
+        i = i + 3;
+        total = total - i * 4;
+    }
+    if (total > 100 && calls < 5) {
+        digitalWrite(led, HIGH);
+    } else {
+        digitalWrite(led, LOW);
+    }
+    calls = calls + 1;
+    quot = (0 - total - 3) / 4;
+    rem = (0 - total - 3) % 4;
+    mask = mask / 4 + mask % 4 + analogRead(0);
+    average = (average + total) / 2;
+    delay(millis() % 7 + total % 50);
+}
+'''
+
+
+def compile_sketch(tokens, optimisation_level):
+    analyser = SyntacticAndSemanticAnalyser(tokens)
+    program = analyser.check_program()
+    analyser.optimise_code(program, optimisation_level)
+    return analyser, program
+
+
+def run_sketch(analyser, program, backend, loops):
+    '''
+    Returns the global variables and the outputs of a run, or the error that
+    stopped it.
+    '''
+    symbols_table = analyser.symbols_table
+    machine = backend(analyser.definitions_code.code, program.code,
+                      variable_types=symbols_table.get_localized_types(),
+                      data_image=analyser.data_image,
+                      function_locals=symbols_table.get_function_locals())
+    try:
+        machine.run(loops)
+    except ExecutionError as error:
+        return unicode(error)
+    variables = machine.get_variables()
+    # The globals that the optimiser left out were never changed
+    global_variables = sorted(
+        (name, variables.get(name, 0))
+        for name, symbol in symbols_table.elements.items()
+        if not symbol.is_function)
+    return global_variables, machine.input_output.events
+
+
+def check_sketch(name, tokens, loops):
+    '''
+    Prints the runs that differ from the unoptimised one on the virtual
+    machine, and returns whether they all match.
+    '''
+    expected = None
+    matches = True
+    for optimisation_level in OPTIMISATION_LEVELS:
+        try:
+            analyser, program = compile_sketch(tokens, optimisation_level)
+        except SystemExit:
+            # The error was already printed by the analyser
+            return False
+        for backend in BACKENDS:
+            result = run_sketch(analyser, program, backend, loops)
+            if expected is None:
+                expected = result
+            elif result != expected:
+                print '%s: -O%i on %s differs' % (name, optimisation_level,
+                                                  backend.__name__)
+                print '    expected: %r' % (expected,)
+                print '    got:      %r' % (result,)
+                matches = False
+    return matches
+
+
+def main(arguments):
+    input_files = [argument for argument in arguments
+                   if not argument.startswith('-')]
+    options = [argument for argument in arguments if argument.startswith('-')]
+    try:
+        loops = int(get_option_value(options, '--loops', DEFAULT_LOOPS))
+    except ValueError:
+        loops = -1
+    if loops < 0 or any(not option.startswith('--loops=')
+                        for option in options):
+        print 'Usage: python check_backends.py [sketch.c ...] [--loops=N]'
+        sys.exit(1)
+    preprocessor = get_preprocessor([])
+    matches = True
+    try:
+        if not input_files:
+            matches = check_sketch(u'sample', preprocessor.get_text_tokens(
+                u'sample.c', SAMPLE_SKETCH.splitlines(True)), loops)
+        for input_file in input_files:
+            matches = check_sketch(input_file, preprocessor.get_tokens(
+                input_file), loops) and matches
+    except PreprocessorError as error:
+        print error
+        sys.exit(1)
+    if not matches:
+        sys.exit(1)
+    print 'OK.'
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,1050 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+from intermediary_code import (Instruction, build_call_graph,
+                               find_functions, find_loops,
+                               find_reachable_functions, generate_code,
+                               get_next_label_index,
+                               get_next_temporary_variable_index,
+                               is_constant, is_function_label,
+                               is_temporary_variable, verify_code)
+
+# The sketches define these as placeholders for the Arduino core, whose
+# calls are answered by the board, so their bodies must not replace them.
+ARDUINO_FUNCTIONS = [
+    u'pinMode', u'digitalWrite', u'digitalRead', u'analogWrite',
+    u'analogRead', u'delay', u'millis'
+]
+# Called by the Arduino core, so every other function is reached from them
+ROOT_FUNCTIONS = [u'setup', u'loop']
+INLINING_MAX_SIZE = 8
+UNROLLING_MAX_SIZE = 64
+NEGATED_OPERATORS = {
+    '==': '!=', '!=': '==', '<': '>=', '>': '<=', '<=': '>', '>=': '<'
+}
+
+
+def get_type_category(defined_type):
+    if defined_type is None:
+        return None
+    words = defined_type.words
+    if 'float' in words or 'double' in words:
+        return 'float'
+    elif 'unsigned' in words or 'word' in words or 'boolean' in words:
+        return 'unsigned'
+    elif 'int' in words or 'char' in words or 'long' in words or\
+            'short' in words:
+        return 'int'
+    return None
+
+
+def get_constant_temporary_variables(instructions):
+    definitions = {}
+    for instruction in instructions:
+        defined_operand = instruction.get_defined_operand()
+        if is_temporary_variable(defined_operand):
+            definitions.setdefault(defined_operand, []).append(instruction)
+    constants = {}
+    for operand, operand_definitions in definitions.items():
+        if len(operand_definitions) == 1 and\
+                operand_definitions[0].kind == 'copy' and\
+                is_constant(operand_definitions[0].argument1):
+            constants[operand] = operand_definitions[0].argument1
+    return constants
+
+
+def infer_operand_types(instructions, variable_types):
+    '''
+    Returns the type category ('int', 'unsigned' or 'float') of every
+    operand whose type can be told from the symbols' table or from the
+    instruction that defines it.
+    '''
+    operand_types = {}
+    for operand, defined_type in variable_types.items():
+        operand_types[operand] = get_type_category(defined_type)
+
+    def get_operand_type(operand):
+        if is_constant(operand):
+            return 'float' if '.' in operand else 'int'
+        return operand_types.get(operand)
+
+    for instruction in instructions:
+        if not is_temporary_variable(instruction.result):
+            continue
+        if instruction.kind in ['copy', 'unary']:
+            operand_type = get_operand_type(instruction.argument1)
+        elif instruction.kind == 'call':
+            operand_type = get_type_category(
+                variable_types.get(instruction.argument1))
+        elif instruction.kind == 'binary' and instruction.operator in\
+                ['==', '!=', '<', '>', '<=', '>=', '&&', '||']:
+            operand_type = 'int'
+        elif instruction.kind == 'binary':
+            operand_types_set = set([
+                get_operand_type(instruction.argument1),
+                get_operand_type(instruction.argument2)])
+            if None in operand_types_set:
+                operand_type = None
+            elif 'float' in operand_types_set:
+                operand_type = 'float'
+            elif operand_types_set == set(['unsigned']):
+                operand_type = 'unsigned'
+            else:
+                operand_type = 'int'
+        else:
+            operand_type = None
+        operand_types[instruction.result] = operand_type
+    return operand_types
+
+
+def get_trip_count(initial_value, step, operator, bound):
+    '''
+    Returns how many times "for (i = initial_value; i operator bound;
+    i += step)" runs, or None if it never stops.
+    '''
+    if operator in ['>', '>=']:
+        initial_value, step, bound = -initial_value, -step, -bound
+        operator = '<' if operator == '>' else '<='
+    if operator == '!=':
+        if step and (bound - initial_value) % step == 0 and\
+                (bound - initial_value) / step >= 0:
+            return (bound - initial_value) / step
+        return None
+    if operator == '<=':
+        bound += 1
+    if initial_value >= bound:
+        return 0
+    if step <= 0:
+        return None
+    return (bound - initial_value + step - 1) / step
+
+
+def get_power_of_two_exponent(value):
+    if value is None or '.' in value:
+        return None
+    value = int(value)
+    if value > 0 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return None
+
+
+class LoopInvariantCodeMotion():
+    name = 'loop-invariant-code-motion'
+
+    def __init__(self):
+        self.hoistable_kinds = ['copy', 'unary', 'binary']
+        # These may fault, so they are only hoisted if they were already
+        # executed on every pass through the loop.
+        self.faulting_operators = ['/', '%']
+
+    def run(self, instructions):
+        instructions = list(instructions)
+        hoisted = True
+        while hoisted:
+            hoisted = False
+            # Innermost loops come first, so that the hoisted code can be
+            # hoisted again by the enclosing loop.
+            for header_index, back_edge_index in find_loops(instructions):
+                if self.hoist_invariants(instructions, header_index,
+                                         back_edge_index):
+                    hoisted = True
+                    break
+        return instructions
+
+    def hoist_invariants(self, instructions, header_index, back_edge_index):
+        body = instructions[header_index + 1:back_edge_index]
+        definitions_count = {}
+        for instruction in instructions:
+            defined_operand = instruction.get_defined_operand()
+            if defined_operand:
+                definitions_count[defined_operand] =\
+                    definitions_count.get(defined_operand, 0) + 1
+        defined_operands = set([instruction.get_defined_operand()
+                                for instruction in body])
+        has_call = any(instruction.kind == 'call' for instruction in body)
+        invariants = []
+        invariant_operands = set()
+        is_before_branch = True
+        for instruction in body:
+            if instruction.is_branch():
+                is_before_branch = False
+            if instruction.kind not in self.hoistable_kinds:
+                continue
+            if not is_temporary_variable(instruction.result) or\
+                    definitions_count[instruction.result] != 1:
+                continue
+            if instruction.operator in self.faulting_operators and\
+                    not is_before_branch:
+                continue
+            if all(self.is_invariant_operand(operand, defined_operands,
+                                             invariant_operands, has_call)
+                   for operand in instruction.get_used_operands()):
+                invariants.append(instruction)
+                invariant_operands.add(instruction.result)
+        if not invariants:
+            return False
+        for instruction in invariants:
+            instructions.remove(instruction)
+        instructions[header_index:header_index] = invariants
+        return True
+
+    def is_invariant_operand(self, operand, defined_operands,
+                             invariant_operands, has_call):
+        if operand in invariant_operands:
+            return True
+        if operand in defined_operands:
+            return False
+        # A called function may change any global variable
+        return not has_call or is_temporary_variable(operand)
+
+
+class StrengthReduction():
+    name = 'strength-reduction'
+
+    def __init__(self, variable_types=None, temporary_variable_index=None):
+        self.variable_types = variable_types if variable_types is not None\
+            else {}
+        self.temporary_variable_index = temporary_variable_index
+
+    def get_next_temporary_variable(self):
+        name = '#T%s' % self.temporary_variable_index
+        self.temporary_variable_index += 1
+        return name
+
+    def run(self, instructions):
+        instructions = list(instructions)
+        # Other passes may have added temporaries since the last run
+        self.temporary_variable_index = max(
+            self.temporary_variable_index,
+            get_next_temporary_variable_index(instructions))
+        reduced = True
+        while reduced:
+            reduced = False
+            constants = get_constant_temporary_variables(instructions)
+            operand_types = infer_operand_types(instructions,
+                                                self.variable_types)
+            for header_index, back_edge_index in find_loops(instructions):
+                if self.reduce_induction_variables(
+                        instructions, header_index, back_edge_index,
+                        constants, operand_types):
+                    reduced = True
+                    break
+        constants = get_constant_temporary_variables(instructions)
+        operand_types = infer_operand_types(instructions, self.variable_types)
+        simplified_instructions = []
+        for instruction in instructions:
+            simplified_instructions.extend(
+                self.simplify(instruction, constants, operand_types))
+        return simplified_instructions
+
+    def get_constant_value(self, operand, constants):
+        if is_constant(operand):
+            return operand
+        return constants.get(operand)
+
+    def is_integral(self, operand, operand_types):
+        if is_constant(operand):
+            return '.' not in operand
+        return operand_types.get(operand) in ['int', 'unsigned']
+
+    def keeps_type(self, value, operand, operand_types):
+        """
+        Whether an identity with the constant value leaves the operand's
+        type as it is: "i + 0.0" is a float even if "i" is an int.
+        """
+        return '.' not in value or operand_types.get(operand) == 'float'
+
+    def reduce_induction_variables(self, instructions, header_index,
+                                   back_edge_index, constants,
+                                   operand_types):
+        """
+        Replaces "t := i * k" inside a loop whose only update of "i" is
+        "i += c" (or "i -= c") with a copy of a new variable that starts at
+        "i * k" and is incremented by "c * k" right after "i".
+        """
+        body = instructions[header_index + 1:back_edge_index]
+        # A called function may change a global induction variable
+        if any(instruction.kind == 'call' for instruction in body):
+            return False
+        body_definitions = {}
+        for instruction in body:
+            body_definitions.setdefault(instruction.get_defined_operand(),
+                                        []).append(instruction)
+        all_definitions = {}
+        for instruction in instructions:
+            all_definitions.setdefault(instruction.get_defined_operand(),
+                                       []).append(instruction)
+        induction_variables = {}
+        for instruction in body:
+            if instruction.kind != 'compound' or\
+                    instruction.operator not in ['+=', '-='] or\
+                    len(body_definitions[instruction.result]) != 1 or\
+                    not self.is_integral(instruction.result, operand_types):
+                continue
+            step = self.get_constant_value(instruction.argument1, constants)
+            if step is None or '.' in step:
+                continue
+            step = int(step) if instruction.operator == '+=' else -int(step)
+            induction_variables[instruction.result] = (instruction, step)
+        for instruction in body:
+            if instruction.kind != 'binary' or instruction.operator != '*' or\
+                    len(all_definitions[instruction.result]) != 1:
+                continue
+            if instruction.argument1 in induction_variables:
+                induction_variable = instruction.argument1
+                factor = self.get_constant_value(instruction.argument2,
+                                                 constants)
+            elif instruction.argument2 in induction_variables:
+                induction_variable = instruction.argument2
+                factor = self.get_constant_value(instruction.argument1,
+                                                 constants)
+            else:
+                continue
+            if factor is None or '.' in factor:
+                continue
+            update, step = induction_variables[induction_variable]
+            reduced_variable = self.get_next_temporary_variable()
+            increment = step * int(factor)
+            instructions[instructions.index(instruction)] = Instruction(
+                'copy', result=instruction.result, operator=':=',
+                argument1=reduced_variable)
+            update_index = instructions.index(update)
+            instructions.insert(update_index + 1, Instruction(
+                'compound', result=reduced_variable,
+                operator='+=' if increment >= 0 else '-=',
+                argument1=str(abs(increment))))
+            instructions.insert(header_index, Instruction(
+                'binary', result=reduced_variable, operator='*',
+                argument1=induction_variable, argument2=factor))
+            return True
+        return False
+
+    def simplify(self, instruction, constants, operand_types):
+        if instruction.kind == 'binary':
+            return self.simplify_binary(instruction, constants, operand_types)
+        elif instruction.kind == 'compound':
+            return self.simplify_compound(instruction, constants,
+                                          operand_types)
+        return [instruction]
+
+    def simplify_binary(self, instruction, constants, operand_types):
+        operator = instruction.operator
+        value1 = self.get_constant_value(instruction.argument1, constants)
+        value2 = self.get_constant_value(instruction.argument2, constants)
+        number1 = float(value1) if value1 is not None else None
+        number2 = float(value2) if value2 is not None else None
+
+        def copy_of(operand):
+            return [Instruction('copy', result=instruction.result,
+                                operator=':=', argument1=operand)]
+
+        # Algebraic identities
+        if ((operator in ['+', '-', '<<', '>>'] and number2 == 0) or
+                (operator in ['*', '/'] and number2 == 1)) and\
+                self.keeps_type(value2, instruction.argument1,
+                                operand_types):
+            return copy_of(instruction.argument1)
+        if ((operator == '+' and number1 == 0) or
+                (operator == '*' and number1 == 1)) and\
+                self.keeps_type(value1, instruction.argument2,
+                                operand_types):
+            return copy_of(instruction.argument2)
+        if operator == '*' and (number1 == 0 or number2 == 0) and\
+                self.is_integral(instruction.argument1, operand_types) and\
+                self.is_integral(instruction.argument2, operand_types):
+            return copy_of('0')
+
+        # Power-of-two multiplication, division and remainder
+        if operator == '*':
+            exponent = get_power_of_two_exponent(value2)
+            operand = instruction.argument1
+            if exponent is None:
+                exponent = get_power_of_two_exponent(value1)
+                operand = instruction.argument2
+            if exponent is not None and\
+                    self.is_integral(operand, operand_types):
+                return [Instruction('binary', result=instruction.result,
+                                    operator='<<', argument1=operand,
+                                    argument2=str(exponent))]
+            return [instruction]
+        if operator in ['/', '%']:
+            exponent = get_power_of_two_exponent(value2)
+            operand = instruction.argument1
+            if exponent is None or\
+                    not self.is_integral(operand, operand_types):
+                return [instruction]
+            if operand_types.get(operand) == 'unsigned':
+                if operator == '/':
+                    return [Instruction('binary', result=instruction.result,
+                                        operator='>>', argument1=operand,
+                                        argument2=str(exponent))]
+                return [Instruction('binary', result=instruction.result,
+                                    operator='&', argument1=operand,
+                                    argument2=str((1 << exponent) - 1))]
+            return self.generate_signed_division(instruction, operand,
+                                                 exponent)
+        return [instruction]
+
+    def generate_signed_division(self, instruction, operand, exponent):
+        """
+        C division truncates towards zero, so negative dividends are biased
+        by 2^k - 1 before being shifted (or masked, for the remainder).
+        """
+        is_negative = self.get_next_temporary_variable()
+        sign_mask = self.get_next_temporary_variable()
+        bias = self.get_next_temporary_variable()
+        biased_operand = self.get_next_temporary_variable()
+        reduced_code = [
+            Instruction('binary', result=is_negative, operator='<',
+                        argument1=operand, argument2='0'),
+            Instruction('unary', result=sign_mask, operator='-',
+                        argument1=is_negative),
+            Instruction('binary', result=bias, operator='&',
+                        argument1=sign_mask,
+                        argument2=str((1 << exponent) - 1)),
+            Instruction('binary', result=biased_operand, operator='+',
+                        argument1=operand, argument2=bias)
+        ]
+        if instruction.operator == '/':
+            reduced_code.append(Instruction(
+                'binary', result=instruction.result, operator='>>',
+                argument1=biased_operand, argument2=str(exponent)))
+        else:
+            quotient_part = self.get_next_temporary_variable()
+            reduced_code.append(Instruction(
+                'binary', result=quotient_part, operator='&',
+                argument1=biased_operand, argument2=str(-(1 << exponent))))
+            reduced_code.append(Instruction(
+                'binary', result=instruction.result, operator='-',
+                argument1=operand, argument2=quotient_part))
+        return reduced_code
+
+    def simplify_compound(self, instruction, constants, operand_types):
+        operator = instruction.operator
+        value = self.get_constant_value(instruction.argument1, constants)
+        number = float(value) if value is not None else None
+        if (operator in ['+=', '-=', '<<=', '>>=', '|=', '^='] and
+                number == 0) or (operator in ['*=', '/='] and number == 1):
+            return []
+        exponent = get_power_of_two_exponent(value)
+        if exponent is None or\
+                not self.is_integral(instruction.result, operand_types):
+            return [instruction]
+        if operator == '*=':
+            return [Instruction('compound', result=instruction.result,
+                                operator='<<=', argument1=str(exponent))]
+        if operand_types.get(instruction.result) == 'unsigned':
+            if operator == '/=':
+                return [Instruction('compound', result=instruction.result,
+                                    operator='>>=', argument1=str(exponent))]
+            if operator == '%=':
+                return [Instruction('compound', result=instruction.result,
+                                    operator='&=',
+                                    argument1=str((1 << exponent) - 1))]
+        return [instruction]
+
+
+class FunctionInlining():
+    name = 'function-inlining'
+
+    def __init__(self, variable_types=None, temporary_variable_index=None,
+                 label_index=None, function_locals=None,
+                 function_summaries=None, max_size=INLINING_MAX_SIZE):
+        self.variable_types = variable_types if variable_types is not None\
+            else {}
+        self.temporary_variable_index = temporary_variable_index
+        self.label_index = label_index
+        # Localized parameters and locals of each function, by function name
+        self.function_locals = function_locals\
+            if function_locals is not None else {}
+        # (contains call, instruction count) of each function, by name
+        self.function_summaries = function_summaries\
+            if function_summaries is not None else {}
+        self.max_size = max_size
+
+    def get_next_temporary_variable(self):
+        name = '#T%s' % self.temporary_variable_index
+        self.temporary_variable_index += 1
+        return name
+
+    def get_next_label(self):
+        name = '#LB%s' % self.label_index
+        self.label_index += 1
+        return name
+
+    def run(self, instructions):
+        self.temporary_variable_index = max(
+            self.temporary_variable_index,
+            get_next_temporary_variable_index(instructions))
+        self.label_index = max(self.label_index,
+                               get_next_label_index(instructions))
+        functions = find_functions(instructions)
+        operand_types = infer_operand_types(instructions,
+                                            self.variable_types)
+        # The summaries describe the code of the analyser, so they only hold
+        # on the first run
+        function_summaries = self.function_summaries
+        self.function_summaries = {}
+        callees = {}
+        for name, start, end in functions:
+            body = instructions[start + 1:end]
+            contains_call, instruction_count = function_summaries.get(
+                name, (False, None))
+            # Calls another function, as long as the body is still the one
+            # summarised, so it need not be scanned
+            if contains_call and instruction_count == len(body):
+                continue
+            if self.is_inlinable(name, body, operand_types):
+                callees[name] = body
+        if not callees:
+            return instructions
+        inlined_instructions = list(instructions[:functions[0][1]])
+        for name, start, end in functions:
+            inlined_instructions.append(instructions[start])
+            inlined_instructions.extend(self.inline_calls(
+                instructions[start + 1:end], callees, operand_types))
+        return inlined_instructions
+
+    def is_local(self, operand, name):
+        return operand in self.function_locals.get(name, ())
+
+    def is_conversion_free(self, variable, value, operand_types):
+        """
+        Whether storing the value in the variable keeps its type category.
+        The locals of an inlined function become temporaries of the caller,
+        which have no type to convert the values stored in them to.
+        """
+        variable_type = get_type_category(self.variable_types.get(variable))
+        if is_constant(value):
+            value_type = 'float' if '.' in value else 'int'
+        else:
+            value_type = operand_types.get(value)
+        if variable_type == 'float':
+            return value_type == 'float'
+        return variable_type is not None and\
+            value_type in ['int', 'unsigned']
+
+    def is_inlinable(self, name, body, operand_types):
+        # Leaf functions are never recursive
+        if name in ARDUINO_FUNCTIONS:
+            return False
+        size = 0
+        for instruction in body:
+            if instruction.kind in ['call', 'param']:
+                return False
+            if instruction.kind not in ['label', 'load_parameter']:
+                size += 1
+            if not self.is_local(instruction.get_defined_operand(), name):
+                continue
+            if instruction.kind in ['unary', 'binary'] or\
+                    (instruction.kind in ['copy', 'compound'] and
+                     not self.is_conversion_free(instruction.result,
+                                                 instruction.argument1,
+                                                 operand_types)):
+                return False
+        return size <= self.max_size
+
+    def inline_calls(self, instructions, callees, operand_types):
+        # The param instructions of each call that can be inlined
+        call_parameters = {}
+        pending_parameters = []
+        for index, instruction in enumerate(instructions):
+            if instruction.kind == 'param':
+                pending_parameters.append(index)
+            elif instruction.kind == 'label':
+                # Only the parameters of a straight run of code are known
+                pending_parameters = []
+            elif instruction.kind == 'call':
+                count = int(instruction.argument2)
+                if count > len(pending_parameters):
+                    pending_parameters = []
+                    continue
+                parameters = pending_parameters[
+                    len(pending_parameters) - count:]
+                del pending_parameters[len(pending_parameters) - count:]
+                if instruction.argument1 in callees and\
+                        self.has_conversion_free_arguments(
+                            callees[instruction.argument1],
+                            [instructions[parameter].argument1
+                             for parameter in parameters],
+                            operand_types):
+                    call_parameters[index] = parameters
+        if not call_parameters:
+            return instructions
+        parameter_copies = {}
+        inlined_code = {}
+        for index, parameters in call_parameters.items():
+            call = instructions[index]
+            copies, code = self.rename_body(call, callees[call.argument1])
+            for position, parameter in enumerate(parameters):
+                if position in copies:
+                    parameter_copies[parameter] = Instruction(
+                        'copy', result=copies[position], operator=':=',
+                        argument1=instructions[parameter].argument1)
+                else:
+                    parameter_copies[parameter] = None
+            inlined_code[index] = code
+        inlined_instructions = []
+        for index, instruction in enumerate(instructions):
+            if index in inlined_code:
+                inlined_instructions.extend(inlined_code[index])
+            elif index in parameter_copies:
+                if parameter_copies[index] is not None:
+                    inlined_instructions.append(parameter_copies[index])
+            else:
+                inlined_instructions.append(instruction)
+        return inlined_instructions
+
+    def has_conversion_free_arguments(self, body, arguments, operand_types):
+        for instruction in body:
+            if instruction.kind == 'load_parameter':
+                position = int(instruction.argument1)
+                if position >= len(arguments) or\
+                        not self.is_conversion_free(instruction.result,
+                                                    arguments[position],
+                                                    operand_types):
+                    return False
+        return True
+
+    def rename_body(self, call, body):
+        """
+        Returns the copy of the body for the call, with new temporaries for
+        its locals and temporaries and new labels, where each return stores
+        the result and jumps to the end. The parameters are returned apart,
+        by position, as they are copied where they are passed.
+        """
+        name = call.argument1
+        names = {}
+
+        def rename(operand):
+            if operand is None or is_constant(operand):
+                return operand
+            if is_temporary_variable(operand) or self.is_local(operand, name):
+                if operand not in names:
+                    names[operand] = self.get_next_temporary_variable()
+                return names[operand]
+            return operand
+
+        labels = {}
+
+        def rename_label(label):
+            if label not in labels:
+                labels[label] = self.get_next_label()
+            return labels[label]
+
+        end_label = self.get_next_label()
+        parameters = {}
+        code = []
+        for position, instruction in enumerate(body):
+            if instruction.kind == 'load_parameter':
+                parameters[int(instruction.argument1)] =\
+                    rename(instruction.result)
+                continue
+            if instruction.kind == 'return':
+                code.append(Instruction('copy', result=call.result,
+                                        operator=':=',
+                                        argument1=rename(
+                                            instruction.argument1)))
+                if position < len(body) - 1:
+                    code.append(Instruction('goto', target=end_label))
+                continue
+            renamed_instruction = instruction.copy()
+            if instruction.kind == 'copy':
+                renamed_instruction.operator = ':='
+            renamed_instruction.result = rename(instruction.result)
+            renamed_instruction.argument1 = rename(instruction.argument1)
+            renamed_instruction.argument2 = rename(instruction.argument2)
+            if instruction.kind == 'label' or instruction.kind == 'goto' or\
+                    instruction.kind.startswith('if_'):
+                renamed_instruction.target = rename_label(instruction.target)
+            elif instruction.kind == 'jump_table':
+                renamed_instruction.targets = [
+                    rename_label(target) for target in instruction.targets]
+            code.append(renamed_instruction)
+        if any(instruction.target == end_label for instruction in code):
+            code.append(Instruction('label', target=end_label))
+        return parameters, code
+
+
+class LoopUnrolling():
+    name = 'loop-unrolling'
+
+    def __init__(self, variable_types=None, temporary_variable_index=None,
+                 label_index=None, function_locals=None,
+                 max_size=UNROLLING_MAX_SIZE):
+        self.variable_types = variable_types if variable_types is not None\
+            else {}
+        self.temporary_variable_index = temporary_variable_index
+        self.label_index = label_index
+        self.function_locals = function_locals\
+            if function_locals is not None else {}
+        self.max_size = max_size
+
+    def get_next_temporary_variable(self):
+        name = '#T%s' % self.temporary_variable_index
+        self.temporary_variable_index += 1
+        return name
+
+    def get_next_label(self):
+        name = '#LB%s' % self.label_index
+        self.label_index += 1
+        return name
+
+    def run(self, instructions):
+        instructions = list(instructions)
+        self.temporary_variable_index = max(
+            self.temporary_variable_index,
+            get_next_temporary_variable_index(instructions))
+        self.label_index = max(self.label_index,
+                               get_next_label_index(instructions))
+        unrolled = True
+        while unrolled:
+            unrolled = False
+            constants = get_constant_temporary_variables(instructions)
+            # Innermost loops come first, so that the enclosing loop can be
+            # unrolled with them if it still fits.
+            for header_index, back_edge_index in find_loops(instructions):
+                if self.unroll(instructions, header_index, back_edge_index,
+                               constants):
+                    unrolled = True
+                    break
+        return instructions
+
+    def get_constant_value(self, operand, constants):
+        value = operand if is_constant(operand) else constants.get(operand)
+        if value is None or '.' in value:
+            return None
+        return int(value)
+
+    def get_function_name(self, instructions, index):
+        for instruction in reversed(instructions[:index]):
+            if instruction.kind == 'label' and\
+                    is_function_label(instruction.target):
+                return instruction.target
+        return None
+
+    def unroll(self, instructions, header_index, back_edge_index,
+               constants):
+        """
+        Unrolls a for loop in the shape generated by the analyser:
+            i = initial_value
+            header:
+            (constant loads)
+            if i >= bound goto end      (or another comparison)
+            body, ending with i += step (or #T := i + step, i = #T)
+            goto header
+            end:
+        The whole loop is unrolled if it fits in max_size instructions, and
+        otherwise its body is repeated as many times as fit and evenly
+        divide the trip count.
+        """
+        header = instructions[header_index]
+        back_edge = instructions[back_edge_index]
+        if back_edge.kind != 'goto' or back_edge_index + 1 >=\
+                len(instructions):
+            return False
+        end = instructions[back_edge_index + 1]
+        test_index = header_index + 1
+        while test_index < back_edge_index and\
+                instructions[test_index].kind == 'copy' and\
+                instructions[test_index].result in constants:
+            test_index += 1
+        test = instructions[test_index]
+        if test.kind != 'if_compare' or end.kind != 'label' or\
+                test.target != end.target:
+            return False
+        variable = test.argument1
+        bound = self.get_constant_value(test.argument2, constants)
+        if bound is None or is_constant(variable) or\
+                is_temporary_variable(variable) or\
+                get_type_category(self.variable_types.get(variable)) not in\
+                ['int', 'unsigned']:
+            return False
+        body = instructions[test_index + 1:back_edge_index]
+        step = self.get_step(variable, body, constants)
+        initial_value = self.get_initial_value(
+            instructions, header_index, variable, constants)
+        if step is None or initial_value is None:
+            return False
+        if not self.is_unrollable(instructions, header_index,
+                                  back_edge_index, body, variable):
+            return False
+        trip_count = get_trip_count(initial_value, step,
+                                    NEGATED_OPERATORS[test.operator], bound)
+        if trip_count is None or\
+                (get_type_category(self.variable_types.get(variable)) ==
+                 'unsigned' and
+                 min(initial_value, initial_value + trip_count * step) < 0):
+            return False
+        size = len([instruction for instruction in body
+                    if instruction.kind != 'label'])
+        if trip_count * size <= self.max_size:
+            unrolled_loop = instructions[header_index + 1:test_index]
+            for _ in xrange(trip_count):
+                unrolled_loop.extend(self.copy_body(instructions,
+                                                    test_index + 1,
+                                                    back_edge_index))
+            instructions[header_index:back_edge_index + 1] = unrolled_loop
+            return True
+        factor = max([factor for factor in xrange(1, trip_count + 1)
+                      if trip_count % factor == 0 and
+                      factor * size <= self.max_size] or [1])
+        if factor == 1:
+            return False
+        unrolled_body = []
+        for _ in xrange(factor):
+            unrolled_body.extend(self.copy_body(instructions,
+                                                test_index + 1,
+                                                back_edge_index))
+        instructions[test_index + 1:back_edge_index] = unrolled_body
+        return True
+
+    def get_step(self, variable, body, constants):
+        """
+        Returns the step of the update of the variable that ends the body,
+        which must be its only definition there.
+        """
+        definitions = [instruction for instruction in body
+                       if instruction.get_defined_operand() == variable]
+        if len(definitions) != 1 or not body or\
+                body[-1] is not definitions[0]:
+            return None
+        update = definitions[0]
+        if update.kind == 'compound' and update.operator in ['+=', '-=']:
+            step = self.get_constant_value(update.argument1, constants)
+            if step is not None and update.operator == '-=':
+                step = -step
+            return step
+        if update.kind != 'copy' or\
+                not is_temporary_variable(update.argument1):
+            return None
+        sums = [instruction for instruction in body
+                if instruction.get_defined_operand() == update.argument1]
+        if len(sums) != 1 or sums[0].kind != 'binary':
+            return None
+        increment = sums[0]
+        if increment.operator == '+' and increment.argument2 == variable:
+            step = self.get_constant_value(increment.argument1, constants)
+        elif increment.operator in ['+', '-'] and\
+                increment.argument1 == variable:
+            step = self.get_constant_value(increment.argument2, constants)
+            if step is not None and increment.operator == '-':
+                step = -step
+        else:
+            return None
+        return step
+
+    def get_initial_value(self, instructions, header_index, variable,
+                          constants):
+        for instruction in reversed(instructions[:header_index]):
+            if instruction.kind in ['label', 'call'] or\
+                    instruction.is_branch():
+                return None
+            if instruction.get_defined_operand() == variable:
+                if instruction.kind != 'copy':
+                    return None
+                return self.get_constant_value(instruction.argument1,
+                                               constants)
+        return None
+
+    def is_unrollable(self, instructions, header_index, back_edge_index,
+                      body, variable):
+        """
+        The body must run whole on every iteration: it cannot return, break
+        out or continue, and no code outside may jump into it. Calls could
+        change a global loop variable.
+        """
+        function_name = self.get_function_name(instructions, header_index)
+        body_labels = set(instruction.target for instruction in body
+                          if instruction.kind == 'label')
+        for instruction in body:
+            if instruction.kind == 'return':
+                return False
+            if instruction.kind == 'call' and variable not in\
+                    self.function_locals.get(function_name, ()):
+                return False
+            if any(target not in body_labels
+                   for target in instruction.get_targets()):
+                return False
+        header_label = instructions[header_index].target
+        for index, instruction in enumerate(instructions):
+            if header_index <= index <= back_edge_index:
+                continue
+            if any(target in body_labels or target == header_label
+                   for target in instruction.get_targets()):
+                return False
+        return True
+
+    def copy_body(self, instructions, body_start, body_end):
+        """
+        Copies the body with new labels, and with new temporaries for those
+        only used inside it.
+        """
+        body = instructions[body_start:body_end]
+        outside_operands = set()
+        for instruction in instructions[:body_start] +\
+                instructions[body_end:]:
+            outside_operands.update([instruction.result,
+                                     instruction.argument1,
+                                     instruction.argument2])
+        names = {}
+        for instruction in body:
+            operand = instruction.get_defined_operand()
+            if is_temporary_variable(operand) and\
+                    operand not in outside_operands and operand not in names:
+                names[operand] = self.get_next_temporary_variable()
+            if instruction.kind == 'label':
+                names[instruction.target] = self.get_next_label()
+
+        def rename(operand):
+            return names.get(operand, operand)
+
+        code = []
+        for instruction in body:
+            copied_instruction = instruction.copy()
+            copied_instruction.result = rename(instruction.result)
+            copied_instruction.argument1 = rename(instruction.argument1)
+            copied_instruction.argument2 = rename(instruction.argument2)
+            copied_instruction.target = rename(instruction.target)
+            if instruction.targets is not None:
+                copied_instruction.targets = [rename(target) for target in
+                                              instruction.targets]
+            code.append(copied_instruction)
+        return code
+
+
+def get_function_sizes(instructions, root_functions=None):
+    '''
+    Returns the (name, size, reachable) triples of the functions of the
+    program code, where the size counts the instructions after the label.
+    '''
+    functions = find_functions(instructions)
+    roots = ROOT_FUNCTIONS + list(root_functions or [])
+    if any(name in ROOT_FUNCTIONS for name, _, _ in functions):
+        reachable_functions = find_reachable_functions(
+            build_call_graph(instructions), roots)
+    else:
+        # Not a sketch, so the functions are called from somewhere else
+        reachable_functions = set(name for name, _, _ in functions)
+    return [(name, end - start - 1, name in reachable_functions)
+            for name, start, end in functions]
+
+
+def print_function_sizes(function_sizes):
+    print
+    print 'Functions'
+    print '---------'
+    print
+    for name, size, reachable in function_sizes:
+        print u'%-28s %6i %s' % (name, size, 'reachable' if reachable
+                                 else 'unreachable')
+    print
+    print u'%i of %i instructions in unreachable functions' % (
+        sum(size for _, size, reachable in function_sizes if not reachable),
+        sum(size for _, size, _ in function_sizes))
+    print
+    print '-' * 40
+
+
+class DeadFunctionElimination():
+    name = 'dead-function-elimination'
+
+    def __init__(self, root_functions=None):
+        # The functions called by the global initialisers, besides setup and
+        # loop
+        self.root_functions = root_functions
+
+    def run(self, instructions):
+        function_sizes = get_function_sizes(instructions, self.root_functions)
+        if all(reachable for _, _, reachable in function_sizes):
+            return instructions
+        reachable_functions = set(name for name, _, reachable in
+                                  function_sizes if reachable)
+        functions = find_functions(instructions)
+        live_instructions = list(instructions[:functions[0][1]])
+        for name, start, end in functions:
+            if name in reachable_functions:
+                live_instructions.extend(instructions[start:end])
+        return live_instructions
+
+
+class PassStatistics():
+    def __str__(self):
+        return u'%-28s %3i %9.3fms %6i -> %6i (%+i)' % (
+            self.name, self.iteration, self.elapsed_time * 1000,
+            self.instructions_before, self.instructions_after,
+            self.instructions_after - self.instructions_before)
+
+    def __init__(self, name, iteration, elapsed_time, instructions_before,
+                 instructions_after):
+        self.name = name
+        self.iteration = iteration
+        self.elapsed_time = elapsed_time
+        self.instructions_before = instructions_before
+        self.instructions_after = instructions_after
+
+
+class PassManager():
+    def __init__(self, passes, fixed_point=False, verify=True,
+                 max_iterations=10):
+        self.passes = passes
+        self.fixed_point = fixed_point
+        self.verify = verify
+        self.max_iterations = max_iterations
+        self.statistics = []
+
+    def run(self, instructions):
+        if self.verify:
+            verify_code(instructions)
+        iteration = 1
+        while True:
+            code_before = generate_code(instructions)
+            for optimisation_pass in self.passes:
+                instructions_before = len(instructions)
+                start_time = time.time()
+                instructions = optimisation_pass.run(instructions)
+                elapsed_time = time.time() - start_time
+                self.statistics.append(PassStatistics(
+                    optimisation_pass.name, iteration, elapsed_time,
+                    instructions_before, len(instructions)))
+                # Catches a pass that leaves the code broken right away,
+                # instead of at the execution of a later pass.
+                if self.verify:
+                    verify_code(instructions)
+            if not self.fixed_point or iteration >= self.max_iterations or\
+                    generate_code(instructions) == code_before:
+                return instructions
+            iteration += 1
+
+    def print_statistics(self):
+        print
+        print 'Optimisation Passes'
+        print '-------------------'
+        print
+        for statistics in self.statistics:
+            print statistics
+        print
+        print '-' * 40
+
+
+def get_pass_manager(optimisation_level, variable_types=None,
+                     temporary_variable_index=None, label_index=None,
+                     root_functions=None, function_locals=None,
+                     function_summaries=None):
+    """
+    -O0 runs no pass, -O1 runs each pass once and -O2 repeats them until the
+    code stops changing.
+    """
+    if optimisation_level <= 0:
+        return PassManager([])
+    passes = [
+        FunctionInlining(variable_types, temporary_variable_index,
+                         label_index, function_locals, function_summaries),
+        DeadFunctionElimination(root_functions),
+        LoopUnrolling(variable_types, temporary_variable_index, label_index,
+                      function_locals),
+        LoopInvariantCodeMotion(),
+        StrengthReduction(variable_types, temporary_variable_index)
+    ]
+    return PassManager(passes, fixed_point=optimisation_level >= 2)
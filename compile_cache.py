@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+On-disk cache of compilation results. The key is a hash of the source bytes,
+the compiler version and the options that change the output, so a file that
+did not change is never lexed or parsed again. Each entry keeps a hash of
+the headers the file included, and is only used while they are unchanged and
+no header appeared earlier in their search path.
+The cache directory is kept under a size limit by evicting the least
+recently used entries.
+'''
+
+import hashlib
+import json
+import fcntl
+import os
+import tempfile
+from support_classes import CompilationResult
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(
+    os.path.expanduser('~'), '.cache', 'arduino-c-compiler')
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+COMPILER_MODULES = [
+    'code_optimiser.py', 'intermediary_code.py', 'lexical_analyser.py',
+    'preprocessor.py', 'static_data.py', 'support_classes.py',
+    'syntactic_and_semantic_analyser.py', 'virtual_machine.py'
+]
+STATISTICS_FILE = 'statistics.json'
+STATISTICS_LOCK_FILE = 'statistics.lock'
+
+
+def get_compiler_version():
+    '''
+    Hash of the compiler modules themselves, so that any change to the
+    compiler invalidates the results it produced.
+    '''
+    version = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in COMPILER_MODULES:
+        with open(os.path.join(directory, module), 'rb') as module_file:
+            version.update(module_file.read())
+    return version.hexdigest()
+
+
+def get_file_hash(path):
+    try:
+        with open(path, 'rb') as input_file:
+            return hashlib.sha1(input_file.read()).hexdigest()
+    except IOError:
+        return None
+
+
+class CompileCache():
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY,
+                 max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.compiler_version = get_compiler_version()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def get_key(self, source, options):
+        key = hashlib.sha1()
+        key.update(self.compiler_version)
+        key.update(json.dumps(options, sort_keys=True))
+        key.update(source)
+        return key.hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.directory, '%s.json' % (key))
+
+    def get(self, key):
+        path = self.get_entry_path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = json.load(entry_file)
+            result = CompilationResult.from_dict(entry['result'])
+            dependencies = entry['dependencies'].items()
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            result = None
+        # Stale if a header changed since the result was stored
+        if result is None or any(get_file_hash(dependency) != dependency_hash
+                                 for dependency, dependency_hash in
+                                 dependencies):
+            self.misses += 1
+            self.update_statistics(0, 1, 0)
+            return None
+        # The modification time orders the entries for the LRU eviction
+        os.utime(path, None)
+        self.hits += 1
+        self.update_statistics(1, 0, 0)
+        return result
+
+    def put(self, key, result, dependencies=None, missing_files=None):
+        '''
+        Stores the result with the hashes of the files it depends on. The
+        missing files are stored without a hash, so that the result is stale
+        once they exist.
+        '''
+        hashes = dict((path, None) for path in missing_files or [])
+        hashes.update((path, get_file_hash(path))
+                      for path in dependencies or [])
+        self.write_file(self.get_entry_path(key), {
+            'result': result.to_dict(), 'dependencies': hashes})
+        evictions = self.evict()
+        self.evictions += evictions
+        if evictions:
+            self.update_statistics(0, 0, evictions)
+
+    def write_file(self, path, values):
+        # Written to a temporary file first, so that a concurrent compilation
+        # never reads half of an entry
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=self.directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as temporary_file:
+            json.dump(values, temporary_file)
+        os.rename(temporary_path, path)
+
+    def get_entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json') or name == STATISTICS_FILE:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        return sorted(entries)
+
+    def get_size(self):
+        return sum(entry[1] for entry in self.get_entries())
+
+    def evict(self):
+        entries = self.get_entries()
+        size = sum(entry[1] for entry in entries)
+        evictions = 0
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            evictions += 1
+        return evictions
+
+    def get_statistics(self):
+        try:
+            with open(os.path.join(self.directory, STATISTICS_FILE),
+                      'rb') as statistics_file:
+                return json.load(statistics_file)
+        except (IOError, ValueError):
+            return {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def lock_statistics(self):
+        '''
+        Returns the open lock file, held until it is closed, so that the
+        counts of concurrent compilations are not lost.
+        '''
+        lock_file = open(os.path.join(self.directory, STATISTICS_LOCK_FILE),
+                         'ab')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def update_statistics(self, hits, misses, evictions):
+        with self.lock_statistics():
+            statistics = self.get_statistics()
+            statistics['hits'] += hits
+            statistics['misses'] += misses
+            statistics['evictions'] += evictions
+            self.write_file(os.path.join(self.directory, STATISTICS_FILE),
+                            statistics)
+
+    def clear(self):
+        for _, _, path in self.get_entries():
+            os.remove(path)
+        with self.lock_statistics():
+            self.write_file(os.path.join(self.directory, STATISTICS_FILE),
+                            {'hits': 0, 'misses': 0, 'evictions': 0})
+
+    def print_statistics(self):
+        statistics = self.get_statistics()
+        entries = self.get_entries()
+        print
+        print 'Compilation Cache'
+        print '-----------------'
+        print
+        print 'This run: %i hit(s), %i miss(es), %i eviction(s)' %\
+            (self.hits, self.misses, self.evictions)
+        print 'Total:    %i hit(s), %i miss(es), %i eviction(s)' %\
+            (statistics['hits'], statistics['misses'],
+             statistics['evictions'])
+        print 'Entries:  %i (%i of %i bytes)' %\
+            (len(entries), sum(entry[1] for entry in entries), self.max_size)
+        print
+        print '-' * 40
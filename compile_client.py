@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Thin client for compile_server.py: takes the same arguments as program.py and
+prints the same output, but the compilation runs in the server. When no
+server is listening, or it dies before answering, the compilation runs in
+this process instead.
+
+Usage: python compile_client.py [--socket=PATH] input_file.c [options]
+       python compile_client.py [--socket=PATH] --shutdown
+'''
+
+import json
+import os
+import socket
+import sys
+import tempfile
+
+DEFAULT_SOCKET_PATH = os.path.join(
+    tempfile.gettempdir(), 'arduino-c-compiler-%i.sock' % (os.getuid()))
+
+
+def send_request(request, socket_path=DEFAULT_SOCKET_PATH):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request) + '\n')
+        response = client.makefile('rb').readline()
+    finally:
+        client.close()
+    return json.loads(response)
+
+
+def main(arguments):
+    socket_path = DEFAULT_SOCKET_PATH
+    for argument in arguments:
+        if argument.startswith('--socket='):
+            socket_path = argument[len('--socket='):]
+    arguments = [argument for argument in arguments
+                 if not argument.startswith('--socket=')]
+    if arguments == ['--shutdown']:
+        request = {'command': 'shutdown'}
+    else:
+        request = {'arguments': arguments, 'cwd': os.getcwd()}
+    try:
+        response = send_request(request, socket_path)
+    except (socket.error, ValueError):
+        # No server, or it closed the connection without a valid response
+        if request.get('command') == 'shutdown':
+            sys.exit()
+        import program
+        program.main(arguments)
+        return
+    sys.stdout.write(response['output'].encode('utf-8'))
+    sys.exit(response['status'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
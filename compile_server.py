@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Compile server: keeps the compiler loaded in a pool of worker processes and
+answers compile requests sent by compile_client.py over a local Unix socket.
+
+Each request and each response is a single line of JSON:
+    {"arguments": ["sketch.c", "--print"], "cwd": "/home/user/sketch"}
+    {"output": "OK.\n", "status": 0}
+The arguments are the same as those of program.py, and the output is what
+program.py would have printed. {"command": "ping"} and
+{"command": "shutdown"} are also accepted.
+
+Usage: python compile_server.py [--socket=PATH] [--workers=N]
+'''
+
+import errno
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import SocketServer
+import StringIO
+import sys
+import threading
+import program
+from compile_client import DEFAULT_SOCKET_PATH
+
+
+def run_program(arguments, cwd):
+    '''
+    Runs program.py in a worker process, capturing what it prints.
+    '''
+    output = StringIO.StringIO()
+    status = 0
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        os.chdir(cwd)
+        program.main(arguments)
+    except SystemExit as exit:
+        status = exit.code if isinstance(exit.code, int) else 0
+    except Exception as exception:
+        print u'Internal Error - %s' % (exception)
+        status = 2
+    finally:
+        sys.stdout = stdout
+    return output.getvalue(), status
+
+
+def ignore_interrupt():
+    # The server stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class CompileRequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # Closed without a request, as by a server checking the socket
+            return
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self.send({'output': u'Invalid request\n', 'status': 2})
+            return
+        command = request.get('command', 'compile')
+        if command == 'ping':
+            self.send({'output': u'', 'status': 0})
+        elif command == 'shutdown':
+            self.send({'output': u'', 'status': 0})
+            threading.Thread(target=self.server.shutdown).start()
+        elif command == 'compile':
+            output, status = self.server.pool.apply(
+                run_program, (request.get('arguments', []),
+                              request.get('cwd', os.getcwd())))
+            self.send({'output': output, 'status': status})
+        else:
+            self.send({'output': u'Unknown command "%s"\n' % (command),
+                       'status': 2})
+
+    def send(self, response):
+        self.wfile.write(json.dumps(response) + '\n')
+
+
+def remove_stale_socket(socket_path):
+    '''
+    Removes the socket left by a server that is no longer running. Returns
+    False if a server still listens on it.
+    '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error as error:
+        if error.errno == errno.ECONNREFUSED:
+            os.remove(socket_path)
+        return True
+    finally:
+        client.close()
+    return False
+
+
+class CompileServer(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, workers=None):
+        if not remove_stale_socket(socket_path):
+            raise socket.error(errno.EADDRINUSE, 'Server already running')
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               CompileRequestHandler)
+        self.socket_path = socket_path
+        self.pool = multiprocessing.Pool(workers, ignore_interrupt)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def main(arguments):
+    socket_path = DEFAULT_SOCKET_PATH
+    workers = None
+    for argument in arguments:
+        if argument.startswith('--socket='):
+            socket_path = argument[len('--socket='):]
+        elif argument.startswith('--workers='):
+            workers = int(argument[len('--workers='):])
+        else:
+            print 'Usage: python compile_server.py [--socket=PATH]'\
+                ' [--workers=N]'
+            sys.exit(1)
+    try:
+        server = CompileServer(socket_path, workers)
+    except socket.error as error:
+        print '%s: %s' % (socket_path, error.strerror)
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit())
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
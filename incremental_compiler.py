@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Incremental compilation at top-level definition granularity. The source is
+split into definition units, each one holding its tokens, the C3E generated
+for it and the global symbols it declared. When the source changes, only the
+units whose lines were touched are lexed and parsed again; the other units
+keep their tokens, code and temporary variable and label numbering.
+
+The lexer never produces a token that spans more than one line, so any range
+of whole lines can be lexed on its own. The lines up to the last directive
+are run through the preprocessor whenever they change, and the macros they
+leave are expanded in each range of lines lexed after them.
+'''
+
+from lexical_analyser import LexicalAnalyser
+from preprocessor import Preprocessor, get_directives_end, is_directive
+from support_classes import (CompilationStoppedError, PanicModeError,
+                             Production, StandaloneCodeManager)
+from syntactic_and_semantic_analyser import SyntacticAndSemanticAnalyser
+
+
+class CompilationCancelledError(Exception):
+    pass
+
+
+class DefinitionUnit():
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.first_line = tokens[0].line
+        self.last_line = tokens[-1].line
+        self.code = []
+        self.definitions_code = []
+        self.symbols = {}
+        self.errors = []
+        self.warnings = []
+
+    def shift_lines(self, delta):
+        for token in self.tokens:
+            token.line += delta
+        self.first_line += delta
+        self.last_line += delta
+
+    def get_signature(self):
+        signature = []
+        for identifier, symbol in sorted(self.symbols.items()):
+            parameters = [(parameter.identifier, parameter.defined_type)
+                          for parameter in
+                          symbol.parameters.elements.values()]\
+                if symbol.is_function and symbol.parameters is not None\
+                else []
+            signature.append((identifier, symbol.defined_type,
+                              symbol.is_function, parameters))
+        return signature
+
+
+def split_definition_units(tokens):
+    '''
+    Splits the token stream at the end of each top-level definition: a
+    semicolon or a closing curly bracket outside of any block. Definitions
+    sharing a line are kept in the same unit, so units never share a line.
+    Returns None if the tokens do not end at the end of a definition.
+    '''
+    units_tokens = []
+    unit_tokens = []
+    depth = 0
+    for token in tokens:
+        unit_tokens.append(token)
+        if token.token_type == u'T_CURLY_BRACKET_OPEN':
+            depth += 1
+        elif token.token_type == u'T_CURLY_BRACKET_CLOSE':
+            depth -= 1
+            if depth < 0:
+                return None
+        if depth == 0 and token.token_type in [u'T_SEMICOLON',
+                                               u'T_CURLY_BRACKET_CLOSE']:
+            if units_tokens and\
+                    units_tokens[-1][-1].line == unit_tokens[0].line:
+                units_tokens[-1].extend(unit_tokens)
+            else:
+                units_tokens.append(unit_tokens)
+            unit_tokens = []
+    if unit_tokens:
+        return None
+    return [DefinitionUnit(unit_tokens) for unit_tokens in units_tokens]
+
+
+class IncrementalCompiler():
+    def __init__(self, max_errors=1, exit_on_error=True, file_path=None,
+                 include_paths=None, is_cancelled=None):
+        self.max_errors = max_errors
+        self.exit_on_error = exit_on_error
+        # Where the quoted #include are searched from
+        self.file_path = file_path if file_path is not None else u'sketch.c'
+        self.include_paths = include_paths
+        # Checked between the units, to give up a compilation that is no
+        # longer needed
+        self.is_cancelled = is_cancelled if is_cancelled is not None\
+            else lambda: False
+        self.lines = []
+        self.units = []
+        self.analyser = None
+        self.preprocessor = None
+        self.directives_end = 0
+        self.parsed_units = 0
+
+    def lex_lines(self, lines, first_line):
+        tokens = LexicalAnalyser(None, lines).get_tokens()
+        for token in tokens:
+            token.line += first_line
+        return self.preprocessor.expand(tokens)
+
+    def compile(self, lines):
+        '''
+        Compiles the whole source, given as a list of lines.
+        '''
+        self.lines = list(lines)
+        self.analyser = SyntacticAndSemanticAnalyser([], self.max_errors)
+        self.analyser.exit_on_error = self.exit_on_error
+        self.parsed_units = 0
+        self.units = []
+        self.directives_end = get_directives_end(self.lines)
+        self.preprocessor = Preprocessor(self.include_paths)
+        tokens = self.preprocessor.get_text_tokens(
+            self.file_path, self.lines[:self.directives_end]) +\
+            self.lex_lines(self.lines[self.directives_end:],
+                           self.directives_end)
+        units = split_definition_units(tokens)
+        if units is None:
+            # Let the analyser report the unfinished definition
+            units = [DefinitionUnit(tokens)]
+        if tokens:
+            try:
+                self.parse_units(units)
+            except CompilationCancelledError:
+                # Kept as the compilation of the lines parsed so far, which
+                # the next update carries on from
+                self.units = units[:self.parsed_units]
+                self.lines = self.lines[:self.units[-1].last_line + 1]\
+                    if self.units else []
+                raise
+            self.units = units
+        return self.get_program()
+
+    def update(self, lines):
+        '''
+        Compiles the source again after a change, parsing only the
+        definition units whose lines were touched.
+        '''
+        lines = list(lines)
+        if self.analyser is None or not self.units:
+            return self.compile(lines)
+        old_lines = self.lines
+        prefix = 0
+        while prefix < min(len(old_lines), len(lines)) and\
+                old_lines[prefix] == lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < min(len(old_lines), len(lines)) - prefix and\
+                old_lines[-suffix - 1] == lines[-suffix - 1]:
+            suffix += 1
+        if prefix == len(old_lines) == len(lines):
+            return self.get_program()
+        delta = len(lines) - len(old_lines)
+        # The touched units, widened to the lines between their neighbours
+        first_unit = 0
+        while first_unit < len(self.units) and\
+                self.units[first_unit].last_line < prefix:
+            first_unit += 1
+        last_unit = first_unit
+        while last_unit < len(self.units) and\
+                self.units[last_unit].first_line < len(old_lines) - suffix:
+            last_unit += 1
+        # The macros of the lines after the directives come from them, so a
+        # change to the directives or to a unit among them starts over
+        if prefix < self.directives_end or\
+                (first_unit < len(self.units) and
+                 self.units[first_unit].first_line < self.directives_end) or\
+                any(is_directive(line)
+                    for line in lines[prefix:len(lines) - suffix]):
+            return self.compile(lines)
+        first_line = max(self.units[first_unit - 1].last_line + 1
+                         if first_unit > 0 else 0, self.directives_end)
+        last_line = self.units[last_unit].first_line\
+            if last_unit < len(self.units) else len(old_lines)
+        tokens = self.lex_lines(lines[first_line:last_line + delta],
+                                first_line)
+        units = split_definition_units(tokens)
+        if units is None:
+            return self.compile(lines)
+        old_units = self.units[first_unit:last_unit]
+        later_units = self.units[last_unit:]
+        self.analyser.symbols_table.elements = {}
+        for unit in self.units[:first_unit]:
+            self.analyser.symbols_table.elements.update(unit.symbols)
+        try:
+            self.parse_units(units)
+        except CompilationCancelledError:
+            # Back to the state of the units kept
+            self.analyser.symbols_table.elements = {}
+            for unit in self.units:
+                self.analyser.symbols_table.elements.update(unit.symbols)
+            self.get_program()
+            raise
+        if later_units and not self.are_declarations_compatible(
+                old_units, units, later_units):
+            # The later units may depend on the declarations that changed
+            return self.compile(lines)
+        for unit in later_units:
+            unit.shift_lines(delta)
+            self.analyser.symbols_table.elements.update(unit.symbols)
+        self.units = self.units[:first_unit] + units + later_units
+        self.lines = lines
+        return self.get_program()
+
+    def are_declarations_compatible(self, old_units, new_units, later_units):
+        '''
+        The later units can be kept if every declaration they could have
+        used is still there, unchanged, and none of the new declarations
+        clashes with theirs. A later unit with errors may have been missing
+        one of the new declarations, so it is never kept.
+        '''
+        old_signature = sum([unit.get_signature() for unit in old_units], [])
+        new_signature = sum([unit.get_signature() for unit in new_units], [])
+        if any(declaration not in new_signature
+               for declaration in old_signature):
+            return False
+        for unit in later_units:
+            if unit.errors or any(declaration[0] in unit.symbols
+                                  for declaration in new_signature):
+                return False
+        return True
+
+    def parse_units(self, units):
+        for unit in units:
+            if self.is_cancelled():
+                raise CompilationCancelledError()
+            self.parse_unit(unit)
+
+    def parse_unit(self, unit):
+        analyser = self.analyser
+        analyser.tokens_list = unit.tokens
+        analyser.token_index = 0
+        analyser.definitions_code = StandaloneCodeManager()
+        symbols_before = set(analyser.symbols_table.elements.keys())
+        errors_before = len(analyser.errors)
+        warnings_before = len(analyser.warnings)
+        try:
+            program = analyser.check_program()
+            if analyser.token_index != len(unit.tokens):
+                analyser.set_syntactic_error(
+                    u'definition', unit.tokens[analyser.token_index])
+        except (CompilationStoppedError, PanicModeError):
+            # The errors were recorded in the analyser
+            program = Production()
+        unit.code = program.code
+        unit.definitions_code = analyser.definitions_code.code
+        unit.symbols = dict(
+            (identifier, symbol) for identifier, symbol in
+            analyser.symbols_table.elements.items()
+            if identifier not in symbols_before)
+        unit.errors = analyser.errors[errors_before:]
+        unit.warnings = analyser.warnings[warnings_before:]
+        self.parsed_units += 1
+
+    def get_program(self):
+        '''
+        Rebuilds the analyser state for the whole source out of the units:
+        returns the program Production and leaves the global initialisers,
+        errors and warnings in the analyser, as a full compilation would.
+        '''
+        program = Production()
+        self.analyser.tokens_list = []
+        self.analyser.definitions_code = StandaloneCodeManager()
+        self.analyser.errors = []
+        self.analyser.warnings = []
+        # Extended in place: append_code copies the whole list every time
+        for unit in self.units:
+            self.analyser.tokens_list.extend(unit.tokens)
+            program.code.extend(unit.code)
+            self.analyser.definitions_code.code.extend(unit.definitions_code)
+            self.analyser.errors.extend(unit.errors)
+            self.analyser.warnings.extend(unit.warnings)
+        self.analyser.error = self.analyser.errors[-1]\
+            if self.analyser.errors else None
+        self.analyser.token_index = len(self.analyser.tokens_list)
+        return program
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Structured view of the C3E lines generated by the syntactic and semantic
+analyser. These are the forms that the analyser emits:
+    name:                       Function label
+    #LBn :                      Internal label
+    goto L
+    goto [L0, L1, L2] i         Jump table, indexed from 0
+    if a = 0 goto L
+    if a != 0 goto L
+    if a < b goto L             (and the other relational and equality
+                                operators)
+    param a
+    return a, n                 (or "return a" for the implicit return)
+    a := call f, n
+    a := param[i]
+    a := b                      (also "a = b" for attribution commands)
+    a += b                      (and the other compound attributions)
+    a := - b
+    a := b + c
+'''
+
+
+class IntermediaryCodeError(Exception):
+    def __str__(self):
+        return u'Intermediary Code Error - %s' % (self.message)
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+class Instruction():
+    def __init__(self, kind, result=None, operator=None, argument1=None,
+                 argument2=None, target=None, targets=None):
+        self.kind = kind
+        self.result = result
+        self.operator = operator
+        self.argument1 = argument1
+        self.argument2 = argument2
+        self.target = target
+        self.targets = targets
+
+    def __str__(self):
+        if self.kind == 'label':
+            if is_function_label(self.target):
+                return '%s:' % (self.target)
+            return '%s :' % (self.target)
+        elif self.kind == 'goto':
+            return 'goto %s' % (self.target)
+        elif self.kind == 'jump_table':
+            return 'goto [%s] %s' % (', '.join(self.targets), self.argument1)
+        elif self.kind == 'if_false':
+            return 'if %s = 0 goto %s' % (self.argument1, self.target)
+        elif self.kind == 'if_true':
+            return 'if %s != 0 goto %s' % (self.argument1, self.target)
+        elif self.kind == 'if_compare':
+            return 'if %s %s %s goto %s' % (self.argument1, self.operator,
+                                            self.argument2, self.target)
+        elif self.kind == 'param':
+            return 'param %s' % (self.argument1)
+        elif self.kind == 'return':
+            if self.argument2 is not None:
+                return 'return %s, %s' % (self.argument1, self.argument2)
+            return 'return %s' % (self.argument1)
+        elif self.kind == 'call':
+            return '%s := call %s, %s' % (self.result, self.argument1,
+                                          self.argument2)
+        elif self.kind == 'load_parameter':
+            return '%s := param[%s]' % (self.result, self.argument1)
+        elif self.kind in ['copy', 'compound']:
+            return '%s %s %s' % (self.result, self.operator, self.argument1)
+        elif self.kind == 'unary':
+            return '%s := %s %s' % (self.result, self.operator,
+                                    self.argument1)
+        return '%s := %s %s %s' % (self.result, self.argument1,
+                                   self.operator, self.argument2)
+
+    def copy(self):
+        return Instruction(self.kind, self.result, self.operator,
+                           self.argument1, self.argument2, self.target,
+                           self.targets)
+
+    def get_used_operands(self):
+        if self.kind in ['if_false', 'if_true', 'jump_table', 'param',
+                         'return', 'copy', 'unary']:
+            operands = [self.argument1]
+        elif self.kind == 'compound':
+            operands = [self.result, self.argument1]
+        elif self.kind in ['binary', 'if_compare']:
+            operands = [self.argument1, self.argument2]
+        else:
+            operands = []
+        return [operand for operand in operands if not is_constant(operand)]
+
+    def get_defined_operand(self):
+        if self.kind in ['call', 'load_parameter', 'copy', 'compound',
+                         'unary', 'binary']:
+            return self.result
+        return None
+
+    def is_branch(self):
+        return self.kind in ['goto', 'if_false', 'if_true', 'if_compare',
+                             'jump_table']
+
+    def get_targets(self):
+        if self.kind == 'jump_table':
+            return self.targets
+        elif self.is_branch():
+            return [self.target]
+        return []
+
+
+def is_constant(operand):
+    try:
+        float(operand)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def is_temporary_variable(operand):
+    return operand is not None and operand.startswith('#T')
+
+
+def is_function_label(label):
+    return not label.startswith('#')
+
+
+def parse_instruction(line):
+    parts = line.split()
+    if line.endswith(':'):
+        return Instruction('label', target=line[:-1].strip())
+    elif parts[0] == 'goto' and len(parts) == 2:
+        return Instruction('goto', target=parts[1])
+    elif parts[0] == 'goto' and parts[1].startswith('['):
+        targets = ' '.join(parts[1:-1])
+        return Instruction('jump_table', argument1=parts[-1],
+                           targets=targets[1:-1].split(', '))
+    elif parts[0] == 'if' and len(parts) == 6 and parts[2] == '=':
+        return Instruction('if_false', argument1=parts[1], target=parts[5])
+    elif parts[0] == 'if' and len(parts) == 6 and parts[2:4] == ['!=', '0']:
+        return Instruction('if_true', argument1=parts[1], target=parts[5])
+    elif parts[0] == 'if' and len(parts) == 6 and parts[4] == 'goto':
+        return Instruction('if_compare', operator=parts[2],
+                           argument1=parts[1], argument2=parts[3],
+                           target=parts[5])
+    elif parts[0] == 'param' and len(parts) == 2:
+        return Instruction('param', argument1=parts[1])
+    elif parts[0] == 'return' and len(parts) == 3:
+        return Instruction('return', argument1=parts[1].rstrip(','),
+                           argument2=parts[2])
+    elif parts[0] == 'return' and len(parts) == 2:
+        return Instruction('return', argument1=parts[1])
+    elif len(parts) == 5 and parts[2] == 'call':
+        return Instruction('call', result=parts[0],
+                           argument1=parts[3].rstrip(','), argument2=parts[4])
+    elif len(parts) == 3 and parts[2].startswith('param['):
+        return Instruction('load_parameter', result=parts[0],
+                           argument1=parts[2][len('param['):-1])
+    elif len(parts) == 3 and parts[1] in [':=', '=']:
+        return Instruction('copy', result=parts[0], operator=parts[1],
+                           argument1=parts[2])
+    elif len(parts) == 3:
+        return Instruction('compound', result=parts[0], operator=parts[1],
+                           argument1=parts[2])
+    elif len(parts) == 4:
+        return Instruction('unary', result=parts[0], operator=parts[2],
+                           argument1=parts[3])
+    elif len(parts) == 5:
+        return Instruction('binary', result=parts[0], operator=parts[3],
+                           argument1=parts[2], argument2=parts[4])
+    raise IntermediaryCodeError(u'Invalid C3E instruction: "%s"' % (line))
+
+
+def parse_code(code):
+    return [parse_instruction(line) for line in code]
+
+
+def generate_code(instructions):
+    return [str(instruction) for instruction in instructions]
+
+
+def verify_code(instructions):
+    labels = set()
+    for instruction in instructions:
+        if instruction.kind == 'label':
+            if instruction.target in labels:
+                raise IntermediaryCodeError(
+                    u'Label "%s" defined more than once' %
+                    (instruction.target))
+            labels.add(instruction.target)
+    for instruction in instructions:
+        for target in instruction.get_targets():
+            if target not in labels:
+                raise IntermediaryCodeError(u'Label "%s" not found in "%s"' %
+                                            (target, instruction))
+        operands = instruction.get_used_operands()
+        if instruction.get_defined_operand() is not None or\
+                instruction.kind in ['call', 'load_parameter', 'copy',
+                                     'compound', 'unary', 'binary']:
+            operands.append(instruction.get_defined_operand())
+        if not all(operands) or\
+                (instruction.kind in ['compound', 'unary', 'binary',
+                                      'if_compare'] and
+                 not instruction.operator):
+            raise IntermediaryCodeError(u'Incomplete instruction "%s"' %
+                                        (instruction))
+        if parse_instruction(str(instruction)).kind != instruction.kind:
+            raise IntermediaryCodeError(u'Ambiguous instruction "%s"' %
+                                        (instruction))
+
+
+def find_labels(instructions):
+    labels = {}
+    for index, instruction in enumerate(instructions):
+        if instruction.kind == 'label':
+            labels[instruction.target] = index
+    return labels
+
+
+def find_functions(instructions):
+    '''
+    Returns the (name, start_index, end_index) triples of the functions
+    found in the program code, where start_index is the function label.
+    '''
+    functions = []
+    for index, instruction in enumerate(instructions):
+        if instruction.kind == 'label' and\
+                is_function_label(instruction.target):
+            if functions:
+                functions[-1][2] = index
+            functions.append([instruction.target, index, len(instructions)])
+    return [tuple(function) for function in functions]
+
+
+def build_call_graph(instructions):
+    '''
+    Returns the functions called by each function of the program code, in
+    the order of their first call.
+    '''
+    call_graph = {}
+    for name, start, end in find_functions(instructions):
+        callees = call_graph.setdefault(name, [])
+        for instruction in instructions[start + 1:end]:
+            if instruction.kind == 'call' and\
+                    instruction.argument1 not in callees:
+                callees.append(instruction.argument1)
+    return call_graph
+
+
+def find_reachable_functions(call_graph, roots):
+    reachable_functions = set()
+    pending_functions = list(roots)
+    while pending_functions:
+        name = pending_functions.pop()
+        if name in reachable_functions:
+            continue
+        reachable_functions.add(name)
+        pending_functions.extend(call_graph.get(name, []))
+    return reachable_functions
+
+
+def find_loops(instructions):
+    '''
+    Returns the (header_index, back_edge_index) pairs of the loops generated
+    by the while, do-while and for productions: a label that is the target
+    of a later branch. The last backward branch closes the loop, since
+    continue also jumps back to the header.
+    '''
+    labels = find_labels(instructions)
+    loops = {}
+    for index, instruction in enumerate(instructions):
+        for target in instruction.get_targets():
+            if target in labels and labels[target] < index:
+                loops[labels[target]] = index
+    return sorted(loops.items(), key=lambda loop: loop[1] - loop[0])
+
+
+def get_next_label_index(instructions):
+    indexes = [-1]
+    for instruction in instructions:
+        if instruction.kind == 'label' and\
+                instruction.target.startswith('#LB'):
+            indexes.append(int(instruction.target[len('#LB'):]))
+    return max(indexes) + 1
+
+
+def get_next_temporary_variable_index(instructions):
+    indexes = [-1]
+    for instruction in instructions:
+        for operand in [instruction.result, instruction.argument1,
+                        instruction.argument2]:
+            if is_temporary_variable(operand):
+                indexes.append(int(operand[len('#T'):]))
+    return max(indexes) + 1
@@ -0,0 +1,333 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Language Server Protocol front end, over stdin and stdout. It publishes the
+errors and warnings of each open sketch as diagnostics, and answers
+go-to-definition and hover requests from the symbols table.
+
+The documents are compiled by an IncrementalCompiler each, in a background
+thread: changes are debounced, and a compilation whose document changed
+again while it ran is given up at the next definition and never published.
+Hover and go-to-definition answer from a snapshot of the last compilation, so
+they never wait for a running one.
+
+Usage: python language_server.py
+'''
+
+import bisect
+import json
+import sys
+import threading
+import urllib
+import urlparse
+from incremental_compiler import (CompilationCancelledError,
+                                  IncrementalCompiler)
+from preprocessor import PreprocessorError
+from support_classes import SymbolsTable
+
+DEBOUNCE_DELAY = 0.02
+MAX_DIAGNOSTICS = 100
+ERROR_SEVERITY = 1
+WARNING_SEVERITY = 2
+METHOD_NOT_FOUND = -32601
+
+
+def read_message(stream):
+    content_length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        if name.lower() == 'content-length':
+            content_length = int(value)
+    if content_length is None:
+        return None
+    return json.loads(stream.read(content_length))
+
+
+def write_message(stream, message):
+    body = json.dumps(message)
+    stream.write('Content-Length: %i\r\n\r\n%s' % (len(body), body))
+    stream.flush()
+
+
+def get_file_path(uri):
+    '''
+    The path of a file URI, from which the quoted #include are searched. The
+    other URIs, as those of unsaved documents, are taken as relative paths.
+    '''
+    parts = urlparse.urlparse(uri)
+    if parts.scheme == 'file':
+        return urllib.unquote(parts.path)
+    return uri
+
+
+def get_token_range(token):
+    if token is None:
+        return {'start': {'line': 0, 'character': 0},
+                'end': {'line': 0, 'character': 0}}
+    return {'start': {'line': token.line, 'character': token.column},
+            'end': {'line': token.line,
+                    'character': token.column + len(token.lexeme)}}
+
+
+class Document():
+    def __init__(self, uri, text, version):
+        self.uri = uri
+        self.lines = text.splitlines(True)
+        self.version = version
+        # Counts the changes, since the client may not send versions
+        self.revision = 0
+        self.compiling_revision = None
+        self.compiler = self.get_compiler()
+        self.lock = threading.Lock()
+        # The units and symbols table of the last compilation
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+
+    def get_compiler(self):
+        return IncrementalCompiler(MAX_DIAGNOSTICS, False,
+                                   get_file_path(self.uri),
+                                   is_cancelled=self.is_stale)
+
+    def is_stale(self):
+        return self.revision != self.compiling_revision
+
+    def compile(self, lines):
+        try:
+            self.compiler.update(lines)
+            return None
+        except CompilationCancelledError:
+            raise
+        except PreprocessorError as error:
+            self.compiler = self.get_compiler()
+            return unicode(error)
+        except Exception as exception:
+            # Start over on the next change
+            self.compiler = self.get_compiler()
+            return u'Internal Error - %r' % (exception)
+
+    def get_diagnostics(self, internal_error=None):
+        diagnostics = []
+        if internal_error:
+            diagnostics.append({'range': get_token_range(None),
+                                'severity': ERROR_SEVERITY,
+                                'message': internal_error})
+            return diagnostics
+        analyser = self.compiler.analyser
+        for error in analyser.errors:
+            diagnostics.append({'range': get_token_range(error.token),
+                                'severity': ERROR_SEVERITY,
+                                'message': error.message})
+        for warning in analyser.warnings:
+            diagnostics.append({'range': get_token_range(warning.token),
+                                'severity': WARNING_SEVERITY,
+                                'message': warning.message})
+        return diagnostics
+
+    def take_snapshot(self):
+        symbols_table = SymbolsTable()
+        symbols_table.elements = dict(
+            self.compiler.analyser.symbols_table.elements)
+        with self.snapshot_lock:
+            self.snapshot = (list(self.compiler.units), symbols_table)
+
+    def get_unit(self, units, line):
+        index = bisect.bisect_right([unit.first_line for unit in units],
+                                    line) - 1
+        if index >= 0 and units[index].last_line >= line:
+            return units[index]
+        return None
+
+    def find_symbol(self, line, character):
+        '''
+        Returns the symbol named by the identifier at the position, looked up
+        in the scope of the function around it.
+        '''
+        with self.snapshot_lock:
+            snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        units, symbols_table = snapshot
+        unit = self.get_unit(units, line)
+        if unit is None:
+            return None
+        position = (line, character)
+        token = None
+        for unit_token in unit.tokens:
+            if (unit_token.line, unit_token.column) <= position <\
+                    (unit_token.line,
+                     unit_token.column + len(unit_token.lexeme)):
+                token = unit_token
+                break
+        if token is None or\
+                token.token_type not in [u'T_ID', u'T_RESERVED_WORD']:
+            return None
+        scope = u'_global_'
+        scope_position = None
+        for identifier, symbol in unit.symbols.items():
+            if symbol.is_function and symbol.token is not None:
+                symbol_position = (symbol.token.line, symbol.token.column)
+                if symbol_position <= position and\
+                        (scope_position is None or
+                         symbol_position > scope_position):
+                    scope = identifier
+                    scope_position = symbol_position
+        return symbols_table.get(token.lexeme, scope)
+
+
+class LanguageServer():
+    def __init__(self, input_stream, output_stream):
+        self.input_stream = input_stream
+        self.output_stream = output_stream
+        self.output_lock = threading.Lock()
+        self.documents = {}
+        self.pending_documents = set()
+        self.change_count = 0
+        self.condition = threading.Condition()
+        self.shutting_down = False
+        self.compiler_thread = threading.Thread(target=self.compile_documents)
+        self.compiler_thread.daemon = True
+
+    def send(self, message):
+        with self.output_lock:
+            write_message(self.output_stream, message)
+
+    def respond(self, message, result):
+        self.send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+
+    def notify(self, method, parameters):
+        self.send({'jsonrpc': '2.0', 'method': method, 'params': parameters})
+
+    def run(self):
+        self.compiler_thread.start()
+        while True:
+            message = read_message(self.input_stream)
+            if message is None or message.get('method') == 'exit':
+                return 0 if self.shutting_down else 1
+            self.handle(message)
+
+    def handle(self, message):
+        method = message.get('method')
+        parameters = message.get('params', {})
+        if method == 'initialize':
+            self.respond(message, {'capabilities': {
+                'textDocumentSync': 1,
+                'hoverProvider': True,
+                'definitionProvider': True
+            }})
+        elif method == 'shutdown':
+            self.shutting_down = True
+            self.respond(message, None)
+        elif method == 'textDocument/didOpen':
+            document = parameters['textDocument']
+            self.documents[document['uri']] = Document(
+                document['uri'], document['text'], document.get('version'))
+            self.schedule(document['uri'])
+        elif method == 'textDocument/didChange':
+            document = self.documents.get(parameters['textDocument']['uri'])
+            if document and parameters['contentChanges']:
+                # Full synchronisation: the last change has the whole text
+                document.lines = parameters['contentChanges'][-1]['text'].\
+                    splitlines(True)
+                document.version = parameters['textDocument'].get('version')
+                document.revision += 1
+                self.schedule(document.uri)
+        elif method == 'textDocument/didClose':
+            uri = parameters['textDocument']['uri']
+            self.documents.pop(uri, None)
+            self.notify('textDocument/publishDiagnostics',
+                        {'uri': uri, 'diagnostics': []})
+        elif method == 'textDocument/hover':
+            self.respond(message, self.get_hover(parameters))
+        elif method == 'textDocument/definition':
+            self.respond(message, self.get_definition(parameters))
+        elif 'id' in message and method is not None:
+            self.send({'jsonrpc': '2.0', 'id': message['id'],
+                       'error': {'code': METHOD_NOT_FOUND,
+                                 'message': u'Unknown method "%s"' %
+                                            (method)}})
+
+    def schedule(self, uri):
+        with self.condition:
+            self.pending_documents.add(uri)
+            self.change_count += 1
+            self.condition.notify()
+
+    def compile_documents(self):
+        while True:
+            with self.condition:
+                while not self.pending_documents:
+                    self.condition.wait()
+                # Wait until the changes stop coming
+                change_count = None
+                while change_count != self.change_count:
+                    change_count = self.change_count
+                    self.condition.wait(DEBOUNCE_DELAY)
+                uris = self.pending_documents
+                self.pending_documents = set()
+            for uri in uris:
+                self.compile_document(uri)
+
+    def compile_document(self, uri):
+        document = self.documents.get(uri)
+        if document is None:
+            return
+        with document.lock:
+            revision = document.revision
+            version = document.version
+            document.compiling_revision = revision
+            try:
+                internal_error = document.compile(document.lines)
+            except CompilationCancelledError:
+                # The document changed again and is already pending
+                return
+            if internal_error is None:
+                document.take_snapshot()
+            diagnostics = document.get_diagnostics(internal_error)
+        if document.revision != revision or uri not in self.documents:
+            # Stale: the document changed again and is already pending
+            return
+        self.notify('textDocument/publishDiagnostics',
+                    {'uri': uri, 'version': version,
+                     'diagnostics': diagnostics})
+
+    def find_symbol(self, parameters):
+        document = self.documents.get(parameters['textDocument']['uri'])
+        if document is None:
+            return None
+        position = parameters['position']
+        return document.find_symbol(position['line'], position['character'])
+
+    def get_hover(self, parameters):
+        symbol = self.find_symbol(parameters)
+        if symbol is None:
+            return None
+        if getattr(symbol, 'is_function', False):
+            text = u'%s %s(%s)' % (symbol.defined_type, symbol.identifier,
+                                   symbol.parameters
+                                   if symbol.parameters is not None else '')
+        else:
+            text = u'%s %s' % (symbol.defined_type, symbol.identifier)
+        return {'contents': {'kind': 'plaintext', 'value': text}}
+
+    def get_definition(self, parameters):
+        symbol = self.find_symbol(parameters)
+        if symbol is None or symbol.token is None:
+            return None
+        return {'uri': parameters['textDocument']['uri'],
+                'range': get_token_range(symbol.token)}
+
+
+def main():
+    server = LanguageServer(sys.stdin, sys.stdout)
+    sys.exit(server.run())
+
+
+if __name__ == '__main__':
+    main()
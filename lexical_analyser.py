@@ -1,6 +1,21 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import marshal
+import os
+from array import array
+
+TOKENS_FORMAT = 'arduino-c-tokens'
+TOKENS_FORMAT_VERSION = 1
+
+class TokensFormatError(Exception):
+    def __str__(self):
+        return u'Tokens Format Error - %s' % (self.message)
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+
 class Token():
     def __str__(self):
         return u'%s - "%s" (%i, %i)' % (self.token_type, self.lexeme,
@@ -13,8 +28,9 @@ class Token():
         self.column = column
 
 class FileManager():
-    def __init__(self, file_path):
-        self.content = self.read_file_content(file_path)
+    def __init__(self, file_path, content=None):
+        self.content = content if content is not None else\
+            self.read_file_content(file_path)
         self.line = 0
         self.column = 0
 
@@ -55,11 +71,11 @@ class FileManager():
         self.column = column
 
 class LexicalAnalyser():
-    def __init__(self, input_file):
+    def __init__(self, input_file, content=None):
         self.content = None
         self.current_position = 0
         self.generated_tokens = []
-        self.file_manager = FileManager(input_file)
+        self.file_manager = FileManager(input_file, content)
         self.possible_tokens = self.get_list_of_tokens()
         self.reserved_words = self.get_list_of_reserved_words()
 
@@ -429,3 +445,81 @@ class LexicalAnalyser():
 
     def process_blank(self, line, column):
         return
+
+def dump_tokens(tokens):
+    """
+    Serializes the tokens to a binary string. Token types and lexemes are
+    stored once, in a table of strings, and each token field becomes an
+    array of integers, so that loading needs no parsing per token.
+    """
+    strings = []
+    string_indexes = {}
+    def get_string_index(string):
+        key = (type(string), string)
+        if key not in string_indexes:
+            string_indexes[key] = len(strings)
+            strings.append(string)
+        return string_indexes[key]
+    token_types = array('i', [get_string_index(token.token_type)
+        for token in tokens])
+    lexemes = array('i', [get_string_index(token.lexeme)
+        for token in tokens])
+    lines = array('i', [token.line for token in tokens])
+    columns = array('i', [token.column for token in tokens])
+    return marshal.dumps((TOKENS_FORMAT, TOKENS_FORMAT_VERSION, strings,
+        token_types.tostring(), lexemes.tostring(), lines.tostring(),
+        columns.tostring()))
+
+def load_tokens(data):
+    try:
+        tokens_format, version, strings, token_types, lexemes, lines,\
+            columns = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        raise TokensFormatError(u'Invalid tokens data')
+    if tokens_format != TOKENS_FORMAT or version != TOKENS_FORMAT_VERSION:
+        raise TokensFormatError(u'Unsupported tokens format "%s" version %s' %
+            (tokens_format, version))
+    fields = []
+    for field in [token_types, lexemes, lines, columns]:
+        values = array('i')
+        try:
+            values.fromstring(field)
+        except (ValueError, TypeError):
+            raise TokensFormatError(u'Invalid tokens data')
+        fields.append(values)
+    if not isinstance(strings, list) or any(index < 0 or
+            index >= len(strings) for field in fields[:2] for index in field):
+        raise TokensFormatError(u'Invalid string index in tokens data')
+    return map(Token, map(strings.__getitem__, fields[0]),
+        map(strings.__getitem__, fields[1]), fields[2], fields[3])
+
+def lex_file(file_path):
+    return LexicalAnalyser(file_path).get_tokens()
+
+class TokenCache():
+    """
+    Keeps the serialized tokens of each file lexed, by path, until the file
+    changes. A fresh list of tokens is returned every time, since the
+    analyser may change them. lex_file turns a path into its tokens.
+    """
+    def __init__(self, lex_file=lex_file):
+        self.lex_file = lex_file
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_tokens(self, file_path):
+        path = os.path.abspath(file_path)
+        status = os.stat(path)
+        version = (status.st_mtime, status.st_size)
+        entry = self.entries.get(path)
+        if entry and entry[0] == version:
+            self.hits += 1
+            return load_tokens(entry[1])
+        self.misses += 1
+        tokens = self.lex_file(path)
+        self.entries[path] = (version, dump_tokens(tokens))
+        return tokens
+
+    def clear(self):
+        self.entries = {}
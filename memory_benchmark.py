@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Measures the memory used by the symbols' table of a program with a given
+number of symbols: a tenth of them are functions, each with a parameter and
+a local variable, and the rest are global variables.
+
+Usage: python memory_benchmark.py [symbols]
+'''
+
+import resource
+import sys
+import time
+from support_classes import SymbolsTable, Type, get_type
+
+DEFAULT_SYMBOLS = 100000
+
+
+def get_size(value, seen):
+    '''
+    Returns the size of value and of everything it holds, leaving out the
+    strings and the types, which are shared with the tokens and interned.
+    '''
+    if id(value) in seen or value is None or\
+            isinstance(value, (str, unicode, bool, int, Type)):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += get_size(key, seen) + get_size(item, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += get_size(item, seen)
+    else:
+        if hasattr(value, '__dict__'):
+            size += get_size(value.__dict__, seen)
+        for name in getattr(type(value), '__slots__', []):
+            size += get_size(getattr(value, name, None), seen)
+    return size
+
+
+def create_symbols_table(symbols):
+    int_type = get_type(u'int')
+    symbols_table = SymbolsTable()
+    functions = symbols / 10
+    for index in range(functions):
+        function = u'function%i' % (index)
+        symbols_table.add(function, int_type, is_function=True)
+        symbols_table[function].add_parameter(u'parameter', int_type)
+        symbols_table.add(u'local', int_type, function)
+    for index in range(symbols - functions * 3):
+        symbols_table.add(u'variable%i' % (index), int_type)
+    return symbols_table
+
+
+def main(arguments):
+    symbols = int(arguments[0]) if arguments else DEFAULT_SYMBOLS
+    start = time.time()
+    symbols_table = create_symbols_table(symbols)
+    elapsed_time = time.time() - start
+    size = get_size(symbols_table, set())
+    print 'Symbols:         %i' % (symbols)
+    print 'Table size:      %i bytes (%.1f bytes per symbol)' % (
+        size, float(size) / symbols)
+    print 'Creation time:   %.3fs' % (elapsed_time)
+    print 'Peak memory:     %i KB' % (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Static memory layout for the locals and temporaries of each function, as
+the compilers for small microcontrollers do. Two functions that can never
+be active at the same time share memory: every function is placed in the
+overlay area just after the frames of all the functions that may be below
+it in the call stack. Recursive functions keep a frame of their own, since
+a call to them may be active more than once.
+'''
+
+from intermediary_code import (build_call_graph, find_functions,
+                               find_reachable_functions, is_constant,
+                               is_temporary_variable)
+
+DEFINITIONS_FRAME = u'_definitions_'
+# Sizes in bytes on the 8-bit AVR boards, where a double is a float
+BYTE_TYPES = [u'boolean', u'char']
+LONG_TYPES = [u'long', u'float', u'double']
+
+
+def get_type_size(defined_type):
+    if defined_type is None:
+        return 2
+    words = defined_type.words
+    if any(word in words for word in LONG_TYPES):
+        return 4
+    elif any(word in words for word in BYTE_TYPES):
+        return 1
+    return 2
+
+
+class MemoryLayout():
+    def __init__(self, global_size, frames, addresses, overlay_size,
+                 dedicated_size):
+        self.global_size = global_size
+        # (name, offset, size, overlaid) of each frame
+        self.frames = frames
+        self.addresses = addresses
+        self.overlay_size = overlay_size
+        self.dedicated_size = dedicated_size
+
+    def get_size(self):
+        return self.global_size + self.overlay_size + self.dedicated_size
+
+    def get_size_without_overlays(self):
+        return self.global_size +\
+            sum(size for _, _, size, _ in self.frames)
+
+    def print_all(self):
+        print
+        print 'Memory Layout'
+        print '-------------'
+        print
+        for name, offset, size, overlaid in self.frames:
+            print u'%-28s %6i bytes at +%-6i %s' % (
+                name, size, offset, 'overlaid' if overlaid
+                else 'own frame (recursive)')
+        print
+        print u'Globals:          %6i bytes' % (self.global_size)
+        print u'Overlay area:     %6i bytes' % (self.overlay_size)
+        print u'Recursive frames: %6i bytes' % (self.dedicated_size)
+        print u'SRAM:             %6i bytes (%i bytes without overlays)' % (
+            self.get_size(), self.get_size_without_overlays())
+        print
+        print '-' * 40
+
+
+class MemoryPlanner():
+    def __init__(self, variable_types=None, global_variables=None,
+                 function_locals=None):
+        self.variable_types = variable_types if variable_types is not None\
+            else {}
+        self.global_variables = global_variables\
+            if global_variables is not None else []
+        self.function_locals = function_locals\
+            if function_locals is not None else {}
+
+    def get_operand_sizes(self, instructions, name):
+        '''
+        Returns the size of each local and temporary of the function, in
+        the order of their first use. The size of a temporary is that of the
+        widest operand it is computed from.
+        '''
+        operand_sizes = {}
+        operands = []
+        function_locals = self.function_locals.get(name, ())
+
+        def get_size(operand):
+            if operand in operand_sizes:
+                return operand_sizes[operand]
+            elif is_constant(operand):
+                return 4 if '.' in operand else 2
+            return get_type_size(self.variable_types.get(operand))
+
+        for instruction in instructions:
+            for operand in [instruction.result, instruction.argument1,
+                            instruction.argument2]:
+                if operand is None or operand in operand_sizes or\
+                        not (is_temporary_variable(operand) or
+                             operand in function_locals):
+                    continue
+                if not is_temporary_variable(operand):
+                    size = get_size(operand)
+                elif instruction.kind == 'call' and\
+                        operand == instruction.result:
+                    size = get_type_size(
+                        self.variable_types.get(instruction.argument1))
+                elif operand == instruction.result and\
+                        instruction.kind in ['copy', 'unary', 'binary'] and\
+                        not (instruction.kind == 'binary' and
+                             instruction.operator in
+                             ['==', '!=', '<', '>', '<=', '>=', '&&',
+                              '||']):
+                    size = max(get_size(argument) for argument in
+                               [instruction.argument1, instruction.argument2]
+                               if argument is not None)
+                else:
+                    size = 2
+                operand_sizes[operand] = size
+                operands.append(operand)
+        return [(operand, operand_sizes[operand]) for operand in operands]
+
+    def find_recursive_functions(self, call_graph):
+        return set(name for name, callees in call_graph.items()
+                   if name in find_reachable_functions(call_graph, callees))
+
+    def plan(self, definitions_instructions, program_instructions):
+        bodies = dict((name, program_instructions[start + 1:end])
+                      for name, start, end in
+                      find_functions(program_instructions))
+        bodies[DEFINITIONS_FRAME] = definitions_instructions
+        call_graph = build_call_graph(program_instructions)
+        call_graph[DEFINITIONS_FRAME] = [
+            instruction.argument1 for instruction in definitions_instructions
+            if instruction.kind == 'call']
+        recursive_functions = self.find_recursive_functions(call_graph)
+        frame_operands = dict(
+            (name, self.get_operand_sizes(body, name))
+            for name, body in bodies.items())
+        frame_sizes = dict((name, sum(size for _, size in operands))
+                           for name, operands in frame_operands.items())
+        # A function starts where the frames below it end. Recursive frames
+        # take no room in the overlay area, so the cycles they make settle.
+        offsets = dict((name, 0) for name in bodies)
+        changed = True
+        while changed:
+            changed = False
+            for name, callees in call_graph.items():
+                end = offsets[name]
+                if name not in recursive_functions:
+                    end += frame_sizes[name]
+                for callee in callees:
+                    if callee in offsets and offsets[callee] < end:
+                        offsets[callee] = end
+                        changed = True
+        names = [DEFINITIONS_FRAME] + [name for name, _, _ in
+                                       find_functions(program_instructions)]
+        overlay_size = max([offsets[name] + frame_sizes[name]
+                            for name in names
+                            if name not in recursive_functions] or [0])
+        frames = []
+        # Offsets from the start of the frames, with the recursive frames
+        # after the overlay area
+        addresses = {}
+        dedicated_size = 0
+        for name in names:
+            overlaid = name not in recursive_functions
+            if overlaid:
+                address = offsets[name]
+            else:
+                address = overlay_size + dedicated_size
+                dedicated_size += frame_sizes[name]
+            frames.append((name, address, frame_sizes[name], overlaid))
+            for operand, size in frame_operands[name]:
+                addresses[operand] = address
+                address += size
+        global_size = sum(get_type_size(self.variable_types.get(name))
+                          for name in self.global_variables)
+        return MemoryLayout(global_size, frames, addresses, overlay_size,
+                            dedicated_size)
@@ -0,0 +1,516 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Preprocessing stage in front of the lexical analyser. It supports #include,
+object-like and function-like #define, #undef and conditional compilation
+with #if, #ifdef, #ifndef, #elif, #else and #endif.
+
+Each file is lexed once, with each directive line kept as a single token,
+and its tokens are kept in a TokenCache, by path and modification time, so a
+header included by every sketch of a batch is only lexed once.
+
+The #if expressions are evaluated by a small parser of integer expressions
+with the C operators and precedences.
+'''
+
+import os
+import re
+from lexical_analyser import LexicalAnalyser, Token, TokenCache
+
+MAX_INCLUDE_DEPTH = 64
+IDENTIFIER_TOKEN_TYPES = [u'T_ID', u'T_RESERVED_WORD']
+# The binary operators of #if, from the lowest precedence to the highest
+CONDITION_OPERATOR_LEVELS = [
+    [u'T_OR'], [u'T_AND'], [u'T_EQUAL_TO', u'T_DIFFERENT'],
+    [u'T_LOWER_THAN', u'T_GREATER_THAN', u'T_LOWER_THAN_OR_EQUAL_TO',
+     u'T_GREATER_THAN_OR_EQUAL_TO'],
+    [u'T_ADDITION', u'T_SUBTRACTION'],
+    [u'T_MULTIPLICATION', u'T_DIVISION', u'T_MODULO']
+]
+CONDITION_TOKEN_TYPES = sum(CONDITION_OPERATOR_LEVELS, [
+    u'T_INTEGER', u'T_NOT', u'T_PARENTHESES_OPEN', u'T_PARENTHESES_CLOSE'
+]) + IDENTIFIER_TOKEN_TYPES
+DEFINED_PATTERN = re.compile(
+    r'\bdefined\s*(?:\(\s*([A-Za-z_]\w*)\s*\)|([A-Za-z_]\w*))')
+DEFINE_PATTERN = re.compile(r'([A-Za-z_]\w*)(\(([^)]*)\))?\s*(.*)$')
+INCLUDE_PATTERN = re.compile(r'\s*#\s*include\s*("[^"]*"|<[^>]*>)')
+
+
+class PreprocessorError(Exception):
+    def __str__(self):
+        if self.line is not None:
+            return u'Preprocessor Error - %s [%s:%iL]' % (
+                self.message, self.file_path, self.line + 1)
+        elif self.file_path is not None:
+            return u'Preprocessor Error - %s [%s]' % (self.message,
+                                                      self.file_path)
+        return u'Preprocessor Error - %s' % (self.message)
+
+    def __init__(self, message, file_path=None, line=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.file_path = file_path
+        self.line = line
+
+
+class Macro():
+    def __init__(self, name, parameters, body):
+        self.name = name
+        # None for object-like macros
+        self.parameters = parameters
+        self.body = body
+
+
+def lex_text(text):
+    return LexicalAnalyser(None, [text + '\n']).get_tokens()
+
+
+def is_directive(line):
+    return line.lstrip().startswith('#')
+
+
+def get_directives_end(lines):
+    '''
+    Returns the number of lines up to the end of the last directive, with
+    its continuation lines.
+    '''
+    end = 0
+    line_number = 0
+    while line_number < len(lines):
+        if is_directive(lines[line_number]):
+            while lines[line_number].rstrip('\r\n').endswith('\\') and\
+                    line_number + 1 < len(lines):
+                line_number += 1
+            end = line_number + 1
+        line_number += 1
+    return end
+
+
+def find_header(text, file_path, include_paths, missing_files=None):
+    '''
+    Returns the path of the header named by the text of an #include, with
+    its quotes or angle brackets, or None if it is not found. The paths
+    tried before are added to missing_files.
+    '''
+    directories = include_paths
+    if text[0] == '"':
+        directories = [os.path.dirname(os.path.abspath(file_path))] +\
+            directories
+    for directory in directories:
+        header_path = os.path.join(directory, text[1:-1])
+        if os.path.isfile(header_path):
+            return header_path
+        if missing_files is not None:
+            missing_files.append(os.path.abspath(header_path))
+    return None
+
+
+def find_included_files(file_path, include_paths=None):
+    '''
+    Returns the paths of the headers that the file may include, directly or
+    through other headers, whatever the conditions around the #include.
+    '''
+    included_files = set()
+    pending_files = [file_path]
+    while pending_files:
+        path = pending_files.pop()
+        try:
+            with open(path, 'r') as source_file:
+                lines = source_file.readlines()
+        except IOError:
+            continue
+        for line in lines:
+            match = INCLUDE_PATTERN.match(line)
+            header_path = find_header(match.group(1), path,
+                                      include_paths or [])\
+                if match else None
+            if header_path is not None and\
+                    os.path.abspath(header_path) not in included_files:
+                included_files.add(os.path.abspath(header_path))
+                pending_files.append(header_path)
+    return included_files
+
+
+def read_source_tokens(file_path):
+    with open(file_path, 'r') as source_file:
+        return lex_source_lines(source_file.readlines())
+
+
+def lex_source_lines(lines):
+    '''
+    Returns the tokens of the lines of a file, where each directive line is
+    a single T_DIRECTIVE token holding the text after the #, with its
+    continuation lines joined.
+    '''
+    directives = {}
+    blank_lines = list(lines)
+    line_number = 0
+    while line_number < len(lines):
+        if is_directive(lines[line_number]):
+            first_line = line_number
+            text = lines[line_number].lstrip()[1:].rstrip('\r\n')
+            blank_lines[line_number] = '\n'
+            while text.endswith('\\') and line_number + 1 < len(lines):
+                line_number += 1
+                text = text[:-1] + ' ' + lines[line_number].rstrip('\r\n')
+                blank_lines[line_number] = '\n'
+            directives[first_line] = text.strip()
+        line_number += 1
+    tokens = LexicalAnalyser(None, blank_lines).get_tokens()
+    tokens.extend(Token(u'T_DIRECTIVE', text, line_number, 0)
+                  for line_number, text in directives.items())
+    tokens.sort(key=lambda token: (token.line, token.column))
+    return tokens
+
+
+def get_source_lines(tokens):
+    '''
+    Returns the (line_number, directive, tokens) triples of the tokens of a
+    file, where directive is None for the lines that are not directives.
+    '''
+    source_lines = []
+    for token in tokens:
+        if token.token_type == u'T_DIRECTIVE':
+            source_lines.append((token.line, token.lexeme, []))
+        elif source_lines and source_lines[-1][0] == token.line:
+            source_lines[-1][2].append(token)
+        else:
+            source_lines.append((token.line, None, [token]))
+    return source_lines
+
+
+def divide(dividend, divisor):
+    # Truncated towards zero, as in C
+    quotient = abs(dividend) // abs(divisor)
+    return quotient if (dividend < 0) == (divisor < 0) else -quotient
+
+
+def get_binary_operations():
+    return {
+        u'T_OR': lambda a, b: int(bool(a or b)),
+        u'T_AND': lambda a, b: int(bool(a and b)),
+        u'T_EQUAL_TO': lambda a, b: int(a == b),
+        u'T_DIFFERENT': lambda a, b: int(a != b),
+        u'T_LOWER_THAN': lambda a, b: int(a < b),
+        u'T_GREATER_THAN': lambda a, b: int(a > b),
+        u'T_LOWER_THAN_OR_EQUAL_TO': lambda a, b: int(a <= b),
+        u'T_GREATER_THAN_OR_EQUAL_TO': lambda a, b: int(a >= b),
+        u'T_ADDITION': lambda a, b: a + b,
+        u'T_SUBTRACTION': lambda a, b: a - b,
+        u'T_MULTIPLICATION': lambda a, b: a * b,
+        u'T_DIVISION': divide,
+        u'T_MODULO': lambda a, b: a - divide(a, b) * b
+    }
+
+
+class ConditionParser():
+    '''
+    Evaluates the tokens of an #if expression. Raises ValueError if they are
+    not a valid expression and ZeroDivisionError on a division by zero that
+    is evaluated: the right operand of a && or || that decides the result
+    on its own is only checked.
+    '''
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+        self.skipped = 0
+        self.binary_operations = get_binary_operations()
+
+    def evaluate(self):
+        value = self.parse_binary(0)
+        if self.index != len(self.tokens):
+            raise ValueError(self.tokens[self.index].lexeme)
+        return value
+
+    def get_next_token_type(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index].token_type
+        return None
+
+    def parse_binary(self, level):
+        if level == len(CONDITION_OPERATOR_LEVELS):
+            return self.parse_unary()
+        value = self.parse_binary(level + 1)
+        while self.get_next_token_type() in CONDITION_OPERATOR_LEVELS[level]:
+            operator = self.get_next_token_type()
+            self.index += 1
+            skip = (operator == u'T_AND' and not value) or\
+                (operator == u'T_OR' and value)
+            self.skipped += skip
+            operand = self.parse_binary(level + 1)
+            self.skipped -= skip
+            if operator in [u'T_DIVISION', u'T_MODULO'] and operand == 0:
+                if not self.skipped:
+                    raise ZeroDivisionError()
+                operand = 1
+            value = self.binary_operations[operator](value, operand)
+        return value
+
+    def parse_unary(self):
+        token_type = self.get_next_token_type()
+        if token_type is None:
+            raise ValueError()
+        token = self.tokens[self.index]
+        self.index += 1
+        if token_type == u'T_NOT':
+            return int(not self.parse_unary())
+        elif token_type == u'T_SUBTRACTION':
+            return -self.parse_unary()
+        elif token_type == u'T_ADDITION':
+            return self.parse_unary()
+        elif token_type == u'T_INTEGER':
+            return int(token.lexeme)
+        elif token_type in IDENTIFIER_TOKEN_TYPES:
+            # Identifiers that are not macros are 0
+            return 0
+        elif token_type == u'T_PARENTHESES_OPEN':
+            value = self.parse_binary(0)
+            if self.get_next_token_type() != u'T_PARENTHESES_CLOSE':
+                raise ValueError()
+            self.index += 1
+            return value
+        raise ValueError(token.lexeme)
+
+
+# Shared by the preprocessors of a process, e.g. of a watch or server worker
+token_cache = TokenCache(read_source_tokens)
+
+
+class Preprocessor():
+    def __init__(self, include_paths=None, macros=None, cache=None):
+        self.include_paths = include_paths if include_paths is not None\
+            else []
+        self.macros = {}
+        for name, value in (macros or {}).items():
+            self.macros[name] = Macro(name, None, lex_text(value))
+        self.cache = cache if cache is not None else token_cache
+
+    def get_tokens(self, file_path):
+        return self.get_lines_tokens(file_path,
+                                     self.cache.get_tokens(file_path))
+
+    def get_text_tokens(self, file_path, lines):
+        '''
+        Preprocesses lines that are not saved to the file yet, as those of
+        an editor, leaving the macros they define in the preprocessor.
+        '''
+        return self.get_lines_tokens(file_path, lex_source_lines(lines))
+
+    def get_lines_tokens(self, file_path, source_tokens):
+        self.file_path = file_path
+        # The headers read, for the caches that depend on them, and the
+        # paths searched before them, which must still not exist
+        self.included_files = []
+        self.missing_files = []
+        tokens = []
+        self.process_file(file_path, get_source_lines(source_tokens),
+                          tokens, None, 0)
+        return tokens
+
+    def process_file(self, file_path, source_lines, output, position,
+                     depth):
+        '''
+        Appends the tokens of the file to output. The tokens of an included
+        file take the position of the #include directive.
+        '''
+        # (enclosing branch active, a branch was taken, active, #else seen)
+        conditions = []
+        pending_tokens = []
+        for line_number, directive, tokens in source_lines:
+            active = not conditions or conditions[-1][2]
+            if directive is None:
+                if active:
+                    pending_tokens.extend(
+                        self.move_tokens(tokens, position))
+                continue
+            output.extend(self.expand(pending_tokens))
+            pending_tokens = []
+            name, _, text = directive.partition(' ')
+            if not name:
+                continue
+            elif name in [u'if', u'ifdef', u'ifndef']:
+                if not active:
+                    conditions.append([False, True, False, False])
+                    continue
+                condition = self.evaluate_condition(
+                    name, text, file_path, line_number)
+                conditions.append([True, condition, condition, False])
+            elif name in [u'elif', u'else', u'endif']:
+                if not conditions:
+                    raise PreprocessorError(
+                        u'#%s without #if' % (name), file_path, line_number)
+                if name == u'endif':
+                    conditions.pop()
+                    continue
+                condition = conditions[-1]
+                if condition[3]:
+                    raise PreprocessorError(u'#%s after #else' % (name),
+                                            file_path, line_number)
+                if condition[1] or not condition[0]:
+                    condition[2] = False
+                elif name == u'else':
+                    condition[2] = True
+                else:
+                    condition[2] = self.evaluate_condition(
+                        u'if', text, file_path, line_number)
+                condition[1] = condition[1] or condition[2]
+                condition[3] = name == u'else'
+            elif not active:
+                continue
+            elif name == u'define':
+                self.define(text, file_path, line_number)
+            elif name == u'undef':
+                self.macros.pop(text.strip(), None)
+            elif name == u'include':
+                self.include(text.strip(), file_path, line_number, output,
+                             position or (line_number, 0), depth)
+            elif name == u'error':
+                raise PreprocessorError(text, file_path, line_number)
+            elif name != u'pragma':
+                raise PreprocessorError(u'Unknown directive "#%s"' % (name),
+                                        file_path, line_number)
+        if conditions:
+            raise PreprocessorError(u'Unterminated #if', file_path)
+        output.extend(self.expand(pending_tokens))
+
+    def move_tokens(self, tokens, position):
+        if position is None:
+            return list(tokens)
+        return [Token(token.token_type, token.lexeme, position[0],
+                      position[1]) for token in tokens]
+
+    def include(self, text, file_path, line_number, output, position, depth):
+        if depth >= MAX_INCLUDE_DEPTH:
+            raise PreprocessorError(u'#include nested too deeply',
+                                    file_path, line_number)
+        if len(text) < 2 or (text[0], text[-1]) not in [('"', '"'),
+                                                        ('<', '>')]:
+            raise PreprocessorError(u'Invalid #include "%s"' % (text),
+                                    file_path, line_number)
+        header_path = find_header(text, file_path, self.include_paths,
+                                  self.missing_files)
+        if header_path is not None:
+            self.included_files.append(os.path.abspath(header_path))
+            self.process_file(
+                header_path,
+                get_source_lines(self.cache.get_tokens(header_path)),
+                output, position, depth + 1)
+            return
+        # The Arduino core and library headers are not available, so the
+        # system headers that are not found are left out
+        if text[0] == '"':
+            raise PreprocessorError(u'File "%s" not found' % (text[1:-1]),
+                                    file_path, line_number)
+
+    def define(self, text, file_path, line_number):
+        match = DEFINE_PATTERN.match(text)
+        if not match:
+            raise PreprocessorError(u'Invalid #define "%s"' % (text),
+                                    file_path, line_number)
+        name, parameters_text, parameters, body = match.groups()
+        # A parenthesis after a space starts the body of an object-like macro
+        if parameters_text is None:
+            parameters = None
+        else:
+            parameters = [parameter.strip() for parameter in
+                          parameters.split(',') if parameter.strip()]
+        self.macros[name] = Macro(name, parameters, lex_text(body))
+
+    def evaluate_condition(self, name, text, file_path, line_number):
+        if name == u'ifdef':
+            return text.strip() in self.macros
+        elif name == u'ifndef':
+            return text.strip() not in self.macros
+        text = DEFINED_PATTERN.sub(
+            lambda match: u'1' if (match.group(1) or match.group(2)) in
+            self.macros else u'0', text)
+        try:
+            tokens = self.expand(lex_text(text))
+        except PreprocessorError as error:
+            raise PreprocessorError(error.message, file_path, line_number)
+        for token in tokens:
+            if token.token_type not in CONDITION_TOKEN_TYPES:
+                raise PreprocessorError(
+                    u'Invalid "%s" in #if' % (token.lexeme), file_path,
+                    line_number)
+        try:
+            return bool(ConditionParser(tokens).evaluate())
+        except (ValueError, ZeroDivisionError):
+            raise PreprocessorError(u'Invalid #if expression "%s"' % (text),
+                                    file_path, line_number)
+
+    def expand(self, tokens, hidden=frozenset()):
+        '''
+        Replaces the macros in tokens. The names in hidden are the macros
+        being expanded, which are not replaced again. The errors are at the
+        position of the tokens, in the main file.
+        '''
+        output = []
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            macro = self.macros.get(token.lexeme)\
+                if token.token_type in IDENTIFIER_TOKEN_TYPES else None
+            if macro is None or token.lexeme in hidden:
+                output.append(token)
+                index += 1
+                continue
+            if macro.parameters is None:
+                replacement = self.move_tokens(macro.body,
+                                               (token.line, token.column))
+                index += 1
+            else:
+                if index + 1 >= len(tokens) or tokens[index + 1].token_type\
+                        != u'T_PARENTHESES_OPEN':
+                    # A function-like macro name without arguments
+                    output.append(token)
+                    index += 1
+                    continue
+                arguments, index = self.get_arguments(tokens, index + 2)
+                if arguments == [[]] and not macro.parameters:
+                    arguments = []
+                if len(arguments) != len(macro.parameters):
+                    raise PreprocessorError(
+                        u'Macro "%s" expects %i argument(s), got %i' %
+                        (macro.name, len(macro.parameters), len(arguments)),
+                        self.file_path, token.line)
+                arguments = [self.expand(argument, hidden)
+                             for argument in arguments]
+                replacement = []
+                for body_token in macro.body:
+                    if body_token.token_type in IDENTIFIER_TOKEN_TYPES and\
+                            body_token.lexeme in macro.parameters:
+                        argument = arguments[
+                            macro.parameters.index(body_token.lexeme)]
+                        replacement.extend(self.move_tokens(
+                            argument, (token.line, token.column)))
+                    else:
+                        replacement.extend(self.move_tokens(
+                            [body_token], (token.line, token.column)))
+            output.extend(self.expand(replacement,
+                                      hidden | set([macro.name])))
+        return output
+
+    def get_arguments(self, tokens, index):
+        '''
+        Returns the arguments of a function-like macro call, starting after
+        its opening parenthesis, and the index after the closing one.
+        '''
+        arguments = [[]]
+        depth = 0
+        while index < len(tokens):
+            token = tokens[index]
+            index += 1
+            if token.token_type == u'T_PARENTHESES_OPEN':
+                depth += 1
+            elif token.token_type == u'T_PARENTHESES_CLOSE':
+                if depth == 0:
+                    return arguments, index
+                depth -= 1
+            elif token.token_type == u'T_COMMA' and depth == 0:
+                arguments.append([])
+                continue
+            arguments[-1].append(token)
+        raise PreprocessorError(u'Unterminated macro call', self.file_path,
+                                tokens[-1].line)
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from compile_cache import DEFAULT_CACHE_DIRECTORY, CompileCache
+from preprocessor import Preprocessor, PreprocessorError
+from syntactic_and_semantic_analyser import SyntacticAndSemanticAnalyser
+
+
+def print_usage():
+    print 'Usage: python program.py input_file.c [--print] [-O0|-O1|-O2]'\
+        ' [--time-passes] [--function-sizes] [--memory-layout]'\
+        ' [--max-errors=N] [--cache] [--cache-dir=DIR] [--cache-stats]'\
+        ' [-IDIR] [-DNAME[=VALUE]]'
+
+
+def get_option_value(options, name, default=None):
+    value = default
+    for option in options:
+        if option.startswith('%s=' % (name)):
+            value = option[len(name) + 1:]
+    return value
+
+
+def get_preprocessor(options):
+    include_paths = [option[2:] for option in options
+                     if option.startswith('-I')]
+    macros = {}
+    for option in options:
+        if option.startswith('-D'):
+            name, _, value = option[2:].partition('=')
+            macros[name] = value or '1'
+    return Preprocessor(include_paths, macros)
+
+
+def get_tokens(input_file, preprocessor):
+    try:
+        return preprocessor.get_tokens(input_file)
+    except PreprocessorError as error:
+        print error
+        sys.exit()
+
+
+def compile_file(input_file, options, optimisation_level, max_errors,
+                 tokens=None):
+    if tokens is None:
+        tokens = get_tokens(input_file, get_preprocessor(options))
+    syntactic_and_semantic_analyser = SyntacticAndSemanticAnalyser(
+        tokens, max_errors)
+    try:
+        return syntactic_and_semantic_analyser.process_tokens(
+            '--print' in options, optimisation_level,
+            '--time-passes' in options, '--function-sizes' in options,
+            '--memory-layout' in options)
+    except SystemExit:
+        # The error was already printed by the analyser
+        return syntactic_and_semantic_analyser.get_compilation_result(None)
+
+
+def compile_cached_file(input_file, options, optimisation_level, max_errors,
+                        cache):
+    # Keyed by the source and by what decides the headers it includes, so
+    # that nothing is lexed on a hit. The cache checks the headers.
+    with open(input_file, 'rb') as source_file:
+        source = source_file.read()
+    key = cache.get_key(source, {
+        'optimisation_level': optimisation_level,
+        'max_errors': max_errors,
+        'directory': os.path.dirname(os.path.abspath(input_file)),
+        'include_paths': [os.path.abspath(option[2:]) for option in options
+                          if option.startswith('-I')],
+        'macros': [option for option in options if option.startswith('-D')]
+    })
+    result = cache.get(key)
+    if result:
+        result.print_all('--print' in options)
+        return result
+    preprocessor = get_preprocessor(options)
+    tokens = get_tokens(input_file, preprocessor)
+    result = compile_file(input_file, options, optimisation_level,
+                          max_errors, tokens)
+    cache.put(key, result, preprocessor.included_files,
+              preprocessor.missing_files)
+    return result
+
+
+def main(arguments):
+    input_files = [argument for argument in arguments
+                   if not argument.startswith('-')]
+    options = [argument for argument in arguments if argument.startswith('-')]
+    optimisation_levels = {'-O0': 0, '-O1': 1, '-O2': 2}
+    if len(input_files) != 1 or\
+            any(option not in ['--print', '--time-passes',
+                               '--function-sizes', '--memory-layout',
+                               '--cache', '--cache-stats'] and
+                option not in optimisation_levels and
+                not option.startswith('--max-errors=') and
+                not option.startswith('--cache-dir=') and
+                not option.startswith('-I') and not option.startswith('-D')
+                for option in options):
+        print_usage()
+        sys.exit(1)
+    try:
+        max_errors = int(get_option_value(options, '--max-errors', 1))
+    except ValueError:
+        print_usage()
+        sys.exit(1)
+    if max_errors < 1:
+        print_usage()
+        sys.exit(1)
+    optimisation_level = 0
+    for option in options:
+        if option in optimisation_levels:
+            optimisation_level = optimisation_levels[option]
+    cache_directory = get_option_value(options, '--cache-dir')
+    # The pass timings change on every run, so they are never cached, and
+    # neither are the reports printed after the result
+    if ('--cache' in options or cache_directory) and\
+            '--time-passes' not in options and\
+            '--function-sizes' not in options and\
+            '--memory-layout' not in options:
+        cache = CompileCache(cache_directory or DEFAULT_CACHE_DIRECTORY)
+        compile_cached_file(input_files[0], options, optimisation_level,
+                            max_errors, cache)
+        if '--cache-stats' in options:
+            cache.print_statistics()
+    else:
+        compile_file(input_files[0], options, optimisation_level, max_errors)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
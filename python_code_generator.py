@@ -0,0 +1,375 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from code_optimiser import (get_constant_temporary_variables,
+                            get_type_category)
+from intermediary_code import (find_functions, is_constant,
+                               is_temporary_variable, parse_code)
+from virtual_machine import (ExecutionError, InputOutputStub, c_divide,
+                             c_remainder)
+
+
+class PythonCodeGenerator():
+    '''
+    Translates the C3E of each function into the source of a Python
+    function. Each run of code between two labels becomes a block guarded by
+    "if block == n", all of them inside a single "while 1" loop: falling
+    through to the next block or jumping forward costs a comparison per
+    skipped block, and jumping backward restarts the loop.
+    '''
+    def __init__(self, input_output, variable_types=None,
+                 function_locals=None):
+        self.variable_types = variable_types if variable_types is not None\
+            else {}
+        self.function_locals = function_locals\
+            if function_locals is not None else {}
+        self.builtin_functions = input_output.get_functions()
+        self.global_variables = set()
+        self.local_variables = set()
+        self.constant_temporaries = {}
+        self.relational_operators = [
+            u'==', u'!=', u'<', u'>', u'<=', u'>='
+        ]
+
+    def get_name(self, operand):
+        if is_constant(operand):
+            return operand
+        elif operand in self.constant_temporaries:
+            return self.constant_temporaries[operand]
+        elif is_temporary_variable(operand):
+            return 't%s' % (operand[len('#T'):])
+        return 'v_%s' % (operand)
+
+    def is_local(self, operand, function_name):
+        return is_temporary_variable(operand) or\
+            operand in self.function_locals.get(function_name, ())
+
+    def is_integral_variable(self, operand):
+        return get_type_category(self.variable_types.get(operand)) in\
+            ['int', 'unsigned']
+
+    def generate_program(self, definitions_instructions, program_instructions):
+        source = []
+        source.extend(self.generate_function(
+            u'_definitions_', definitions_instructions, None))
+        for name, start, end in find_functions(program_instructions):
+            source.extend(self.generate_function(
+                name, program_instructions[start + 1:end], name))
+        return '\n'.join(source) + '\n'
+
+    def get_integral_operands(self, instructions):
+        integral_operands = set()
+
+        def is_integral(operand):
+            operand = self.constant_temporaries.get(operand, operand)
+            if is_constant(operand):
+                return '.' not in operand
+            return operand in integral_operands or\
+                self.is_integral_variable(operand)
+
+        for instruction in instructions:
+            if not is_temporary_variable(instruction.result):
+                continue
+            if instruction.kind == 'binary' and\
+                    (instruction.operator in self.relational_operators or
+                     instruction.operator in [u'&&', u'||']):
+                integral_operands.add(instruction.result)
+            elif instruction.kind in ['copy', 'unary', 'binary'] and\
+                    all(is_integral(operand) for operand in
+                        [instruction.argument1, instruction.argument2]
+                        if operand is not None):
+                integral_operands.add(instruction.result)
+        return is_integral
+
+    def uses_static_parameters(self, instructions):
+        pending_parameters = 0
+        for instruction in instructions:
+            if instruction.kind == 'param':
+                pending_parameters += 1
+            elif instruction.kind == 'call':
+                pending_parameters -= int(instruction.argument2)
+                if pending_parameters < 0:
+                    return False
+            elif instruction.kind == 'label' and pending_parameters:
+                return False
+        return pending_parameters == 0
+
+    def generate_function(self, name, instructions, function_name):
+        # Temporaries that only hold a literal are replaced by the literal
+        self.constant_temporaries =\
+            get_constant_temporary_variables(instructions)
+        instructions = [instruction for instruction in instructions
+                        if instruction.get_defined_operand() not in
+                        self.constant_temporaries]
+        self.is_integral = self.get_integral_operands(instructions)
+        self.static_parameters = self.uses_static_parameters(instructions)
+        self.pending_parameters = []
+        local_operands = set()
+        global_operands = set()
+        for instruction in instructions:
+            operands = instruction.get_used_operands()
+            if instruction.get_defined_operand():
+                operands.append(instruction.get_defined_operand())
+            for operand in operands:
+                if self.is_local(operand, function_name):
+                    local_operands.add(operand)
+                else:
+                    global_operands.add(operand)
+        self.global_variables.update(global_operands)
+        self.named_locals = sorted([operand for operand in local_operands
+                                    if not is_temporary_variable(operand)])
+        self.local_variables.update(self.named_locals)
+        source = ['def f_%s(*arguments):' % (name)]
+        if global_operands:
+            source.append('    global %s' % (', '.join(
+                sorted([self.get_name(operand)
+                        for operand in global_operands]))))
+        if not self.static_parameters:
+            source.append('    pending_parameters = []')
+        for operand in self.named_locals:
+            source.append('    %s = _memory[%r]' % (self.get_name(operand),
+                                                    operand))
+        defined_operands = set()
+        for instruction in instructions:
+            for operand in instruction.get_used_operands():
+                if is_temporary_variable(operand) and\
+                        operand not in self.constant_temporaries and\
+                        operand not in defined_operands:
+                    source.append('    %s = 0' % (self.get_name(operand)))
+                    defined_operands.add(operand)
+            if instruction.get_defined_operand():
+                defined_operands.add(instruction.get_defined_operand())
+        blocks = [[]]
+        labels = {}
+        for instruction in instructions:
+            if instruction.kind == 'label':
+                if blocks[-1]:
+                    blocks.append([])
+                labels[instruction.target] = len(blocks) - 1
+            else:
+                blocks[-1].append(instruction)
+        self.blocks_count = len(blocks)
+        if len(blocks) == 1:
+            source.extend(self.generate_block(blocks[0], 0, labels, 1))
+            return source
+        source.append('    block = 0')
+        source.append('    while 1:')
+        for index, block in enumerate(blocks):
+            source.append('        if block == %s:' % (index))
+            source.extend(self.generate_block(block, index, labels, 3))
+        return source
+
+    def generate_return(self, value, depth):
+        indentation = '    ' * depth
+        source = ['%s_memory[%r] = %s' % (indentation, operand,
+                                          self.get_name(operand))
+                  for operand in self.named_locals]
+        source.append('%sreturn %s' % (indentation, value))
+        return source
+
+    def generate_jump(self, target, index, labels, depth):
+        indentation = '    ' * depth
+        if target not in labels:
+            raise ExecutionError(u'Label "%s" not found' % (target))
+        source = ['%sblock = %s' % (indentation, labels[target])]
+        if labels[target] <= index:
+            source.append('%scontinue' % (indentation))
+        return source
+
+    def generate_block(self, block, index, labels, depth):
+        indentation = '    ' * depth
+        source = []
+        for position, instruction in enumerate(block):
+            if instruction.kind == 'goto':
+                source.extend(self.generate_jump(instruction.target, index,
+                                                 labels, depth))
+                return source
+            elif instruction.kind == 'jump_table':
+                for target in instruction.targets:
+                    if target not in labels:
+                        raise ExecutionError(u'Label "%s" not found' %
+                                             (target))
+                source.append('%sblock = (%s,)[%s]' % (
+                    indentation,
+                    ', '.join([str(labels[target])
+                               for target in instruction.targets]),
+                    self.get_name(instruction.argument1)))
+                source.append('%scontinue' % (indentation))
+                return source
+            elif instruction.kind == 'return':
+                source.extend(self.generate_return(
+                    self.get_name(instruction.argument1), depth))
+                return source
+            elif instruction.is_branch():
+                source.append('%sif %s:' % (
+                    indentation, self.generate_condition(instruction)))
+                source.extend(self.generate_jump(instruction.target, index,
+                                                 labels, depth + 1))
+                rest_of_block = self.generate_block(
+                    block[position + 1:], index, labels, depth + 1)
+                if rest_of_block:
+                    source.append('%selse:' % (indentation))
+                    source.extend(rest_of_block)
+                return source
+            source.extend(self.generate_instruction(instruction, depth))
+        if index + 1 < self.blocks_count:
+            source.append('%sblock = %s' % (indentation, index + 1))
+        else:
+            source.extend(self.generate_return('None', depth))
+        return source
+
+    def generate_condition(self, instruction):
+        argument1 = self.get_name(instruction.argument1)
+        if instruction.kind == 'if_false':
+            return 'not %s' % (argument1)
+        elif instruction.kind == 'if_true':
+            return argument1
+        return '%s %s %s' % (argument1, instruction.operator,
+                             self.get_name(instruction.argument2))
+
+    def generate_expression(self, instruction):
+        kind = instruction.kind
+        operator = instruction.operator
+        argument1 = self.get_name(instruction.argument1)\
+            if instruction.argument1 is not None else None
+        argument2 = self.get_name(instruction.argument2)\
+            if instruction.argument2 is not None else None
+        if kind == 'copy':
+            return argument1
+        elif kind == 'load_parameter':
+            return 'arguments[%s]' % (instruction.argument1)
+        elif kind == 'unary':
+            if operator == u'!':
+                return '0 if %s else 1' % (argument1)
+            return '%s%s' % (operator, argument1)
+        elif kind == 'compound':
+            operator = operator[:-1]
+            argument2 = argument1
+            argument1 = self.get_name(instruction.result)
+        elif kind == 'call':
+            if instruction.argument1 in self.builtin_functions:
+                function_name = 'b_%s' % (instruction.argument1)
+            else:
+                function_name = 'f_%s' % (instruction.argument1)
+            count = int(instruction.argument2)
+            if not self.static_parameters:
+                if not count:
+                    return '%s()' % (function_name)
+                return '_call(%s, pending_parameters, %s)' % (function_name,
+                                                             count)
+            parameters = self.pending_parameters[
+                len(self.pending_parameters) - count:]
+            del self.pending_parameters[
+                len(self.pending_parameters) - count:]
+            return '%s(%s)' % (function_name, ', '.join(parameters))
+        if operator == u'/':
+            return '_divide(%s, %s)' % (argument1, argument2)
+        elif operator == u'%':
+            return '_remainder(%s, %s)' % (argument1, argument2)
+        elif operator in self.relational_operators:
+            return '1 if %s %s %s else 0' % (argument1, operator, argument2)
+        elif operator == u'&&':
+            return '1 if %s and %s else 0' % (argument1, argument2)
+        elif operator == u'||':
+            return '1 if %s or %s else 0' % (argument1, argument2)
+        return '%s %s %s' % (argument1, operator, argument2)
+
+    def generate_instruction(self, instruction, depth):
+        indentation = '    ' * depth
+        if instruction.kind == 'param':
+            if self.static_parameters:
+                self.pending_parameters.append(
+                    self.get_name(instruction.argument1))
+                return []
+            return ['%spending_parameters.append(%s)' % (
+                indentation, self.get_name(instruction.argument1))]
+        expression = self.generate_expression(instruction)
+        # Stores into integral variables drop the fractional part, exactly
+        # as the virtual machine does.
+        if instruction.kind in ['call', 'load_parameter']:
+            source_operands = [None]
+        elif instruction.kind == 'compound':
+            source_operands = [instruction.result, instruction.argument1]
+        else:
+            source_operands = [operand for operand in
+                               [instruction.argument1, instruction.argument2]
+                               if operand is not None]
+        if self.is_integral_variable(instruction.result) and\
+                not all(operand is not None and self.is_integral(operand)
+                        for operand in source_operands):
+            expression = 'int(%s)' % (expression)
+        return ['%s%s = %s' % (indentation,
+                               self.get_name(instruction.result),
+                               expression)]
+
+
+def call_with_pending_parameters(function, pending_parameters, count):
+    parameters = pending_parameters[-count:]
+    del pending_parameters[-count:]
+    return function(*parameters)
+
+
+class CompiledProgram():
+    '''
+    Same interface as VirtualMachine, but the C3E is translated into Python
+    functions that are compiled once.
+    '''
+    def __init__(self, definitions_code, program_code, input_output=None,
+                 variable_types=None, data_image=None, function_locals=None):
+        self.input_output = input_output if input_output is not None\
+            else InputOutputStub()
+        code_generator = PythonCodeGenerator(self.input_output,
+                                             variable_types, function_locals)
+        self.source = code_generator.generate_program(
+            parse_code(definitions_code), parse_code(program_code))
+        self.functions = [name for name, start, end in
+                          find_functions(parse_code(program_code))]
+        self.memory = {}
+        self.namespace = {
+            '_memory': self.memory,
+            '_divide': c_divide,
+            '_remainder': c_remainder,
+            '_call': call_with_pending_parameters
+        }
+        for name, function in code_generator.builtin_functions.items():
+            self.namespace['b_%s' % (name)] = function
+        for operand in code_generator.global_variables:
+            self.namespace[code_generator.get_name(operand)] = 0
+        for operand in code_generator.local_variables:
+            self.memory[operand] = 0
+        for name, _, value in data_image or []:
+            code_generator.global_variables.add(name)
+            self.namespace[code_generator.get_name(name)] = value
+        self.global_variables = code_generator.global_variables
+        exec compile(self.source, '<c3e>', 'exec') in self.namespace
+
+    def get_variable(self, name):
+        if name in self.memory:
+            return self.memory[name]
+        return self.namespace['v_%s' % (name)]
+
+    def get_variables(self):
+        variables = dict(self.memory)
+        for operand in self.global_variables:
+            variables[operand] = self.namespace['v_%s' % (operand)]
+        return variables
+
+    def run(self, loop_iterations=1):
+        try:
+            self.namespace['f__definitions_']()
+            if u'setup' in self.functions:
+                self.namespace['f_setup']()
+            if u'loop' in self.functions:
+                loop = self.namespace['f_loop']
+                for iteration in xrange(loop_iterations):
+                    loop()
+        except ZeroDivisionError:
+            raise ExecutionError(u'Division by zero')
+
+    def call(self, name, arguments=None):
+        if name not in self.functions:
+            raise ExecutionError(u'Function "%s" not found' % (name))
+        try:
+            return self.namespace['f_%s' % (name)](*(arguments or []))
+        except ZeroDivisionError:
+            raise ExecutionError(u'Division by zero')
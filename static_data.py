@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Compile-time evaluation of the global initialisers. The definitions code,
+which runs before setup, is followed along while the values of its operands
+are known: the globals it sets to a known value form a static data image,
+loaded with the program, and only the instructions that depend on something
+else (a call, an unknown value) are left as startup code. A call only stops
+the folding of the globals that the called functions may write.
+'''
+
+from code_optimiser import get_type_category
+from intermediary_code import (Instruction, build_call_graph,
+                               find_functions, find_labels,
+                               find_reachable_functions,
+                               generate_code, is_constant,
+                               is_temporary_variable, parse_code)
+from virtual_machine import (get_binary_operators, get_compound_operators,
+                             get_unary_operators)
+
+
+def get_operands(instruction):
+    if instruction.kind in ['if_false', 'if_true', 'copy', 'unary']:
+        return [instruction.argument1]
+    elif instruction.kind == 'compound':
+        return [instruction.result, instruction.argument1]
+    elif instruction.kind in ['binary', 'if_compare']:
+        return [instruction.argument1, instruction.argument2]
+    return []
+
+
+def find_written_variables(instructions):
+    '''
+    Returns the variables written by each function of the program code,
+    including those written by the functions that it calls.
+    '''
+    writes = {}
+    for name, start, end in find_functions(instructions):
+        writes[name] = set(
+            instruction.get_defined_operand()
+            for instruction in instructions[start + 1:end]
+            if instruction.get_defined_operand() is not None and
+            not is_temporary_variable(instruction.get_defined_operand()))
+    call_graph = build_call_graph(instructions)
+    written_variables = {}
+    for name in writes:
+        written_variables[name] = set()
+        for function in find_reachable_functions(call_graph, [name]):
+            written_variables[name].update(writes.get(function, ()))
+    return written_variables
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+class DataImageBuilder():
+    def __init__(self, variable_types=None, written_variables=None):
+        self.variable_types = variable_types if variable_types is not None\
+            else {}
+        self.written_variables = written_variables
+        self.binary_operators = get_binary_operators()
+        self.unary_operators = get_unary_operators()
+        self.compound_operators = get_compound_operators()
+
+    def get_value(self, operand, values, runtime_globals):
+        if is_constant(operand):
+            return float(operand) if '.' in operand else int(operand)
+        elif operand in values:
+            return values[operand]
+        elif operand in self.variable_types and\
+                operand not in runtime_globals:
+            # Not initialised yet, so still zero
+            return 0
+        return None
+
+    def evaluate(self, instruction, values, runtime_globals):
+        '''
+        Returns the value that the instruction stores, or None if it cannot
+        be told before the program runs.
+        '''
+        operands = [self.get_value(operand, values, runtime_globals)
+                    for operand in get_operands(instruction)]
+        if any(operand is None for operand in operands):
+            return None
+        try:
+            if instruction.kind == 'copy':
+                value = operands[0]
+            elif instruction.kind == 'compound':
+                value = self.compound_operators[instruction.operator](
+                    *operands)
+            elif instruction.kind == 'unary':
+                value = self.unary_operators[instruction.operator](
+                    *operands)
+            elif instruction.kind == 'binary':
+                value = self.binary_operators[instruction.operator](
+                    *operands)
+            else:
+                return None
+        except (ZeroDivisionError, ValueError):
+            # Left for the program to fail at startup, as it would have
+            return None
+        if get_type_category(self.variable_types.get(instruction.result))\
+                in ['int', 'unsigned']:
+            value = int(value)
+        return value
+
+    def is_branch_taken(self, instruction, values, runtime_globals):
+        '''
+        Returns whether the branch is taken, or None if it depends on an
+        unknown value.
+        '''
+        operands = [self.get_value(operand, values, runtime_globals)
+                    for operand in get_operands(instruction)]
+        if any(operand is None for operand in operands):
+            return None
+        if instruction.kind == 'goto':
+            return True
+        elif instruction.kind == 'if_false':
+            return not operands[0]
+        elif instruction.kind == 'if_true':
+            return bool(operands[0])
+        elif instruction.kind == 'if_compare':
+            return bool(self.binary_operators[instruction.operator](
+                *operands))
+        return None
+
+    def build(self, instructions):
+        '''
+        Returns the (name, type, value) entries of the data image and the
+        instructions left to run at startup.
+        '''
+        labels = find_labels(instructions)
+        values = {}
+        data = {}
+        # Globals set by startup code cannot be given a later value in the
+        # image, since the image is loaded first.
+        runtime_globals = set()
+        loaded_temporary_variables = set()
+        startup_instructions = []
+        index = 0
+        while index < len(instructions):
+            instruction = instructions[index]
+            index += 1
+            if instruction.kind == 'label':
+                continue
+            if instruction.kind == 'call' and\
+                    self.written_variables is None:
+                # The function may change any global
+                index -= 1
+                break
+            if instruction.kind == 'call':
+                # Only the globals that the function writes are unknown
+                # after it, so the later initialisers are still folded
+                for variable in self.written_variables.get(
+                        instruction.argument1, ()):
+                    values.pop(variable, None)
+                    runtime_globals.add(variable)
+            if instruction.is_branch():
+                taken = self.is_branch_taken(instruction, values,
+                                             runtime_globals)
+                if taken is None:
+                    # The rest depends on the branch, so it runs as it is
+                    index -= 1
+                    break
+                if taken:
+                    index = labels[instruction.target]
+                continue
+            result = instruction.get_defined_operand()
+            value = self.evaluate(instruction, values, runtime_globals)
+            if value is not None and result not in runtime_globals:
+                values[result] = value
+                if not is_temporary_variable(result):
+                    data[result] = value
+                continue
+            startup_instructions.extend(self.load_temporary_variables(
+                [instruction], values, loaded_temporary_variables))
+            startup_instructions.append(instruction)
+            if result is not None:
+                values.pop(result, None)
+                loaded_temporary_variables.discard(result)
+                if not is_temporary_variable(result):
+                    runtime_globals.add(result)
+        remaining_instructions = instructions[index:]
+        startup_instructions.extend(self.load_temporary_variables(
+            remaining_instructions, values, loaded_temporary_variables))
+        startup_instructions.extend(remaining_instructions)
+        data_image = [(name, self.variable_types.get(name), value)
+                      for name, value in sorted(data.items())]
+        return data_image, startup_instructions
+
+    def load_temporary_variables(self, instructions, values,
+                                 loaded_temporary_variables):
+        '''
+        Loads the known temporaries that the instructions use, since only
+        the globals are kept in the image.
+        '''
+        loads = []
+        for instruction in instructions:
+            for operand in instruction.get_used_operands():
+                if is_temporary_variable(operand) and operand in values and\
+                        operand not in loaded_temporary_variables:
+                    loaded_temporary_variables.add(operand)
+                    loads.append(Instruction(
+                        'copy', result=operand, operator=':=',
+                        argument1=format_value(values[operand])))
+        return loads
+
+
+def build_data_image(definitions_code, variable_types=None,
+                     program_code=None):
+    '''
+    Returns the data image of the definitions code and the C3E lines that
+    still have to run at startup. The program code gives the functions that
+    the initialisers call.
+    '''
+    written_variables = find_written_variables(parse_code(program_code))\
+        if program_code is not None else None
+    data_image, startup_instructions = DataImageBuilder(
+        variable_types, written_variables).build(
+            parse_code(definitions_code))
+    return data_image, generate_code(startup_instructions)
+
+
+def get_data_image_lines(data_image):
+    return [u'%s %s = %s' % (defined_type, name, format_value(value))
+            for name, defined_type, value in data_image]
@@ -17,6 +17,26 @@ class Error():
         self.token = token
 
 
+class PanicModeError(Exception):
+    """
+    Unwinds the analyser to the nearest production where it can
+    resynchronise after an error in the error recovery mode.
+    """
+    def __init__(self, error):
+        Exception.__init__(self, error.message)
+        self.error = error
+
+
+class CompilationStoppedError(Exception):
+    """
+    Raised instead of exiting when the analyser has to stop at an error and
+    was told not to exit.
+    """
+    def __init__(self, errors):
+        Exception.__init__(self, u'%i error(s) found' % len(errors))
+        self.errors = errors
+
+
 class SemanticWarning():
     def __str__(self):
         if self.token:
@@ -57,6 +77,163 @@ class StandaloneCodeManager():
             print line
 
 
+class CompilationResult():
+    """
+    What a compilation prints: the errors, or the Symbols' Table, the
+    Static Data, the Intermediary Code and the Warnings. Plain strings only,
+    so that it can be stored outside of the analyser.
+    """
+    def __init__(self, errors=None, symbols_table=None, definitions_code=None,
+                 code=None, warnings=None, max_errors=1, data_image=None):
+        self.errors = errors if errors is not None else []
+        self.symbols_table = symbols_table if symbols_table is not None\
+            else []
+        self.definitions_code = definitions_code\
+            if definitions_code is not None else []
+        self.code = code if code is not None else []
+        self.warnings = warnings if warnings is not None else []
+        self.max_errors = max_errors
+        self.data_image = data_image if data_image is not None else []
+
+    def to_dict(self):
+        return {
+            'errors': self.errors,
+            'symbols_table': self.symbols_table,
+            'definitions_code': self.definitions_code,
+            'code': self.code,
+            'warnings': self.warnings,
+            'max_errors': self.max_errors,
+            'data_image': self.data_image
+        }
+
+    @staticmethod
+    def from_dict(values):
+        return CompilationResult(values['errors'], values['symbols_table'],
+                                 values['definitions_code'], values['code'],
+                                 values['warnings'], values['max_errors'],
+                                 values['data_image'])
+
+    def print_separator(self):
+        print '-' * 40
+
+    def print_errors(self):
+        for error in self.errors:
+            print error
+        if self.max_errors > 1:
+            print u'%i error(s) found.' % len(self.errors)
+
+    def print_symbols_table(self):
+        print
+        print 'Symbols\' Table'
+        print '---------------'
+        print
+        for line in self.symbols_table:
+            print line
+        print
+        self.print_separator()
+
+    def print_data_image(self):
+        if self.data_image:
+            print
+            print 'Static Data'
+            print '-----------'
+            print
+            for line in self.data_image:
+                print line
+            print
+            self.print_separator()
+
+    def print_intermediary_code(self):
+        print
+        print 'Intermediary Code'
+        print '-----------------'
+        print
+        for line in self.definitions_code:
+            print line
+        print 'goto main'
+        for line in self.code:
+            print line
+        print
+        self.print_separator()
+
+    def print_warnings(self):
+        print
+        if self.warnings:
+            print 'Warning(s)'
+            print '----------'
+            print
+            for warning in self.warnings:
+                print warning
+            print
+            self.print_separator()
+
+    def print_all(self, print_all):
+        if self.errors:
+            self.print_errors()
+        elif print_all:
+            self.print_symbols_table()
+            self.print_data_image()
+            self.print_intermediary_code()
+            self.print_warnings()
+        else:
+            print 'OK.'
+
+
+class Type():
+    """
+    A type as declared: its base type, modifiers and specifiers. Types are
+    interned by get_type, so they can be compared by identity.
+    """
+    def __str__(self):
+        return self.name
+
+    def __init__(self, base_type, modifiers, specifiers):
+        self.base_type = base_type
+        self.modifiers = modifiers
+        self.specifiers = specifiers
+        self.name = u' '.join(modifiers + specifiers + (base_type,))
+        self.words = frozenset(modifiers + specifiers + (base_type,))
+        # The type that the values of this type have in an expression
+        self.value_type = self
+
+
+ARITHMETIC_TYPES = [u'int', u'float', u'double']
+interned_types = {}
+# promotion_table[left_type][right_type] is the type of the result of an
+# arithmetic operation, for the values of the types valid as left operands
+promotion_table = {}
+
+
+def get_type(base_type, modifiers=(), specifiers=()):
+    key = (base_type, modifiers, specifiers)
+    defined_type = interned_types.get(key)
+    if defined_type is None:
+        defined_type = interned_types[key] = Type(base_type, modifiers,
+                                                  specifiers)
+        if base_type in ARITHMETIC_TYPES and (modifiers or specifiers):
+            defined_type.value_type = get_type(base_type)
+        elif base_type not in ARITHMETIC_TYPES:
+            # Right operands of the other types become floating point
+            for left_type, promotions in promotion_table.items():
+                promotions[defined_type] = DOUBLE_TYPE\
+                    if left_type is DOUBLE_TYPE else FLOAT_TYPE
+    return defined_type
+
+
+INT_TYPE = get_type(u'int')
+FLOAT_TYPE = get_type(u'float')
+DOUBLE_TYPE = get_type(u'double')
+for left_type in [INT_TYPE, FLOAT_TYPE, DOUBLE_TYPE]:
+    promotion_table[left_type] = {}
+    for right_type in [INT_TYPE, FLOAT_TYPE, DOUBLE_TYPE]:
+        if left_type is right_type:
+            promotion_table[left_type][right_type] = left_type
+        elif DOUBLE_TYPE in [left_type, right_type]:
+            promotion_table[left_type][right_type] = DOUBLE_TYPE
+        else:
+            promotion_table[left_type][right_type] = FLOAT_TYPE
+
+
 class Production():
     def __init__(self, place=None, code=None, operator=None,
                  production_type=None):
@@ -67,6 +244,9 @@ class Production():
             self.code = []
         self.operator = operator
         self.production_type = production_type
+        self.contains_call = False
+        self.has_side_effects = False
+        self.max_temporary_variable_index = -1
 
     def prepend_code(self, code):
         if code:
@@ -82,6 +262,26 @@ class Production():
             elif type(code) == list:
                 self.code = self.code + code
 
+    def append_production(self, production):
+        self.append_code(production.code)
+        self.inherit_metadata(production)
+
+    def inherit_metadata(self, production):
+        self.contains_call = self.contains_call or production.contains_call
+        self.has_side_effects = self.has_side_effects or\
+            production.has_side_effects
+        self.max_temporary_variable_index = max(
+            self.max_temporary_variable_index,
+            production.max_temporary_variable_index)
+
+    def add_temporary_variable(self, temporary_variable):
+        self.max_temporary_variable_index = max(
+            self.max_temporary_variable_index,
+            int(temporary_variable[len('#T'):]))
+
+    def get_instruction_count(self):
+        return len(self.code)
+
     def __str__(self):
         return u'Place: %s | Operator: %s | Production Type: %s' %\
             (self.place, self.operator, self.production_type)
@@ -109,9 +309,10 @@ class ParametersSet:
             return True
         return False
 
-    def add(self, identifier, defined_type):
+    def add(self, identifier, defined_type, token=None):
         if not self.exists(identifier):
-            self.elements[identifier] = Parameter(identifier, defined_type)
+            self.elements[identifier] = VariableSymbol(identifier,
+                                                       defined_type, token)
             return True
         return False
 
@@ -123,15 +324,6 @@ class ParametersSet:
         return len(self.elements)
 
 
-class Parameter:
-    def __init__(self, identifier, defined_type):
-        self.identifier = identifier
-        self.defined_type = defined_type
-
-    def __str__(self):
-        return '%s %s' % (self.defined_type, self.identifier)
-
-
 class SymbolsTable:
     def __init__(self):
         self.elements = {}
@@ -141,99 +333,201 @@ class SymbolsTable:
 
     def exists(self, identifier, scope='_global_', try_global=True):
         if scope != '_global_':
-            symbols_identifiers = self.elements[scope].symbols_table.\
-                elements.keys()
-            if identifier in symbols_identifiers or identifier in\
-                    self.elements[scope].parameters_set.elements.keys():
+            if self.elements[scope].get_local(identifier) is not None:
                 return True
         if (try_global and scope != '_global_') or scope == '_global_':
-            if identifier in self.elements.keys():
+            if identifier in self.elements:
                 return True
         return False
 
     def add(self, identifier, symbol_type, scope='_global_',
-            is_function=False, parameters_set=None, symbols_table=None):
+            is_function=False, parameters_set=None, symbols_table=None,
+            token=None):
         if not self.exists(identifier, scope, try_global=False):
             if scope != '_global_':
                 parent_symbol = self.elements[scope]
                 parent_symbol.symbols_table.elements[identifier] =\
-                    Symbol(identifier, symbol_type, is_function,
-                           parameters_set, symbols_table)
+                    create_symbol(identifier, symbol_type, is_function,
+                                  parameters_set, symbols_table, token)
             else:
                 self.elements[identifier] =\
-                    Symbol(identifier, symbol_type, is_function,
-                           parameters_set, symbols_table)
+                    create_symbol(identifier, symbol_type, is_function,
+                                  parameters_set, symbols_table, token)
             return True
         return False
 
     def get(self, identifier, scope):
         if scope != '_global_':
-            symbols_identifiers = self.elements[scope].symbols_table.\
-                elements.keys()
-            if identifier in symbols_identifiers:
-                return self.elements[scope].symbols_table[identifier]
-            parameters_identifiers = self.elements[scope].parameters_set.\
-                elements.keys()
-            if identifier in parameters_identifiers:
-                return self.elements[scope].parameters_set[identifier]
-        if identifier in self.elements.keys():
+            symbol = self.elements[scope].get_local(identifier)
+            if symbol is not None:
+                return symbol
+        if identifier in self.elements:
             return self.elements[identifier]
         return None
 
     def get_localized_identifier(self, identifier, scope):
         if scope != '_global_':
-            symbols_identifiers = self.elements[scope].symbols_table.\
-                elements.keys()
-            if identifier in symbols_identifiers:
-                selected_identifier = self.elements[scope].\
-                    symbols_table[identifier].identifier
-                return '%s_%s' % (scope, selected_identifier.split(' ')[-1])
-            parameters_identifiers = self.elements[scope].parameters_set.\
-                elements.keys()
-            if identifier in parameters_identifiers:
-                selected_identifier = self.elements[scope].\
-                    parameters_set[identifier].identifier
-                return '%s_%s' % (scope, selected_identifier.split(' ')[-1])
-        if identifier in self.elements.keys():
+            symbol = self.elements[scope].get_local(identifier)
+            if symbol is not None:
+                return '%s_%s' % (scope, symbol.identifier.split(' ')[-1])
+        if identifier in self.elements:
             return self.elements[identifier].identifier.split(' ')[-1]
         return None
 
+    def get_localized_types(self):
+        localized_types = {}
+        for identifier, symbol in self.elements.items():
+            localized_types[identifier] = symbol.defined_type
+            if symbol.is_function:
+                for element in symbol.get_local_symbols():
+                    localized_types['%s_%s' % (identifier,
+                                               element.identifier)] =\
+                        element.defined_type
+        return localized_types
+
+    def get_function_locals(self):
+        '''
+        Returns the localized names of the parameters and local variables of
+        each function.
+        '''
+        function_locals = {}
+        for identifier, symbol in self.elements.items():
+            if symbol.is_function:
+                function_locals[identifier] = set(
+                    '%s_%s' % (identifier, element.identifier)
+                    for element in symbol.get_local_symbols())
+        return function_locals
+
+    def get_function_summaries(self):
+        '''
+        Returns whether the body of each defined function contains a call
+        and its number of instructions, as generated by the analyser.
+        '''
+        return dict((identifier, (symbol.contains_call,
+                                  symbol.instruction_count))
+                    for identifier, symbol in self.elements.items()
+                    if symbol.is_function and
+                    symbol.instruction_count is not None)
+
+    def get_lines(self):
+        return [unicode(symbol) for symbol in self.elements.values()
+                if symbol.is_function] +\
+            [unicode(symbol) for symbol in self.elements.values()
+             if not symbol.is_function]
+
     def print_all(self):
-        for symbol in self.elements.items():
-            if symbol[1].is_function:
-                print symbol[1]
-        for symbol in self.elements.items():
-            if not symbol[1].is_function:
-                print symbol[1]
+        for line in self.get_lines():
+            print line
+
 
+class VariableSymbol(object):
+    """
+    A variable or a parameter. Symbols are the bulk of the symbols' table,
+    so they have no __dict__ and no tables of their own.
+    """
+    __slots__ = ['identifier', 'defined_type', 'token']
+    is_function = False
 
-class Symbol:
-    def __init__(self, identifier, defined_type, is_function=False,
-                 parameters_set=None, symbols_table=None):
+    def __init__(self, identifier, defined_type, token=None):
         self.identifier = identifier
         self.defined_type = defined_type
-        self.is_function = is_function
-        self.parameters_set = parameters_set if parameters_set is not None\
-            else ParametersSet()
-        self.symbols_table = symbols_table if symbols_table is not None\
-            else SymbolsTable()
+        # Where the symbol was declared
+        self.token = token
 
     def __str__(self):
-        if self.is_function:
-            symbols_table = ['%s %s' % (
-                self.symbols_table.elements[key].defined_type,
-                self.symbols_table.elements[key].identifier)
-                for key in self.symbols_table.elements]
-            symbols_table_string = ', '.join(map(str, symbols_table))
-            return '%s %s (%s) {%s}' %\
-                (self.defined_type, self.identifier,
-                 self.parameters_set, symbols_table_string)
-        else:
-            return '%s %s' %\
-                (self.defined_type, self.identifier)
+        return '%s %s' % (self.defined_type, self.identifier)
+
+    def get_local(self, identifier):
+        return None
+
+    def get_parameter(self, index):
+        return None
+
+    def get_parameters_length(self):
+        return 0
+
 
-    def add_parameter(self, lexeme, parameter_type):
-        return self.parameters_set.add(lexeme, parameter_type)
+class FunctionSymbol(object):
+    """
+    A function, whose parameters set and symbols' table are only created
+    when they are first used.
+    """
+    __slots__ = ['identifier', 'defined_type', 'token', 'parameters',
+                 'locals', 'contains_call', 'instruction_count']
+    is_function = True
+
+    def __init__(self, identifier, defined_type, parameters_set=None,
+                 symbols_table=None, token=None):
+        self.identifier = identifier
+        self.defined_type = defined_type
+        self.token = token
+        self.parameters = parameters_set
+        self.locals = symbols_table
+        # From the production of the body, once the function is defined
+        self.contains_call = None
+        self.instruction_count = None
+
+    @property
+    def parameters_set(self):
+        if self.parameters is None:
+            self.parameters = ParametersSet()
+        return self.parameters
+
+    @property
+    def symbols_table(self):
+        if self.locals is None:
+            self.locals = SymbolsTable()
+        return self.locals
+
+    def __str__(self):
+        symbols_table = ['%s %s' % (symbol.defined_type, symbol.identifier)
+                         for symbol in self.locals.elements.values()]\
+            if self.locals is not None else []
+        symbols_table_string = ', '.join(map(str, symbols_table))
+        return '%s %s (%s) {%s}' %\
+            (self.defined_type, self.identifier,
+             self.parameters if self.parameters is not None else '',
+             symbols_table_string)
+
+    def get_local_symbols(self):
+        """
+        Returns the parameters and the local variables, without creating the
+        tables.
+        """
+        symbols = []
+        if self.parameters is not None:
+            symbols.extend(self.parameters.elements.values())
+        if self.locals is not None:
+            symbols.extend(self.locals.elements.values())
+        return symbols
+
+    def get_local(self, identifier):
+        """
+        Returns the local variable or parameter, without creating the
+        tables.
+        """
+        if self.locals is not None and identifier in self.locals.elements:
+            return self.locals.elements[identifier]
+        if self.parameters is not None and\
+                identifier in self.parameters.elements:
+            return self.parameters.elements[identifier]
+        return None
+
+    def add_parameter(self, lexeme, parameter_type, token=None):
+        return self.parameters_set.add(lexeme, parameter_type, token)
+
+    def get_parameter(self, index):
+        if self.parameters is None:
+            return None
+        return self.parameters.get_element_by_index(index)
 
     def get_parameters_length(self):
-        return self.parameters_set.length()
+        return self.parameters.length() if self.parameters is not None else 0
+
+
+def create_symbol(identifier, defined_type, is_function=False,
+                  parameters_set=None, symbols_table=None, token=None):
+    if is_function:
+        return FunctionSymbol(identifier, defined_type, parameters_set,
+                              symbols_table, token)
+    return VariableSymbol(identifier, defined_type, token)
@@ -11,6 +11,7 @@ recognize:
     √   If
     √   One-line If
     √   Break and Continue
+    √   Switch, dispatched with a jump table or a binary decision tree
     √   Attribution as a command, not as an operator (=, *=, /=, %=, +=, -=,
         <<=, >>=, &=, ^=, |=)
     √   Expression:
@@ -37,21 +38,40 @@ same thing.
 
 import inspect
 import sys
-from support_classes import (Error, Production, SemanticWarning,
-                             StandaloneCodeManager, SymbolsTable)
+from code_optimiser import (get_function_sizes, get_pass_manager,
+                            print_function_sizes)
+from intermediary_code import (generate_code, get_next_label_index,
+                               get_next_temporary_variable_index,
+                               is_constant, parse_code)
+from memory_planner import MemoryPlanner
+from static_data import build_data_image, get_data_image_lines
+from support_classes import (DOUBLE_TYPE, FLOAT_TYPE, INT_TYPE,
+                             CompilationResult,
+                             CompilationStoppedError, Error, PanicModeError,
+                             Production, SemanticWarning,
+                             StandaloneCodeManager, SymbolsTable, get_type,
+                             promotion_table)
 
 
 class SyntacticAndSemanticAnalyser():
-    def __init__(self, tokens_list):
+    def __init__(self, tokens_list, max_errors=1):
         self.tokens_list = tokens_list
         self.symbols_table = SymbolsTable()
         self.error = None
         self.warnings = []
+        self.errors = []
+        self.max_errors = max_errors
+        self.exit_on_error = True
         self.definitions_code = StandaloneCodeManager()
+        self.data_image = []
         self.token_index = 0
         self.token = None
         self.temporary_variable_index = 0
         self.label_index = 0
+        # The && and || productions not yet turned into code, by place
+        self.logical_conditions = {}
+        # The comparisons that may be fused with the branch testing them
+        self.comparison_conditions = {}
         self.log = False
         self.modifiers_list = [
             u'auto', u'extern', u'register', u'static'
@@ -65,6 +85,11 @@ class SyntacticAndSemanticAnalyser():
         self.return_types_list = [
             u'boolean', u'char', u'double', u'float', u'int', u'void', u'word'
         ]
+        # The Arduino constants, which are integer literals
+        self.constants = {
+            u'HIGH': '1', u'LOW': '0', u'INPUT': '0', u'OUTPUT': '1',
+            u'INPUT_PULLUP': '2'
+        }
         self.assignment_operator_list = [
             u'=', u'*=', u'/=', u'%=', u'+=', u'-=', u'<<=', u'>>=', u'&=',
             u'^=', u'|='
@@ -84,6 +109,34 @@ class SyntacticAndSemanticAnalyser():
         self.unary_prefix_operator_list = [
             u'+', u'-'
         ]
+        self.negated_comparison_operators = {
+            u'==': u'!=', u'!=': u'==', u'<': u'>=', u'>': u'<=',
+            u'<=': u'>', u'>=': u'<'
+        }
+        # A switch with this many cases, filling at least half of the range
+        # of their values, is dispatched with a jump table. Smaller ranges of
+        # cases in the decision trees are tested one by one.
+        self.jump_table_min_cases = 4
+        self.decision_tree_min_cases = 4
+        # The operators whose operands are values, unlike those of && and ||
+        self.value_operator_list = self.equality_operator_list +\
+            self.relational_operator_list + self.additive_operator_list +\
+            self.multiplicative_operator_list + [u'!']
+        # Statement productions shared by check_command and
+        # check_block_command, keyed on the lexeme of reserved words and on
+        # the token type otherwise: (check method, receives the loop labels,
+        # only valid inside a block)
+        self.statement_production_table = {
+            u'T_ID': (self.check_expression, False, False),
+            u'while': (self.check_while, False, False),
+            u'do': (self.check_do_while, False, False),
+            u'for': (self.check_for, False, False),
+            u'if': (self.check_if, True, False),
+            u'switch': (self.check_switch, True, False),
+            u'break': (self.check_single_word_command, True, True),
+            u'continue': (self.check_single_word_command, True, True),
+            u'return': (self.check_return, False, False)
+        }
 
     def get_specific_token(self, position):
         if position >= 0 and position < len(self.tokens_list):
@@ -102,70 +155,97 @@ class SyntacticAndSemanticAnalyser():
     def get_last_token(self):
         return self.get_specific_token(len(self.tokens_list) - 1)
 
+    def report_error(self, error, recoverable=True):
+        self.error = error
+        self.errors.append(error)
+        if not recoverable or len(self.errors) >= self.max_errors:
+            if not self.exit_on_error:
+                raise CompilationStoppedError(self.errors)
+            self.print_errors()
+            sys.exit()
+        raise PanicModeError(error)
+
     def set_eof_error(self, expected_token):
-        self.error = Error(u'Expected a %s, got %s' %
-                           (expected_token, u'EOF'), self.get_last_token())
-        print self.error
-        sys.exit()
+        self.report_error(Error(u'Expected a %s, got %s' %
+                                (expected_token, u'EOF'),
+                                self.get_last_token()), False)
 
     def set_syntactic_error(self, expected_token_type, received_token):
-        self.error = Error(u'Expected a %s, got %s' %
-                           (expected_token_type, received_token.token_type),
-                           received_token)
-        print self.error
-        sys.exit()
+        self.report_error(Error(u'Expected a %s, got %s' %
+                                (expected_token_type,
+                                 received_token.token_type), received_token))
 
     def set_multiple_declaration_error(self, identifier_token):
-        self.error = Error(u'Previous declaration of "%s" was found' %
-                           identifier_token.lexeme, identifier_token)
-        print self.error
-        sys.exit()
+        self.report_error(Error(u'Previous declaration of "%s" was found' %
+                                identifier_token.lexeme, identifier_token))
 
     def set_invalid_type_error(self, production_type):
-        self.error = Error(u'"%s" is an invalid type for this operation' %
-                           production_type, None)
-        print self.error
-        sys.exit()
+        self.report_error(Error(
+            u'"%s" is an invalid type for this operation' % production_type,
+            None))
 
     def set_undeclared_variable_error(self, identifier_token):
-        self.error = Error(u'"%s" undeclared.' %
-                           identifier_token.lexeme, identifier_token)
-        print self.error
-        sys.exit()
+        self.report_error(Error(u'"%s" undeclared.' %
+                                identifier_token.lexeme, identifier_token))
 
     def set_redeclared_variable_error(self, identifier_token):
-        self.error = Error(u'"%s" redeclared as different kind of symbol' %
-                           identifier_token.lexeme, identifier_token)
-        print self.error
-        sys.exit()
+        self.report_error(Error(
+            u'"%s" redeclared as different kind of symbol' %
+            identifier_token.lexeme, identifier_token))
 
     def set_invalid_operands_error(self, production1_type, production2_type,
                                    token):
-        self.error = Error(
+        self.report_error(Error(
             u'Invalid operands for remainder operation: "%s" and "%s"' %
-            (production1_type, production2_type), token)
-        print self.error
-        sys.exit()
+            (production1_type, production2_type), token))
+
+    def set_duplicate_case_error(self, case_token, value):
+        self.report_error(Error(u'Duplicate case value "%i"' % value,
+                                case_token))
+
+    def set_multiple_default_error(self, default_token):
+        self.report_error(Error(u'Multiple default labels in one switch',
+                                default_token))
 
     def set_return_out_of_function_error(self):
-        self.error = Error(u'Return out of function')
-        print self.error
-        sys.exit()
+        self.report_error(Error(u'Return out of function'))
 
     def set_unexpected_parameter_error(self, function_identifier,
                                        parameters_ammount):
-        self.error = None
         if parameters_ammount == 0:
-            self.error = Error(u'%s %s %s' % (
+            error = Error(u'%s %s %s' % (
                 u'The function', function_identifier,
                 u'didn\'t expect any parameters'))
         else:
-            self.error = Error(
+            error = Error(
                 u'%s %s %s %s %s' % (
                     u'The function', function_identifier, u'only expected',
                     parameters_ammount, u'parameters'))
-        print self.error
-        sys.exit()
+        self.report_error(error)
+
+    def synchronise(self, inside_block):
+        """
+        Panic mode: skips tokens until the end of the statement or block
+        where the error was found. Inside a block, the closing bracket of the
+        block itself is left for the enclosing production.
+        """
+        depth = 0
+        token = self.get_present_token()
+        while token:
+            if token.token_type == u'T_CURLY_BRACKET_OPEN':
+                depth += 1
+            elif token.token_type == u'T_CURLY_BRACKET_CLOSE':
+                if depth == 0 and inside_block:
+                    return
+                depth = max(depth - 1, 0)
+                if depth == 0:
+                    self.token_index += 1
+                    return
+            elif token.token_type == u'T_SEMICOLON' and depth == 0:
+                self.token_index += 1
+                return
+            self.token_index += 1
+            token = self.get_present_token()
 
     def set_implicit_conversion_warning(self, left_side_type, right_side_type,
                                         left_side_token):
@@ -174,7 +254,8 @@ class SyntacticAndSemanticAnalyser():
             (right_side_type, left_side_type), left_side_token))
 
     def get_localized_identifier(self, identifier, scope):
-        if '#' not in identifier:
+        # Temporaries and the literals of true, false and the constants
+        if '#' not in identifier and not is_constant(identifier):
             return self.symbols_table.get_localized_identifier(
                 identifier, scope)
         return identifier
@@ -184,7 +265,7 @@ class SyntacticAndSemanticAnalyser():
                              symbols_table=None):
         if not self.symbols_table.add(identifier_token.lexeme, return_type,
                                       scope, is_function, parameters_set,
-                                      symbols_table):
+                                      symbols_table, identifier_token):
             self.set_multiple_declaration_error(identifier_token)
 
     def exists_in_symbols_table(self, identifier_token, scope):
@@ -194,7 +275,7 @@ class SyntacticAndSemanticAnalyser():
     def add_parameter_to_symbol(self, symbol_identifier, parameter_token,
                                 parameter_type):
         if not self.symbols_table[symbol_identifier].add_parameter(
-                parameter_token.lexeme, parameter_type):
+                parameter_token.lexeme, parameter_type, parameter_token):
             self.set_multiple_declaration_error(parameter_token)
 
     def get_next_label(self):
@@ -236,96 +317,293 @@ class SyntacticAndSemanticAnalyser():
                 return '%s%s' % (parameter_1, parameter_2)
             return '%s %s' % (parameter_1, parameter_2)
 
-    def calculate_resulting_production_type(self, production1, production2):
-        if self.is_valid_operation(production1, production2):
-            return self.return_operation_type(production1, production2)
-        else:
-            self.set_invalid_type_error(production1)
-
-    def is_valid_operation(self, production1, production2,
-                           are_both_required=False):
-        valid_types = ['float', 'int', 'double']
-        is_production1_valid_type = production1.production_type in valid_types
-        is_production2_valid_type = production2.production_type in valid_types
-        if production1.place and production2.place and\
-                is_production1_valid_type and is_production2_valid_type:
-            return True
-        elif are_both_required:
-            return False
-        elif production1.place and is_production1_valid_type:
-            return True
-        else:
-            return False
+    def create_logical_production(self, operator, production1, production2):
+        """
+        A && or || production has no code until it is used: as a condition
+        it becomes jumping code, and as a value it is computed into its
+        place, both short-circuiting the second operand.
+        """
+        logical_production = Production()
+        logical_production.place = self.get_next_temporary_variable()
+        logical_production.add_temporary_variable(logical_production.place)
+        logical_production.inherit_metadata(production1)
+        logical_production.inherit_metadata(production2)
+        self.logical_conditions[logical_production.place] =\
+            (operator, production1, production2)
+        return logical_production
+
+    def add_comparison_condition(self, production, place_name1, operator,
+                                 place_name2):
+        # The negation of < and the like is not their opposite for NaN
+        is_negatable = operator in [u'==', u'!='] or\
+            production.production_type not in [FLOAT_TYPE, DOUBLE_TYPE]
+        self.comparison_conditions[production.place] = (
+            production.code[-1], place_name1, operator, place_name2,
+            is_negatable)
+
+    def get_comparison_condition(self, production):
+        comparison = self.comparison_conditions.get(production.place)
+        if comparison is None or not production.code or\
+                production.code[-1] != comparison[0]:
+            return None
+        return comparison[1:]
+
+    def get_logical_condition(self, production):
+        if production.code:
+            return None
+        return self.logical_conditions.get(production.place)
 
-    def return_operation_type(self, production1, production2):
-        if production1.place and production2.place:
-            if production2.production_type !=\
-                    production1.production_type:
-                if production1.production_type == 'double' or\
-                        production2.production_type == 'double':
-                    return 'double'
-                return 'float'
+    def generate_condition_code(self, production, scope, true_label,
+                                false_label):
+        """
+        Returns the code that jumps to true_label if the production is not 0
+        and to false_label otherwise, falling through when the label is None.
+        """
+        condition = self.get_logical_condition(production)
+        comparison = self.get_comparison_condition(production)
+        if comparison is not None:
+            # The comparison is fused with the branch, without its temporary
+            place_name1, operator, place_name2, is_negatable = comparison
+            code = production.code[:-1]
+            if false_label and is_negatable:
+                code.append(self.generate_code(
+                    'if', place_name1,
+                    self.negated_comparison_operators[operator], place_name2,
+                    'goto', false_label))
+                if true_label:
+                    code.append(self.generate_code('goto', true_label))
+                return code
+            elif true_label:
+                code.append(self.generate_code(
+                    'if', place_name1, operator, place_name2, 'goto',
+                    true_label))
+                if false_label:
+                    code.append(self.generate_code('goto', false_label))
+                return code
+        if condition is None:
+            place_name = self.get_localized_identifier(
+                production.place, scope) or production.place
+            code = list(production.code)
+            if false_label:
+                code.append(self.generate_code(
+                    'if', place_name, '=', '0', 'goto', false_label))
+                if true_label:
+                    code.append(self.generate_code('goto', true_label))
             else:
-                return production1.production_type
+                code.append(self.generate_code(
+                    'if', place_name, '!=', '0', 'goto', true_label))
+            return code
+        del self.logical_conditions[production.place]
+        operator, production1, production2 = condition
+        if operator == u'&&':
+            label = false_label or self.get_next_label()
+            code = self.generate_condition_code(production1, scope, None,
+                                                label)
         else:
-            return production1.production_type
+            label = true_label or self.get_next_label()
+            code = self.generate_condition_code(production1, scope, label,
+                                                None)
+        code.extend(self.generate_condition_code(production2, scope,
+                                                 true_label, false_label))
+        if label not in [true_label, false_label]:
+            code.append(self.generate_code(label, ':'))
+        return code
+
+    def get_value_production(self, production, scope):
+        if self.get_logical_condition(production) is None:
+            return production
+        false_label = self.get_next_label()
+        end_label = self.get_next_label()
+        value_production = Production()
+        value_production.place = production.place
+        value_production.production_type = production.production_type
+        value_production.inherit_metadata(production)
+        value_production.append_code(self.generate_condition_code(
+            production, scope, None, false_label))
+        value_production.append_code([
+            self.generate_code(production.place, ':=', '1'),
+            self.generate_code('goto', end_label),
+            self.generate_code(false_label, ':'),
+            self.generate_code(production.place, ':=', '0'),
+            self.generate_code(end_label, ':')
+        ])
+        return value_production
+
+    def generate_switch_code(self, switch, place_name, cases, default_label):
+        """
+        Jumps to the label of the (value, label) case equal to place_name, or
+        to default_label: through a jump table when the values are dense, and
+        through a binary search over them otherwise.
+        """
+        cases = sorted(cases)
+        if len(cases) < self.jump_table_min_cases or\
+                cases[-1][0] - cases[0][0] >= len(cases) * 2:
+            return self.generate_decision_tree_code(place_name, cases,
+                                                    default_label)
+        lowest_value = cases[0][0]
+        highest_value = cases[-1][0]
+        code = [
+            self.generate_code('if', place_name, '<', str(lowest_value),
+                               'goto', default_label),
+            self.generate_code('if', place_name, '>', str(highest_value),
+                               'goto', default_label)
+        ]
+        index_place = place_name
+        if lowest_value != 0:
+            index_place = self.get_next_temporary_variable()
+            switch.add_temporary_variable(index_place)
+            code.append(self.generate_code(index_place, ':=', place_name,
+                                           '-', str(lowest_value)))
+        case_labels = dict(cases)
+        table = [case_labels.get(value, default_label)
+                 for value in range(lowest_value, highest_value + 1)]
+        code.append(self.generate_code('goto', '[%s]' % (', '.join(table)),
+                                       index_place))
+        return code
+
+    def generate_decision_tree_code(self, place_name, cases, default_label):
+        if len(cases) < self.decision_tree_min_cases:
+            code = [self.generate_code('if', place_name, '==', str(value),
+                                       'goto', label)
+                    for value, label in cases]
+            code.append(self.generate_code('goto', default_label))
+            return code
+        middle = len(cases) / 2
+        upper_label = self.get_next_label()
+        code = [self.generate_code('if', place_name, '>=',
+                                   str(cases[middle][0]), 'goto',
+                                   upper_label)]
+        code.extend(self.generate_decision_tree_code(
+            place_name, cases[:middle], default_label))
+        code.append(self.generate_code(upper_label, ':'))
+        code.extend(self.generate_decision_tree_code(
+            place_name, cases[middle:], default_label))
+        return code
+
+    def is_value_operand(self, before_index, after_index):
+        """
+        Whether the parenthesised expression between the tokens is an operand
+        of an operator other than && and ||. Otherwise its value, if needed,
+        is computed by the enclosing expression.
+        """
+        token_before = self.get_specific_token(before_index)\
+            if before_index >= 0 else None
+        token_after = self.get_specific_token(after_index)
+        return any(token is not None and
+                   token.lexeme in self.value_operator_list
+                   for token in [token_before, token_after])
+
+    def get_declared_type(self, modifiers, defined_type):
+        if modifiers:
+            return get_type(defined_type.base_type,
+                            tuple(modifiers.split(u' ')),
+                            defined_type.specifiers)
+        return defined_type
 
-    def process_tokens(self, print_all):
-        program = self.check_program()
-        if program and self.token_index == len(self.tokens_list):
-            if print_all:
-                self.print_symbols_table()
-                self.print_intermediary_code(program)
-                self.print_warnings()
-            else:
-                print 'OK.'
+    def calculate_resulting_production_type(self, production1, production2):
+        promotions = promotion_table.get(production1.production_type)\
+            if production1.place else None
+        if promotions:
+            right_side_type = production2.production_type\
+                if production2.place else production1.production_type
+            if right_side_type in promotions:
+                return promotions[right_side_type]
+        self.set_invalid_type_error(production1)
+
+    def get_root_functions(self):
+        '''
+        Returns the functions called by the global initialisers, which are
+        reached without setup and loop.
+        '''
+        return [instruction.argument1 for instruction in
+                parse_code(self.definitions_code.code)
+                if instruction.kind == 'call']
+
+    def optimise_code(self, program, optimisation_level):
+        pass_manager = get_pass_manager(
+            optimisation_level, self.symbols_table.get_localized_types(),
+            self.temporary_variable_index, self.label_index,
+            self.get_root_functions(),
+            self.symbols_table.get_function_locals(),
+            self.symbols_table.get_function_summaries())
+        if not pass_manager.passes:
+            return pass_manager
+        self.data_image, self.definitions_code.code = build_data_image(
+            self.definitions_code.code,
+            self.symbols_table.get_localized_types(), program.code)
+        instructions = pass_manager.run(parse_code(program.code))
+        self.temporary_variable_index = max(
+            self.temporary_variable_index,
+            get_next_temporary_variable_index(instructions))
+        self.label_index = max(self.label_index,
+                               get_next_label_index(instructions))
+        program.code = generate_code(instructions)
+        return pass_manager
+
+    def get_compilation_result(self, program):
+        if self.errors:
+            errors = [unicode(error) for error in self.errors]
+        elif not program or self.token_index != len(self.tokens_list):
+            errors = [unicode(self.error)]
         else:
-            print self.error
-
-    def print_separator(self):
-        print '-' * 40
-
-    def print_symbols_table(self):
-        print
-        print 'Symbols\' Table'
-        print '---------------'
-        print
-        self.symbols_table.print_all()
-        print
-        self.print_separator()
-
-    def print_intermediary_code(self, program):
-        print
-        print 'Intermediary Code'
-        print '-----------------'
-        print
-        self.definitions_code.print_all()
-        print 'goto main'
-        program.print_all()
-        print
-        self.print_separator()
-
-    def print_warnings(self):
-        print
-        if self.warnings:
-            print 'Warning(s)'
-            print '----------'
-            print
-            for warning in self.warnings:
-                print warning
-            print
-            self.print_separator()
+            errors = []
+        if errors:
+            return CompilationResult(errors, max_errors=self.max_errors)
+        return CompilationResult(
+            [], self.symbols_table.get_lines(), self.definitions_code.code,
+            program.code, [unicode(warning) for warning in self.warnings],
+            self.max_errors, get_data_image_lines(self.data_image))
+
+    def plan_memory(self, program):
+        global_variables = [
+            identifier for identifier, symbol in
+            self.symbols_table.elements.items() if not symbol.is_function]
+        return MemoryPlanner(self.symbols_table.get_localized_types(),
+                             global_variables,
+                             self.symbols_table.get_function_locals()).plan(
+            parse_code(self.definitions_code.code), parse_code(program.code))
+
+    def process_tokens(self, print_all, optimisation_level=0,
+                       print_pass_statistics=False,
+                       print_function_report=False,
+                       print_memory_layout=False):
+        program = self.check_program()
+        pass_manager = None
+        function_sizes = None
+        if not self.errors and program and\
+                self.token_index == len(self.tokens_list):
+            # Before the optimisation, which drops the unreachable functions
+            function_sizes = get_function_sizes(parse_code(program.code),
+                                                self.get_root_functions())
+            pass_manager = self.optimise_code(program, optimisation_level)
+        result = self.get_compilation_result(program)
+        result.print_all(print_all)
+        if print_pass_statistics and pass_manager:
+            pass_manager.print_statistics()
+        if print_function_report and function_sizes is not None:
+            print_function_sizes(function_sizes)
+        if print_memory_layout and function_sizes is not None:
+            self.plan_memory(program).print_all()
+        return result
+
+    def print_errors(self):
+        CompilationResult([unicode(error) for error in self.errors],
+                          max_errors=self.max_errors).print_errors()
 
     def check_program(self):
         return self.check_definitions_list(scope=u'_global_')
 
     def check_definitions_list(self, scope):
         definitions_list = Production()
-        definition = self.check_definition(scope=scope)
+        try:
+            definition = self.check_definition(scope=scope)
+        except PanicModeError:
+            self.synchronise(False)
+            definition = Production()
         if definition:
             definitions_list1 = self.check_definitions_list(scope=scope)
-            definitions_list.append_code(definition.code)
-            definitions_list.append_code(definitions_list1.code)
+            definitions_list.append_production(definition)
+            definitions_list.append_production(definitions_list1)
             return definitions_list
         return definitions_list
 
@@ -337,8 +615,8 @@ class SyntacticAndSemanticAnalyser():
             modifiers = None if type(modifiers_return) is bool\
                 else modifiers_return
             return_type_return = self.check_return_type()
-            return_type = u'%s %s' % (modifiers, return_type_return)\
-                if modifiers else u'%s' % (return_type_return)
+            return_type = self.get_declared_type(modifiers,
+                                                 return_type_return)
             index = self.token_index
             token = self.get_specific_token(index)
             if token:
@@ -361,18 +639,26 @@ class SyntacticAndSemanticAnalyser():
                                 identifier_token.lexeme, ':',
                                 code_type='label')
                             definition.append_code(new_production)
-                            definition.append_code(definition_parentheses.code)
+                            definition.append_production(definition_parentheses)
                             # TODO: Verificar uma solução melhor
                             # Falha no caso if_elseif_else
                             if 'return' not in definition.code[-1]:
                                 definition_place =\
                                     self.get_next_temporary_variable()
+                                definition.add_temporary_variable(
+                                    definition_place)
                                 new_production = self.generate_code(
                                     definition_place, ':=', '0')
                                 new_production2 = self.generate_code(
                                     'return', definition_place)
                                 definition.append_code(new_production)
                                 definition.append_code(new_production2)
+                            symbol = self.symbols_table[
+                                identifier_token.lexeme]
+                            symbol.contains_call = definition.contains_call
+                            # Without the label
+                            symbol.instruction_count =\
+                                definition.get_instruction_count() - 1
                             return definition
                         # Likely to be a declaration with assignment
                         elif token.token_type == u'T_ASSIGN':
@@ -432,8 +718,8 @@ class SyntacticAndSemanticAnalyser():
                         self.log_message(token)
                         self.token_index += 1
                         definition_assign = Production()
-                        definition_assign.append_code(right_side_declaration.code)
-                        definition_assign.append_code(more_declarations.code)
+                        definition_assign.append_production(right_side_declaration)
+                        definition_assign.append_production(more_declarations)
                         definition_assign.place = right_side_declaration.place
                         return definition_assign
                     self.set_syntactic_error(u'T_SEMICOLON', token)
@@ -468,10 +754,10 @@ class SyntacticAndSemanticAnalyser():
                                         self.log_message(token)
                                         self.token_index = index + 1
                                         definition_parentheses = Production()
-                                        definition_parentheses.append_code(
-                                            parameters_list.code)
-                                        definition_parentheses.append_code(
-                                            commands_list.code)
+                                        definition_parentheses.append_production(
+                                            parameters_list)
+                                        definition_parentheses.append_production(
+                                            commands_list)
                                         return definition_parentheses
                                     self.set_syntactic_error(
                                         u'T_CURLY_BRACKET_CLOSE', token)
@@ -489,8 +775,8 @@ class SyntacticAndSemanticAnalyser():
         parameter = self.check_parameter(scope, 0)
         if parameter:
             more_parameters = self.check_more_parameters(scope, 1)
-            parameters_list.append_code(parameter.code)
-            parameters_list.append_code(more_parameters.code)
+            parameters_list.append_production(parameter)
+            parameters_list.append_production(more_parameters)
             return parameters_list
         return parameters_list
 
@@ -506,8 +792,8 @@ class SyntacticAndSemanticAnalyser():
                 if parameter:
                     more_parameters1 = self.check_more_parameters(
                         scope, parameter_index + 1)
-                    more_parameters.append_code(parameter.code)
-                    more_parameters.append_code(more_parameters1.code)
+                    more_parameters.append_production(parameter)
+                    more_parameters.append_production(more_parameters1)
                     return more_parameters
                 else:
                     # Expected a parameter after a comma
@@ -522,8 +808,7 @@ class SyntacticAndSemanticAnalyser():
             else modifiers_return
         type_return = self.check_type()
         if type_return:
-            parameter_type = u'%s %s' % (modifiers, type_return)\
-                if modifiers else u'%s' % (type_return)
+            parameter_type = self.get_declared_type(modifiers, type_return)
             index = self.token_index
             token = self.get_specific_token(index)
             if token:
@@ -597,8 +882,9 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 self.token_index = index + 1
                 if specifiers:
-                    return u'%s %s' % (specifiers, token.lexeme)
-                return u'%s' % (token.lexeme)
+                    return get_type(token.lexeme,
+                                    specifiers=tuple(specifiers.split(u' ')))
+                return get_type(token.lexeme)
             return False
         self.set_eof_error(u'T_RESERVED_WORD')
 
@@ -614,8 +900,9 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 self.token_index = index + 1
                 if specifiers:
-                    return u'%s %s' % (specifiers, token.lexeme)
-                return u'%s' % (token.lexeme)
+                    return get_type(token.lexeme,
+                                    specifiers=tuple(specifiers.split(u' ')))
+                return get_type(token.lexeme)
             self.set_syntactic_error(u'T_RESERVED_WORD', token)
         self.set_eof_error(u'T_RESERVED_WORD')
 
@@ -650,8 +937,8 @@ class SyntacticAndSemanticAnalyser():
                                     self.log_message(token)
                                     self.token_index += 1
                                     standalone_declaration = Production()
-                                    standalone_declaration.append_code(
-                                        right_side_declaration.code)
+                                    standalone_declaration.append_production(
+                                        right_side_declaration)
                                     return standalone_declaration
                                 self.set_syntactic_error(u'T_SEMICOLON', token)
                             self.set_eof_error(u'T_SEMICOLON')
@@ -701,8 +988,8 @@ class SyntacticAndSemanticAnalyser():
                     more_declarations1 =\
                         self.check_more_declarations(return_type, scope)
                     more_declarations = Production()
-                    more_declarations.append_code(declaration.code)
-                    more_declarations.append_code(more_declarations1.code)
+                    more_declarations.append_production(declaration)
+                    more_declarations.append_production(more_declarations1)
                     return more_declarations
                 # TODO: Verify if the line below is valid in any way
                 token = self.get_specific_token(self.token_index)
@@ -746,7 +1033,7 @@ class SyntacticAndSemanticAnalyser():
                     scope)
                 right_side_declaration = Production()
                 right_side_declaration.place = right_side_expression.place
-                right_side_declaration.append_code(right_side_expression.code)
+                right_side_declaration.append_production(right_side_expression)
                 if right_side_expression.place:
                     if return_type != right_side_expression.production_type:
                         self.set_implicit_conversion_warning(
@@ -769,11 +1056,15 @@ class SyntacticAndSemanticAnalyser():
         Ø
         """
         commands_list = Production()
-        command = self.check_command(scope)
+        try:
+            command = self.check_command(scope)
+        except PanicModeError:
+            self.synchronise(True)
+            command = Production()
         if command:
             commands_list1 = self.check_commands_list(scope)
-            commands_list.append_code(command.code)
-            commands_list.append_code(commands_list1.code)
+            commands_list.append_production(command)
+            commands_list.append_production(commands_list1)
             return commands_list
         return commands_list
 
@@ -781,36 +1072,16 @@ class SyntacticAndSemanticAnalyser():
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
-            if token.token_type == u'T_ID':
-                expression = self.check_expression(scope)
-                return expression
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'while':
-                command = self.check_while(scope)
-                return command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'do':
-                command = self.check_do_while(scope)
-                return command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'for':
-                _for = self.check_for(scope)
-                return _for
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'if':
-                _if = self.check_if(scope)
-                return _if
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'return':
-                command = self.check_return(scope)
-                return command
+            statement = self.get_statement_production(token, False)
+            if statement:
+                return self.check_statement(statement, scope, None, None)
             elif token.token_type != u'T_CURLY_BRACKET_CLOSE':
                 modifiers_return = self.check_modifiers_list()
                 modifiers = None if type(modifiers_return) is bool\
                     else modifiers_return
                 return_type_return = self.check_return_type()
-                return_type = u'%s %s' % (modifiers, return_type_return)\
-                    if modifiers else u'%s' % (return_type_return)
+                return_type = self.get_declared_type(modifiers,
+                                                     return_type_return)
                 standalone_declaration =\
                     self.check_standalone_declaration(return_type, scope)
                 return standalone_declaration
@@ -822,13 +1093,17 @@ class SyntacticAndSemanticAnalyser():
         Ø
         """
         block_commands_list = Production()
-        block_command = self.check_block_command(
-            scope, break_label, continue_label)
+        try:
+            block_command = self.check_block_command(
+                scope, break_label, continue_label)
+        except PanicModeError:
+            self.synchronise(True)
+            block_command = Production()
         if block_command:
             block_commands_list1 = self.check_block_commands_list(
                 scope, break_label, continue_label)
-            block_commands_list.append_code(block_command.code)
-            block_commands_list.append_code(block_commands_list1.code)
+            block_commands_list.append_production(block_command)
+            block_commands_list.append_production(block_commands_list1)
             return block_commands_list
         return block_commands_list
 
@@ -836,37 +1111,27 @@ class SyntacticAndSemanticAnalyser():
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
-            if token.token_type == u'T_ID':
-                block_command = self.check_expression(scope)
-                return block_command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'while':
-                block_command = self.check_while(scope)
-                return block_command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'do':
-                block_command = self.check_do_while(scope)
-                return block_command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'for':
-                block_command = self.check_for(scope)
-                return block_command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'if':
-                block_command = self.check_if(
-                    scope, break_label, continue_label)
-                return block_command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    (token.lexeme == u'break' or token.lexeme == u'continue'):
-                block_command = self.check_single_word_command(
-                    scope, break_label, continue_label)
-                return block_command
-            elif token.token_type == u'T_RESERVED_WORD' and\
-                    token.lexeme == u'return':
-                block_command = self.check_return(scope)
-                return block_command
+            statement = self.get_statement_production(token, True)
+            if statement:
+                return self.check_statement(statement, scope, break_label,
+                                            continue_label)
             return False
 
+    def get_statement_production(self, token, inside_block):
+        if token.token_type == u'T_RESERVED_WORD':
+            statement = self.statement_production_table.get(token.lexeme)
+        else:
+            statement = self.statement_production_table.get(token.token_type)
+        if statement and (inside_block or not statement[2]):
+            return statement
+        return None
+
+    def check_statement(self, statement, scope, break_label, continue_label):
+        check_method, receives_labels = statement[:2]
+        if receives_labels:
+            return check_method(scope, break_label, continue_label)
+        return check_method(scope)
+
     def check_single_word_command(self, scope, break_label, continue_label):
         index = self.token_index
         token = self.get_specific_token(index)
@@ -923,7 +1188,7 @@ class SyntacticAndSemanticAnalyser():
                                 'return', right_side_expression_name,
                                 function_token.get_parameters_length(),
                                 code_type='return')
-                            return_.append_code(right_side_expression.code)
+                            return_.append_production(right_side_expression)
                             return_.append_code(new_production)
                             return return_
                         self.set_syntactic_error(u'T_SEMICOLON', token)
@@ -950,14 +1215,14 @@ class SyntacticAndSemanticAnalyser():
                         left_side_expression_name,
                         left_side_expression.operator,
                         right_side_expression_name)
-                    expression.append_code(right_side_expression.code)
+                    expression.append_production(right_side_expression)
                     expression.append_code(new_production)
+                    expression.has_side_effects = True
                     return expression
                 else:
                     expression = Production()
-                    if any('call' in string for string
-                           in right_side_expression.code):
-                        expression.append_code(right_side_expression.code)
+                    if right_side_expression.has_side_effects:
+                        expression.append_production(right_side_expression)
                     return expression
             self.set_syntactic_error(u'T_SEMICOLON', token)
         self.set_eof_error(u'T_SEMICOLON')
@@ -1000,21 +1265,19 @@ class SyntacticAndSemanticAnalyser():
 
     def check_right_side_expression(self, scope):
         right_side_expression = self.check_logical_or(scope)
-        return right_side_expression
+        return self.get_value_production(right_side_expression, scope)
 
     def check_logical_or(self, scope):
         logical_and = self.check_logical_and(scope)
-        logical_or_helper = self.check_logical_or_helper(
-            scope, logical_and.place, logical_and.code,
-            logical_and.production_type)
+        logical_or_helper = self.check_logical_or_helper(scope, logical_and)
         logical_or = Production()
         logical_or.place = logical_or_helper.place
         logical_or.code = logical_or_helper.code
         logical_or.production_type = logical_or_helper.production_type
+        logical_or.inherit_metadata(logical_or_helper)
         return logical_or
 
-    def check_logical_or_helper(self, scope, inherited_place, inherited_code,
-                                inherited_production_type):
+    def check_logical_or_helper(self, scope, inherited_production):
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
@@ -1022,58 +1285,44 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 index = self.token_index = index + 1
                 logical_and = self.check_logical_and(scope)
-                logical_or_helper1_place = self.get_next_temporary_variable()
-                logical_or_helper1_code = StandaloneCodeManager()
-                logical_or_helper1_code.append_code(inherited_code)
-                logical_or_helper1_code.append_code(logical_and.code)
-                logical_or_helper1_name = self.get_localized_identifier(
-                    logical_or_helper1_place, scope)
-                inherited_place_name = self.get_localized_identifier(
-                    inherited_place, scope)
-                logical_and_place_name = self.get_localized_identifier(
-                    logical_and.place, scope)
-                new_production =\
-                    self.generate_code(logical_or_helper1_name, ':=',
-                                       inherited_place_name, token.lexeme,
-                                       logical_and_place_name)
-                logical_or_helper1_code.append_code(new_production)
+                logical_or_helper1 = self.create_logical_production(
+                    token.lexeme, inherited_production, logical_and)
                 '''
                 Logical operators do not perform the usual arithmetic
                 conversions. Instead, they evaluate each operand in terms of
                 its equivalence to 0. The result of a logical operation is
                 either 0 or 1. The result's type is int.
                 '''
-                logical_or_helper1_production_type = 'int'
-                logical_or_helper1 = self.check_logical_or_helper(
-                    scope, logical_or_helper1_place,
-                    logical_or_helper1_code.code,
-                    logical_or_helper1_production_type)
+                logical_or_helper1.production_type = INT_TYPE
+                logical_or_helper2 = self.check_logical_or_helper(
+                    scope, logical_or_helper1)
                 logical_or_helper = Production()
-                logical_or_helper.place = logical_or_helper1.place
-                logical_or_helper.code = logical_or_helper1.code
+                logical_or_helper.place = logical_or_helper2.place
+                logical_or_helper.code = logical_or_helper2.code
                 logical_or_helper.production_type =\
-                    logical_or_helper1.production_type
+                    logical_or_helper2.production_type
+                logical_or_helper.inherit_metadata(logical_or_helper2)
                 return logical_or_helper
             logical_or_helper = Production()
-            logical_or_helper.place = inherited_place
-            logical_or_helper.code = inherited_code
-            logical_or_helper.production_type = inherited_production_type
+            logical_or_helper.place = inherited_production.place
+            logical_or_helper.code = inherited_production.code
+            logical_or_helper.production_type =\
+                inherited_production.production_type
+            logical_or_helper.inherit_metadata(inherited_production)
             return logical_or_helper
         self.set_eof_error(u'T_OR operator')
 
     def check_logical_and(self, scope):
         equality = self.check_equality(scope)
-        logical_and_helper = self.check_logical_and_helper(
-            scope, equality.place, equality.code,
-            equality.production_type)
+        logical_and_helper = self.check_logical_and_helper(scope, equality)
         logical_and = Production()
         logical_and.place = logical_and_helper.place
         logical_and.code = logical_and_helper.code
         logical_and.production_type = logical_and_helper.production_type
+        logical_and.inherit_metadata(logical_and_helper)
         return logical_and
 
-    def check_logical_and_helper(self, scope, inherited_place, inherited_code,
-                                 inherited_production_type):
+    def check_logical_and_helper(self, scope, inherited_production):
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
@@ -1081,58 +1330,44 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 index = self.token_index = index + 1
                 equality = self.check_equality(scope)
-                logical_and_helper1_place = self.get_next_temporary_variable()
-                logical_and_helper1_code = StandaloneCodeManager()
-                logical_and_helper1_code.append_code(inherited_code)
-                logical_and_helper1_code.append_code(equality.code)
-                logical_and_helper1_name = self.get_localized_identifier(
-                    logical_and_helper1_place, scope)
-                inherited_place_name = self.get_localized_identifier(
-                    inherited_place, scope)
-                equality_place_name = self.get_localized_identifier(
-                    equality.place, scope)
-                new_production =\
-                    self.generate_code(logical_and_helper1_name, ':=',
-                                       inherited_place_name, token.lexeme,
-                                       equality_place_name)
-                logical_and_helper1_code.append_code(new_production)
+                logical_and_helper1 = self.create_logical_production(
+                    token.lexeme, inherited_production, equality)
                 '''
                 Logical operators do not perform the usual arithmetic
                 conversions. Instead, they evaluate each operand in terms of
                 its equivalence to 0. The result of a logical operation is
                 either 0 or 1. The result's type is int.
                 '''
-                logical_and_helper1_production_type = 'int'
-                logical_and_helper1 = self.check_logical_and_helper(
-                    scope, logical_and_helper1_place,
-                    logical_and_helper1_code.code,
-                    logical_and_helper1_production_type)
+                logical_and_helper1.production_type = INT_TYPE
+                logical_and_helper2 = self.check_logical_and_helper(
+                    scope, logical_and_helper1)
                 logical_and_helper = Production()
-                logical_and_helper.place = logical_and_helper1.place
-                logical_and_helper.code = logical_and_helper1.code
+                logical_and_helper.place = logical_and_helper2.place
+                logical_and_helper.code = logical_and_helper2.code
                 logical_and_helper.production_type =\
-                    logical_and_helper1.production_type
+                    logical_and_helper2.production_type
+                logical_and_helper.inherit_metadata(logical_and_helper2)
                 return logical_and_helper
             logical_and_helper = Production()
-            logical_and_helper.place = inherited_place
-            logical_and_helper.code = inherited_code
-            logical_and_helper.production_type = inherited_production_type
+            logical_and_helper.place = inherited_production.place
+            logical_and_helper.code = inherited_production.code
+            logical_and_helper.production_type =\
+                inherited_production.production_type
+            logical_and_helper.inherit_metadata(inherited_production)
             return logical_and_helper
         self.set_eof_error(u'logical_and operator')
 
     def check_equality(self, scope):
         relational = self.check_relational(scope)
-        equality_helper = self.check_equality_helper(
-            scope, relational.place, relational.code,
-            relational.production_type)
+        equality_helper = self.check_equality_helper(scope, relational)
         equality = Production()
         equality.place = equality_helper.place
         equality.code = equality_helper.code
         equality.production_type = equality_helper.production_type
+        equality.inherit_metadata(equality_helper)
         return equality
 
-    def check_equality_helper(self, scope, inherited_place, inherited_code,
-                              inherited_production_type):
+    def check_equality_helper(self, scope, inherited_production):
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
@@ -1140,57 +1375,57 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 index = self.token_index = index + 1
                 relational = self.check_relational(scope)
-                equality_helper1_place = self.get_next_temporary_variable()
-                equality_helper1_code = StandaloneCodeManager()
-                equality_helper1_code.append_code(inherited_code)
-                equality_helper1_code.append_code(relational.code)
+                equality_helper1 = Production()
+                equality_helper1.place = self.get_next_temporary_variable()
+                equality_helper1.add_temporary_variable(equality_helper1.place)
+                equality_helper1.append_production(inherited_production)
+                equality_helper1.append_production(relational)
                 equality_helper1_name = self.get_localized_identifier(
-                    equality_helper1_place, scope)
+                    equality_helper1.place, scope)
                 inherited_place_name = self.get_localized_identifier(
-                    inherited_place, scope)
+                    inherited_production.place, scope)
                 relational_place_name = self.get_localized_identifier(
                     relational.place, scope)
                 new_production =\
                     self.generate_code(equality_helper1_name, ':=',
                                        inherited_place_name, token.lexeme,
                                        relational_place_name)
-                equality_helper1_code.append_code(new_production)
-                mock_production = Production()
-                mock_production.place = inherited_place
-                mock_production.code = inherited_code
-                mock_production.production_type = inherited_production_type
-                equality_helper1_production_type =\
-                    self.calculate_resulting_production_type(mock_production,
-                                                             relational)
-                equality_helper1 = self.check_equality_helper(
-                    scope, equality_helper1_place, equality_helper1_code.code,
-                    equality_helper1_production_type)
+                equality_helper1.append_code(new_production)
+                equality_helper1.production_type =\
+                    self.calculate_resulting_production_type(
+                        inherited_production, relational)
+                self.add_comparison_condition(
+                    equality_helper1, inherited_place_name, token.lexeme,
+                    relational_place_name)
+                equality_helper2 = self.check_equality_helper(
+                    scope, equality_helper1)
                 equality_helper = Production()
-                equality_helper.place = equality_helper1.place
-                equality_helper.code = equality_helper1.code
+                equality_helper.place = equality_helper2.place
+                equality_helper.code = equality_helper2.code
                 equality_helper.production_type =\
-                    equality_helper1.production_type
+                    equality_helper2.production_type
+                equality_helper.inherit_metadata(equality_helper2)
                 return equality_helper
             equality_helper = Production()
-            equality_helper.place = inherited_place
-            equality_helper.code = inherited_code
-            equality_helper.production_type = inherited_production_type
+            equality_helper.place = inherited_production.place
+            equality_helper.code = inherited_production.code
+            equality_helper.production_type =\
+                inherited_production.production_type
+            equality_helper.inherit_metadata(inherited_production)
             return equality_helper
         self.set_eof_error(u'equality operator')
 
     def check_relational(self, scope):
         additive = self.check_additive(scope)
-        relational_helper = self.check_relational_helper(
-            scope, additive.place, additive.code,
-            additive.production_type)
+        relational_helper = self.check_relational_helper(scope, additive)
         relational = Production()
         relational.place = relational_helper.place
         relational.code = relational_helper.code
         relational.production_type = relational_helper.production_type
+        relational.inherit_metadata(relational_helper)
         return relational
 
-    def check_relational_helper(self, scope, inherited_place, inherited_code,
-                                inherited_production_type):
+    def check_relational_helper(self, scope, inherited_production):
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
@@ -1198,61 +1433,59 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 index = self.token_index = index + 1
                 additive = self.check_additive(scope)
-                relational_helper1_place = self.get_next_temporary_variable()
-                relational_helper1_code = StandaloneCodeManager()
-                relational_helper1_code.append_code(inherited_code)
-                relational_helper1_code.append_code(additive.code)
+                relational_helper1 = Production()
+                relational_helper1.place = self.get_next_temporary_variable()
+                relational_helper1.add_temporary_variable(
+                    relational_helper1.place)
+                relational_helper1.append_production(inherited_production)
+                relational_helper1.append_production(additive)
                 relational_helper1_name = self.get_localized_identifier(
-                    relational_helper1_place, scope)
+                    relational_helper1.place, scope)
                 inherited_place_name = self.get_localized_identifier(
-                    inherited_place, scope)
+                    inherited_production.place, scope)
                 additive_place_name = self.get_localized_identifier(
                     additive.place, scope)
                 new_production =\
                     self.generate_code(relational_helper1_name, ':=',
                                        inherited_place_name, token.lexeme,
                                        additive_place_name)
-                relational_helper1_code.append_code(new_production)
+                relational_helper1.append_code(new_production)
                 # Type checking
-                mock_production = Production()
-                mock_production.place = inherited_place
-                mock_production.code = inherited_code
-                mock_production.production_type = inherited_production_type
-
-                relational_helper1_production_type =\
-                    self.calculate_resulting_production_type(mock_production,
-                                                             additive)
-
-                relational_helper1 = self.check_relational_helper(
-                    scope, relational_helper1_place,
-                    relational_helper1_code.code,
-                    relational_helper1_production_type)
+                relational_helper1.production_type =\
+                    self.calculate_resulting_production_type(
+                        inherited_production, additive)
+                self.add_comparison_condition(
+                    relational_helper1, inherited_place_name, token.lexeme,
+                    additive_place_name)
+                relational_helper2 = self.check_relational_helper(
+                    scope, relational_helper1)
                 relational_helper = Production()
-                relational_helper.place = relational_helper1.place
-                relational_helper.code = relational_helper1.code
+                relational_helper.place = relational_helper2.place
+                relational_helper.code = relational_helper2.code
                 relational_helper.production_type =\
-                    relational_helper1.production_type
+                    relational_helper2.production_type
+                relational_helper.inherit_metadata(relational_helper2)
                 return relational_helper
             relational_helper = Production()
-            relational_helper.place = inherited_place
-            relational_helper.code = inherited_code
-            relational_helper.production_type = inherited_production_type
+            relational_helper.place = inherited_production.place
+            relational_helper.code = inherited_production.code
+            relational_helper.production_type =\
+                inherited_production.production_type
+            relational_helper.inherit_metadata(inherited_production)
             return relational_helper
         self.set_eof_error(u'relational operator')
 
     def check_additive(self, scope):
         multiplicative = self.check_multiplicative(scope)
-        additive_helper = self.check_additive_helper(
-            scope, multiplicative.place, multiplicative.code,
-            multiplicative.production_type)
+        additive_helper = self.check_additive_helper(scope, multiplicative)
         additive = Production()
         additive.place = additive_helper.place
         additive.code = additive_helper.code
         additive.production_type = additive_helper.production_type
+        additive.inherit_metadata(additive_helper)
         return additive
 
-    def check_additive_helper(self, scope, inherited_place, inherited_code,
-                              inherited_production_type):
+    def check_additive_helper(self, scope, inherited_production):
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
@@ -1260,57 +1493,56 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 index = self.token_index = index + 1
                 multiplicative = self.check_multiplicative(scope)
-                additive_helper1_place = self.get_next_temporary_variable()
-                additive_helper1_code = StandaloneCodeManager()
-                additive_helper1_code.append_code(inherited_code)
-                additive_helper1_code.append_code(multiplicative.code)
+                additive_helper1 = Production()
+                additive_helper1.place = self.get_next_temporary_variable()
+                additive_helper1.add_temporary_variable(additive_helper1.place)
+                additive_helper1.append_production(inherited_production)
+                additive_helper1.append_production(multiplicative)
                 additive_helper1_name = self.get_localized_identifier(
-                    additive_helper1_place, scope)
+                    additive_helper1.place, scope)
                 inherited_place_name = self.get_localized_identifier(
-                    inherited_place, scope)
+                    inherited_production.place, scope)
                 multiplicative_place_name = self.get_localized_identifier(
                     multiplicative.place, scope)
                 new_production =\
                     self.generate_code(additive_helper1_name, ':=',
                                        inherited_place_name, token.lexeme,
                                        multiplicative_place_name)
-                additive_helper1_code.append_code(new_production)
-                mock_production = Production()
-                mock_production.place = inherited_place
-                mock_production.code = inherited_code
-                mock_production.production_type = inherited_production_type
-                additive_helper1_production_type =\
-                    self.calculate_resulting_production_type(mock_production,
-                                                             multiplicative)
-                additive_helper1 = self.check_additive_helper(
-                    scope, additive_helper1_place, additive_helper1_code.code,
-                    additive_helper1_production_type)
+                additive_helper1.append_code(new_production)
+                additive_helper1.production_type =\
+                    self.calculate_resulting_production_type(
+                        inherited_production, multiplicative)
+                additive_helper2 = self.check_additive_helper(
+                    scope, additive_helper1)
                 additive_helper = Production()
-                additive_helper.place = additive_helper1.place
-                additive_helper.code = additive_helper1.code
+                additive_helper.place = additive_helper2.place
+                additive_helper.code = additive_helper2.code
                 additive_helper.production_type =\
-                    additive_helper1.production_type
+                    additive_helper2.production_type
+                additive_helper.inherit_metadata(additive_helper2)
                 return additive_helper
             additive_helper = Production()
-            additive_helper.place = inherited_place
-            additive_helper.code = inherited_code
-            additive_helper.production_type = inherited_production_type
+            additive_helper.place = inherited_production.place
+            additive_helper.code = inherited_production.code
+            additive_helper.production_type =\
+                inherited_production.production_type
+            additive_helper.inherit_metadata(inherited_production)
             return additive_helper
         self.set_eof_error(u'additive operator')
 
     def check_multiplicative(self, scope):
         unary_prefix = self.check_unary_prefix(scope)
         multiplicative_helper = self.check_multiplicative_helper(
-            scope, unary_prefix.place, unary_prefix.code,
-            unary_prefix.production_type)
+            scope, unary_prefix)
         multiplicative = Production()
         multiplicative.place = multiplicative_helper.place
         multiplicative.code = multiplicative_helper.code
-        multiplicative.production_type = multiplicative_helper.production_type
+        multiplicative.production_type =\
+            multiplicative_helper.production_type
+        multiplicative.inherit_metadata(multiplicative_helper)
         return multiplicative
 
-    def check_multiplicative_helper(self, scope, inherited_place,
-                                    inherited_code, inherited_production_type):
+    def check_multiplicative_helper(self, scope, inherited_production):
         index = self.token_index
         token = self.get_specific_token(index)
         if token:
@@ -1318,50 +1550,49 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 index = self.token_index = index + 1
                 unary_prefix = self.check_unary_prefix(scope)
-                multiplicative_helper1_place =\
+                # The operands of the remainder operator (%) must be integral
+                if token.lexeme == '%' and [
+                        inherited_production.production_type,
+                        unary_prefix.production_type] != [INT_TYPE, INT_TYPE]:
+                    self.set_invalid_operands_error(
+                        inherited_production.production_type,
+                        unary_prefix.production_type, token)
+                multiplicative_helper1 = Production()
+                multiplicative_helper1.place =\
                     self.get_next_temporary_variable()
-                multiplicative_helper1_code = StandaloneCodeManager()
-                multiplicative_helper1_code.append_code(inherited_code)
-                multiplicative_helper1_code.append_code(unary_prefix.code)
+                multiplicative_helper1.add_temporary_variable(
+                    multiplicative_helper1.place)
+                multiplicative_helper1.append_production(inherited_production)
+                multiplicative_helper1.append_production(unary_prefix)
                 multiplicative_helper1_name = self.get_localized_identifier(
-                    multiplicative_helper1_place, scope)
+                    multiplicative_helper1.place, scope)
                 inherited_place_name = self.get_localized_identifier(
-                    inherited_place, scope)
-                unary_prefix_name = self.get_localized_identifier(
+                    inherited_production.place, scope)
+                unary_prefix_place_name = self.get_localized_identifier(
                     unary_prefix.place, scope)
                 new_production =\
                     self.generate_code(multiplicative_helper1_name, ':=',
                                        inherited_place_name, token.lexeme,
-                                       unary_prefix_name)
-                multiplicative_helper1_code.append_code(new_production)
-                # The operands of the remainder operator (%) must be integral
-                if token.lexeme == '%' and\
-                        (inherited_production_type != 'int' or
-                         unary_prefix.production_type != 'int'):
-                    self.set_invalid_operands_error(
-                        inherited_production_type,
-                        unary_prefix.production_type, token)
-                mock_production = Production()
-                mock_production.place = inherited_place
-                mock_production.code = inherited_code
-                mock_production.production_type = inherited_production_type
-                multiplicative_helper1_production_type =\
+                                       unary_prefix_place_name)
+                multiplicative_helper1.append_code(new_production)
+                multiplicative_helper1.production_type =\
                     self.calculate_resulting_production_type(
-                        mock_production, unary_prefix)
-                multiplicative_helper1 = self.check_multiplicative_helper(
-                    scope, multiplicative_helper1_place,
-                    multiplicative_helper1_code.code,
-                    multiplicative_helper1_production_type)
+                        inherited_production, unary_prefix)
+                multiplicative_helper2 = self.check_multiplicative_helper(
+                    scope, multiplicative_helper1)
                 multiplicative_helper = Production()
-                multiplicative_helper.place = multiplicative_helper1.place
-                multiplicative_helper.code = multiplicative_helper1.code
+                multiplicative_helper.place = multiplicative_helper2.place
+                multiplicative_helper.code = multiplicative_helper2.code
                 multiplicative_helper.production_type =\
-                    multiplicative_helper1.production_type
+                    multiplicative_helper2.production_type
+                multiplicative_helper.inherit_metadata(multiplicative_helper2)
                 return multiplicative_helper
             multiplicative_helper = Production()
-            multiplicative_helper.place = inherited_place
-            multiplicative_helper.code = inherited_code
-            multiplicative_helper.production_type = inherited_production_type
+            multiplicative_helper.place = inherited_production.place
+            multiplicative_helper.code = inherited_production.code
+            multiplicative_helper.production_type =\
+                inherited_production.production_type
+            multiplicative_helper.inherit_metadata(inherited_production)
             return multiplicative_helper
         self.set_eof_error(u'multiplicative operator')
 
@@ -1379,7 +1610,8 @@ class SyntacticAndSemanticAnalyser():
                     if expression_element:
                         unary_prefix = Production()
                         unary_prefix.place = self.get_next_temporary_variable()
-                        unary_prefix.append_code(expression_element.code)
+                        unary_prefix.add_temporary_variable(unary_prefix.place)
+                        unary_prefix.append_production(expression_element)
                         new_production =\
                             self.generate_code(unary_prefix.place, ':=',
                                                unary_prefix_operator.lexeme,
@@ -1407,14 +1639,19 @@ class SyntacticAndSemanticAnalyser():
         if token:
             if token.token_type == u'T_PARENTHESES_OPEN':
                 self.log_message(token)
+                parentheses_index = index
                 self.token_index = index = index + 1
-                right_side_expression = self.check_right_side_expression(scope)
+                right_side_expression = self.check_logical_or(scope)
                 index = self.token_index
                 token = self.get_specific_token(self.token_index)
                 if token:
                     if token.token_type == u'T_PARENTHESES_CLOSE':
                         self.log_message(token)
                         self.token_index = index + 1
+                        if self.is_value_operand(parentheses_index - 1,
+                                                 index + 1):
+                            return self.get_value_production(
+                                right_side_expression, scope)
                         return right_side_expression
                     self.set_syntactic_error(u'T_PARENTHESES_CLOSE', token)
                 self.set_eof_error(u'T_PARENTHESES_CLOSE')
@@ -1423,22 +1660,15 @@ class SyntacticAndSemanticAnalyser():
                 self.token_index = index + 1
                 function_call = self.check_function_call(scope, token.lexeme)
                 expression_element = Production()
-                expression_element.code = function_call.code
+                expression_element.append_production(function_call)
                 if function_call.place:
                     expression_element.place = function_call.place
                 else:
                     expression_element.place = token.lexeme
                 if self.symbols_table.exists(token.lexeme, scope, True):
                     identifier = self.symbols_table.get(token.lexeme, scope)
-                    if 'int' in identifier.defined_type:
-                        expression_element.production_type = 'int'
-                    elif 'float' in identifier.defined_type:
-                        expression_element.production_type = 'float'
-                    elif 'double' in identifier.defined_type:
-                        expression_element.production_type = 'double'
-                    else:
-                        expression_element.production_type =\
-                            identifier.defined_type
+                    expression_element.production_type =\
+                        identifier.defined_type.value_type
                 else:
                     self.set_undeclared_variable_error(token)
                 return expression_element
@@ -1449,7 +1679,15 @@ class SyntacticAndSemanticAnalyser():
                 expression_element = Production()
                 expression_element.place = '1'\
                     if token.lexeme == u'true' else '0'
-                expression_element.production_type = 'int'
+                expression_element.production_type = INT_TYPE
+                return expression_element
+            elif token.token_type == u'T_RESERVED_WORD' and\
+                    token.lexeme in self.constants:
+                self.log_message(token)
+                self.token_index = index + 1
+                expression_element = Production()
+                expression_element.place = self.constants[token.lexeme]
+                expression_element.production_type = INT_TYPE
                 return expression_element
             elif token.token_type == u'T_INTEGER' or\
                     token.token_type == u'T_FLOAT':
@@ -1457,10 +1695,12 @@ class SyntacticAndSemanticAnalyser():
                 self.token_index = index + 1
                 expression_element = Production()
                 expression_element.place = self.get_next_temporary_variable()
+                expression_element.add_temporary_variable(
+                    expression_element.place)
                 if token.token_type == u'T_INTEGER':
-                    expression_element.production_type = 'int'
+                    expression_element.production_type = INT_TYPE
                 else:
-                    expression_element.production_type = 'float'
+                    expression_element.production_type = FLOAT_TYPE
                 new_production = self.generate_code(
                     expression_element.place, ':=', token.lexeme)
                 expression_element.append_code(new_production)
@@ -1487,14 +1727,18 @@ class SyntacticAndSemanticAnalyser():
                         function_call = Production()
                         function_call.place =\
                             self.get_next_temporary_variable()
+                        function_call.add_temporary_variable(
+                            function_call.place)
+                        function_call.contains_call = True
+                        function_call.has_side_effects = True
                         function_token = self.symbols_table[
                             function_identifier]
                         new_production = self.generate_code(
                             function_call.place, ':=',
                             'call', function_identifier,
-                            function_token.get_parameters_length(),
+                            str(function_token.get_parameters_length()),
                             code_type='call')
-                        function_call.append_code(function_argument.code)
+                        function_call.append_production(function_argument)
                         function_call.append_code(new_production)
                         return function_call
                     self.set_syntactic_error(u'T_PARENTHESES_CLOSE', token)
@@ -1516,9 +1760,9 @@ class SyntacticAndSemanticAnalyser():
                         self.check_more_function_arguments(
                             scope, function_identifier, argument_index + 1)
                     more_function_arguments = Production()
-                    more_function_arguments.append_code(function_argument.code)
-                    more_function_arguments.append_code(
-                        more_function_arguments1.code)
+                    more_function_arguments.append_production(function_argument)
+                    more_function_arguments.append_production(
+                        more_function_arguments1)
                     return more_function_arguments
                 else:
                     # Expected an expression after a comma
@@ -1534,8 +1778,8 @@ class SyntacticAndSemanticAnalyser():
         if token:
             if token.token_type == u'T_PARENTHESES_CLOSE':
                 return Production()
-        if len(self.symbols_table[function_identifier].
-               parameters_set.elements) == argument_index:
+        if self.symbols_table[function_identifier].\
+                get_parameters_length() == argument_index:
             self.set_unexpected_parameter_error(
                 function_identifier, argument_index)
         left_side_expression = self.check_left_side_expression(scope)
@@ -1544,8 +1788,8 @@ class SyntacticAndSemanticAnalyser():
         if token:
             if token.token_type == u'T_COMMA':
                 function_argument = Production()
-                function_argument.append_code(
-                    right_side_expression.code)
+                function_argument.append_production(
+                    right_side_expression)
                 function_argument.place = right_side_expression.place
                 if left_side_expression.place:
                     new_production = self.generate_code(
@@ -1553,13 +1797,14 @@ class SyntacticAndSemanticAnalyser():
                         right_side_expression.place)
                     function_argument.append_code(new_production)
                     function_argument.place = left_side_expression.place
+                    function_argument.has_side_effects = True
                 param_name = self.get_localized_identifier(
                     function_argument.place, scope)
                 new_production = self.generate_code(
                     'param', param_name)
                 function_argument.append_code(new_production)
                 present_argument = self.symbols_table[function_identifier].\
-                    parameters_set.get_element_by_index(argument_index)
+                    get_parameter(argument_index)
                 if present_argument and present_argument.defined_type !=\
                         right_side_expression.production_type:
                     self.set_implicit_conversion_warning(
@@ -1568,12 +1813,12 @@ class SyntacticAndSemanticAnalyser():
                         self.get_specific_token(self.token_index))
                 more_function_arguments = self.check_more_function_arguments(
                     scope, function_identifier, argument_index + 1)
-                function_argument.append_code(more_function_arguments.code)
+                function_argument.append_production(more_function_arguments)
                 return function_argument
             else:
                 function_argument = Production()
-                function_argument.append_code(
-                    right_side_expression.code)
+                function_argument.append_production(
+                    right_side_expression)
                 function_argument.place = right_side_expression.place
                 if left_side_expression.place:
                     new_production = self.generate_code(
@@ -1581,6 +1826,7 @@ class SyntacticAndSemanticAnalyser():
                         right_side_expression.place)
                     function_argument.append_code(new_production)
                     function_argument.place = left_side_expression.place
+                    function_argument.has_side_effects = True
                 param_name = self.get_localized_identifier(
                     function_argument.place, scope)
                 new_production = self.generate_code(
@@ -1591,8 +1837,10 @@ class SyntacticAndSemanticAnalyser():
 
     def check_block_argument(self, scope):
         left_side_expression = self.check_left_side_expression(scope)
-        right_side_expression = self.check_right_side_expression(scope)
+        right_side_expression = self.check_logical_or(scope)
         if left_side_expression.place:
+            right_side_expression = self.get_value_production(
+                right_side_expression, scope)
             block_argument = Production()
             left_side_expression_name = self.get_localized_identifier(
                 left_side_expression.place, scope)
@@ -1602,8 +1850,10 @@ class SyntacticAndSemanticAnalyser():
                 left_side_expression_name,
                 left_side_expression.operator,
                 right_side_expression_name)
-            block_argument.append_code(right_side_expression.code)
+            block_argument.append_production(right_side_expression)
             block_argument.append_code(new_production)
+            block_argument.has_side_effects = True
+            block_argument.place = left_side_expression_name
             return block_argument
         else:
             return right_side_expression
@@ -1671,23 +1921,17 @@ class SyntacticAndSemanticAnalyser():
                                                                         start_label, ':')
                                                                 do_while.append_code(
                                                                     new_production1)
-                                                                do_while.append_code(
-                                                                    block_commands_list.code)
-                                                                do_while.append_code(
-                                                                    block_argument.code)
+                                                                do_while.append_production(
+                                                                    block_commands_list)
+                                                                do_while.inherit_metadata(
+                                                                    block_argument)
+                                                                # Loops back while the condition holds
                                                                 new_production2 =\
-                                                                    self.generate_code(
-                                                                        'if',
-                                                                        block_argument.place,
-                                                                        '=', '0',
-                                                                        'goto', end_label)
+                                                                    self.generate_condition_code(
+                                                                        block_argument, scope,
+                                                                        start_label, None)
                                                                 do_while.append_code(
                                                                     new_production2)
-                                                                new_production3 =\
-                                                                    self.generate_code(
-                                                                        'goto', start_label)
-                                                                do_while.append_code(
-                                                                    new_production3)
                                                                 new_production4 =\
                                                                     self.generate_code(
                                                                         end_label, ':')
@@ -1763,18 +2007,16 @@ class SyntacticAndSemanticAnalyser():
                                                         start_label, ':')
                                                 _while.append_code(
                                                     new_production1)
-                                                _while.append_code(
-                                                    block_argument.code)
+                                                _while.inherit_metadata(
+                                                    block_argument)
                                                 new_production2 =\
-                                                    self.generate_code(
-                                                        'if',
-                                                        block_argument.place,
-                                                        '=', '0',
-                                                        'goto', end_label)
+                                                    self.generate_condition_code(
+                                                        block_argument, scope, None,
+                                                        end_label)
                                                 _while.append_code(
                                                     new_production2)
-                                                _while.append_code(
-                                                    block_commands_list.code)
+                                                _while.append_production(
+                                                    block_commands_list)
                                                 new_production3 =\
                                                     self.generate_code(
                                                         'goto', start_label)
@@ -1850,32 +2092,30 @@ class SyntacticAndSemanticAnalyser():
                                 else_label = None
                                 if _else.code:
                                     else_label = self.get_next_label()
-                                if_parentheses.append_code(block_argument.code)
+                                if_parentheses.inherit_metadata(block_argument)
                                 if _else.code:
-                                    new_production = self.generate_code(
-                                        'if', block_argument.place, '=', '0',
-                                        'goto', else_label)
+                                    new_production = self.generate_condition_code(
+                                        block_argument, scope, None, else_label)
                                     if_parentheses.append_code(new_production)
-                                    if_parentheses.append_code(
-                                        block_curly_brackets.code)
+                                    if_parentheses.append_production(
+                                        block_curly_brackets)
                                     new_production2 = self.generate_code(
                                         'goto', end_label)
                                     if_parentheses.append_code(new_production2)
                                     new_production3 = self.generate_code(
                                         else_label, ':')
                                     if_parentheses.append_code(new_production3)
-                                    if_parentheses.append_code(_else.code)
+                                    if_parentheses.append_production(_else)
                                     if not inherited_end_label:
                                         new_production4 = self.generate_code(
                                             end_label, ':')
                                         if_parentheses.append_code(new_production4)
                                 else:
-                                    new_production = self.generate_code(
-                                        'if', block_argument.place, '=', '0',
-                                        'goto', end_label)
+                                    new_production = self.generate_condition_code(
+                                        block_argument, scope, None, end_label)
                                     if_parentheses.append_code(new_production)
-                                    if_parentheses.append_code(
-                                        block_curly_brackets.code)
+                                    if_parentheses.append_production(
+                                        block_curly_brackets)
                                     new_production2 = self.generate_code(
                                         end_label, ':')
                                     if_parentheses.append_code(new_production2)
@@ -1893,32 +2133,30 @@ class SyntacticAndSemanticAnalyser():
                                 else_label = None
                                 if _else.code:
                                     else_label = self.get_next_label()
-                                if_parentheses.append_code(block_argument.code)
+                                if_parentheses.inherit_metadata(block_argument)
                                 if _else.code:
-                                    new_production = self.generate_code(
-                                        'if', block_argument.place, '=', '0',
-                                        'goto', else_label)
+                                    new_production = self.generate_condition_code(
+                                        block_argument, scope, None, else_label)
                                     if_parentheses.append_code(new_production)
-                                    if_parentheses.append_code(
-                                        one_line_if_block.code)
+                                    if_parentheses.append_production(
+                                        one_line_if_block)
                                     new_production2 = self.generate_code(
                                         'goto', end_label)
                                     if_parentheses.append_code(new_production2)
                                     new_production3 = self.generate_code(
                                         else_label, ':')
                                     if_parentheses.append_code(new_production3)
-                                    if_parentheses.append_code(_else.code)
+                                    if_parentheses.append_production(_else)
                                     if not inherited_end_label:
                                         new_production4 = self.generate_code(
                                             end_label, ':')
                                         if_parentheses.append_code(new_production4)
                                 else:
-                                    new_production = self.generate_code(
-                                        'if', block_argument.place, '=', '0',
-                                        'goto', end_label)
+                                    new_production = self.generate_condition_code(
+                                        block_argument, scope, None, end_label)
                                     if_parentheses.append_code(new_production)
-                                    if_parentheses.append_code(
-                                        one_line_if_block.code)
+                                    if_parentheses.append_production(
+                                        one_line_if_block)
                                     new_production2 = self.generate_code(
                                         end_label, ':')
                                     if_parentheses.append_code(new_production2)
@@ -2008,6 +2246,137 @@ class SyntacticAndSemanticAnalyser():
             self.set_syntactic_error(u'else', token)
         self.set_eof_error(u'else')
 
+    def check_switch(self, scope, break_label=None, continue_label=None):
+        index = self.token_index
+        token = self.get_specific_token(index)
+        if token:
+            if token.token_type == u'T_RESERVED_WORD' and\
+                    token.lexeme == u'switch':
+                self.log_message(token)
+                index = self.token_index = index + 1
+                token = self.get_specific_token(index)
+                if token:
+                    if token.token_type == u'T_PARENTHESES_OPEN':
+                        self.log_message(token)
+                        self.token_index = index + 1
+                        block_argument = self.get_value_production(
+                            self.check_block_argument(scope), scope)
+                        end_label = self.get_next_label()
+                        index = self.token_index
+                        token = self.get_specific_token(index)
+                        if token:
+                            if token.token_type == u'T_PARENTHESES_CLOSE':
+                                self.log_message(token)
+                                self.token_index = index + 1
+                                switch_body, cases, default_label =\
+                                    self.check_switch_body(
+                                        scope, end_label, continue_label)
+                                switch = Production()
+                                switch.append_production(block_argument)
+                                place_name = self.get_localized_identifier(
+                                    block_argument.place, scope) or\
+                                    block_argument.place
+                                switch.append_code(self.generate_switch_code(
+                                    switch, place_name, cases,
+                                    default_label or end_label))
+                                switch.append_production(switch_body)
+                                switch.append_code(
+                                    self.generate_code(end_label, ':'))
+                                if block_argument.production_type in\
+                                        [FLOAT_TYPE, DOUBLE_TYPE]:
+                                    self.set_invalid_type_error(
+                                        block_argument.production_type)
+                                return switch
+                            self.set_syntactic_error(u'T_PARENTHESES_CLOSE',
+                                                     token)
+                        self.set_eof_error(u'T_PARENTHESES_CLOSE')
+                    self.set_syntactic_error(u'T_PARENTHESES_OPEN', token)
+                self.set_eof_error(u'T_PARENTHESES_OPEN')
+            self.set_syntactic_error(u'switch', token)
+        self.set_eof_error(u'switch')
+
+    # Helper function, not in the grammar
+    def check_switch_body(self, scope, end_label, continue_label):
+        """
+        Returns the code of the cases, their (value, label) pairs and the
+        label of default, if there is one. The cases fall through to the
+        next one unless they break.
+        """
+        index = self.token_index
+        token = self.get_specific_token(index)
+        if token:
+            if token.token_type == u'T_CURLY_BRACKET_OPEN':
+                self.log_message(token)
+                self.token_index = index + 1
+                switch_body = Production()
+                cases = []
+                default_label = None
+                token = self.get_present_token()
+                while token and token.token_type == u'T_RESERVED_WORD' and\
+                        token.lexeme in [u'case', u'default']:
+                    label = self.get_next_label()
+                    try:
+                        case_label = self.check_case_label()
+                        if case_label is None:
+                            if default_label:
+                                self.set_multiple_default_error(token)
+                            default_label = label
+                        else:
+                            if case_label in [case[0] for case in cases]:
+                                self.set_duplicate_case_error(token,
+                                                              case_label)
+                            cases.append((case_label, label))
+                    except PanicModeError:
+                        self.synchronise(True)
+                    switch_body.append_code(self.generate_code(label, ':'))
+                    switch_body.append_production(
+                        self.check_block_commands_list(scope, end_label,
+                                                       continue_label))
+                    token = self.get_present_token()
+                if token:
+                    if token.token_type == u'T_CURLY_BRACKET_CLOSE':
+                        self.log_message(token)
+                        self.token_index += 1
+                        return switch_body, cases, default_label
+                    self.set_syntactic_error(u'T_CURLY_BRACKET_CLOSE', token)
+                self.set_eof_error(u'T_CURLY_BRACKET_CLOSE')
+            self.set_syntactic_error(u'T_CURLY_BRACKET_OPEN', token)
+        self.set_eof_error(u'T_CURLY_BRACKET_OPEN')
+
+    # Helper function, not in the grammar
+    def check_case_label(self):
+        """
+        Returns the value of a case label, or None for default.
+        """
+        index = self.token_index
+        token = self.get_specific_token(index)
+        self.log_message(token)
+        value = None
+        if token.lexeme == u'case':
+            index = self.token_index = index + 1
+            token = self.get_specific_token(index)
+            sign = 1
+            if token and token.lexeme in self.unary_prefix_operator_list:
+                self.log_message(token)
+                sign = -1 if token.lexeme == u'-' else 1
+                index = self.token_index = index + 1
+                token = self.get_specific_token(index)
+            if not token:
+                self.set_eof_error(u'T_INTEGER')
+            if token.token_type != u'T_INTEGER':
+                self.set_syntactic_error(u'T_INTEGER', token)
+            self.log_message(token)
+            value = sign * int(token.lexeme)
+        index = self.token_index = index + 1
+        token = self.get_specific_token(index)
+        if token:
+            if token.token_type == u'T_COLON':
+                self.log_message(token)
+                self.token_index = index + 1
+                return value
+            self.set_syntactic_error(u'T_COLON', token)
+        self.set_eof_error(u'T_COLON')
+
     def check_for(self, scope):
         index = self.token_index
         token = self.get_specific_token(index)
@@ -2041,16 +2410,13 @@ class SyntacticAndSemanticAnalyser():
                         block_curly_brackets = self.check_block_curly_brackets(
                             scope, end_label, start_label)
                         for_parentheses = Production()
-                        for_parentheses.append_code(for_parameters.code)
+                        for_parentheses.append_production(for_parameters)
                         new_production1 = self.generate_code(start_label, ':')
                         for_parentheses.append_code(new_production1)
-                        for_parentheses.append_code(
-                            for_parameters.condition_code)
-                        new_production2 = self.generate_code(
-                            'if', for_parameters.place, '=', '0',
-                            'goto', end_label)
+                        new_production2 = self.generate_condition_code(
+                            for_parameters.condition, scope, None, end_label)
                         for_parentheses.append_code(new_production2)
-                        for_parentheses.append_code(block_curly_brackets.code)
+                        for_parentheses.append_production(block_curly_brackets)
                         for_parentheses.append_code(
                             for_parameters.increment_code)
                         new_production3 = self.generate_code(
@@ -2073,7 +2439,7 @@ class SyntacticAndSemanticAnalyser():
                 self.log_message(token)
                 self.token_index += 1
                 for_parameter_expression1 =\
-                    self.check_for_parameter_expression(scope)
+                    self.check_for_parameter_expression(scope, True)
                 token = self.get_specific_token(self.token_index)
                 if token:
                     if token.token_type == u'T_SEMICOLON':
@@ -2082,13 +2448,14 @@ class SyntacticAndSemanticAnalyser():
                         for_parameter_expression2 =\
                             self.check_for_parameter_expression(scope)
                         for_parameters = Production()
-                        for_parameters.append_code(for_first_parameter.code)
-                        for_parameters.place =\
-                            for_parameter_expression1.place
-                        for_parameters.condition_code =\
-                            for_parameter_expression1.code
+                        for_parameters.append_production(for_first_parameter)
+                        for_parameters.condition = for_parameter_expression1
                         for_parameters.increment_code =\
                             for_parameter_expression2.code
+                        for_parameters.inherit_metadata(
+                            for_parameter_expression1)
+                        for_parameters.inherit_metadata(
+                            for_parameter_expression2)
                         return for_parameters
                     self.set_syntactic_error(u'T_SEMICOLON', token)
                 self.set_eof_error(u'T_SEMICOLON')
@@ -2105,8 +2472,8 @@ class SyntacticAndSemanticAnalyser():
                 expression = self.check_for_expression(scope)
                 more_for_expressions = self.check_more_for_expressions(scope)
                 for_first_parameter = Production()
-                for_first_parameter.append_code(expression.code)
-                for_first_parameter.append_code(more_for_expressions.code)
+                for_first_parameter.append_production(expression)
+                for_first_parameter.append_production(more_for_expressions)
                 return for_first_parameter
 
     def check_for_expression(self, scope):
@@ -2123,8 +2490,9 @@ class SyntacticAndSemanticAnalyser():
                     left_side_expression_name,
                     left_side_expression.operator,
                     right_side_expression_name)
-                for_expression.append_code(right_side_expression.code)
+                for_expression.append_production(right_side_expression)
                 for_expression.append_code(new_production)
+                for_expression.has_side_effects = True
                 for_expression.place = left_side_expression.place
                 return for_expression
             else:
@@ -2134,9 +2502,8 @@ class SyntacticAndSemanticAnalyser():
         else:
             if right_side_expression.place:
                 expression = Production()
-                if any('call' in string for string
-                        in right_side_expression.code):
-                    expression.append_code(right_side_expression.code)
+                if right_side_expression.has_side_effects:
+                    expression.append_production(right_side_expression)
                 return expression
             else:
                 return Production()
@@ -2152,15 +2519,15 @@ class SyntacticAndSemanticAnalyser():
                 more_for_expressions1 =\
                     self.check_more_for_expressions(scope)
                 more_for_expressions = Production()
-                more_for_expressions.append_code(for_expression.code)
-                more_for_expressions.append_code(more_for_expressions1.code)
+                more_for_expressions.append_production(for_expression)
+                more_for_expressions.append_production(more_for_expressions1)
                 return more_for_expressions
             more_for_expressions = Production()
             return more_for_expressions
         more_for_expressions = Production()
         return more_for_expressions
 
-    def check_for_parameter_expression(self, scope):
+    def check_for_parameter_expression(self, scope, is_condition=False):
         token = self.get_specific_token(self.token_index)
         if token:
             # Empty Expression
@@ -2171,6 +2538,7 @@ class SyntacticAndSemanticAnalyser():
                     for_expression = Production()
                     for_expression.place =\
                         self.get_next_temporary_variable()
+                    for_expression.add_temporary_variable(for_expression.place)
                     new_production = self.generate_code(
                         for_expression.place, ':=', '1')
                     for_expression.append_code(new_production)
@@ -2182,9 +2550,14 @@ class SyntacticAndSemanticAnalyser():
             else:
                 left_side_expression =\
                     self.check_left_side_expression(scope)
-                right_side_expression =\
-                    self.check_right_side_expression(scope)
+                if is_condition:
+                    right_side_expression = self.check_logical_or(scope)
+                else:
+                    right_side_expression =\
+                        self.check_right_side_expression(scope)
                 if left_side_expression.place:
+                    right_side_expression = self.get_value_production(
+                        right_side_expression, scope)
                     for_parameter_expression = Production()
                     left_side_expression_name = self.get_localized_identifier(
                         left_side_expression.place, scope)
@@ -2194,11 +2567,12 @@ class SyntacticAndSemanticAnalyser():
                         left_side_expression_name,
                         left_side_expression.operator,
                         right_side_expression_name)
-                    for_parameter_expression.append_code(
-                        right_side_expression.code)
+                    for_parameter_expression.append_production(
+                        right_side_expression)
                     for_parameter_expression.place =\
                         left_side_expression_name
                     for_parameter_expression.append_code(new_production)
+                    for_parameter_expression.has_side_effects = True
                     return for_parameter_expression
                 elif right_side_expression.place:
                     return right_side_expression
@@ -2206,6 +2580,7 @@ class SyntacticAndSemanticAnalyser():
                     for_expression = Production()
                     for_expression.place =\
                         self.get_next_temporary_variable()
+                    for_expression.add_temporary_variable(for_expression.place)
                     new_production = self.generate_code(
                         for_expression.place, ':=', '1')
                     for_expression.append_code(new_production)
@@ -0,0 +1,406 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import operator
+from code_optimiser import get_type_category
+from intermediary_code import (find_functions, is_constant,
+                               is_temporary_variable, parse_code)
+
+(COPY, BINARY, UNARY, GOTO, IF_FALSE, IF_TRUE, IF_COMPARE, JUMP_TABLE, PARAM,
+ CALL, CALL_BUILTIN, LOAD_PARAMETER, RETURN, TRUNCATE, HALT) = range(15)
+
+
+class ExecutionError(Exception):
+    def __str__(self):
+        return u'Execution Error - %s' % (self.message)
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+def c_divide(value1, value2):
+    if type(value1) in [int, long] and type(value2) in [int, long]:
+        quotient = abs(value1) // abs(value2)
+        return quotient if (value1 < 0) == (value2 < 0) else -quotient
+    return float(value1) / value2
+
+
+def c_remainder(value1, value2):
+    return value1 - value2 * c_divide(value1, value2)
+
+
+def get_binary_operators():
+    return {
+        u'+': operator.add, u'-': operator.sub, u'*': operator.mul,
+        u'/': c_divide, u'%': c_remainder,
+        u'<<': operator.lshift, u'>>': operator.rshift,
+        u'&': operator.and_, u'|': operator.or_, u'^': operator.xor,
+        u'==': lambda value1, value2: int(value1 == value2),
+        u'!=': lambda value1, value2: int(value1 != value2),
+        u'<': lambda value1, value2: int(value1 < value2),
+        u'>': lambda value1, value2: int(value1 > value2),
+        u'<=': lambda value1, value2: int(value1 <= value2),
+        u'>=': lambda value1, value2: int(value1 >= value2),
+        u'&&': lambda value1, value2: int(bool(value1) and bool(value2)),
+        u'||': lambda value1, value2: int(bool(value1) or bool(value2))
+    }
+
+
+def get_unary_operators():
+    return {
+        u'+': operator.pos, u'-': operator.neg, u'~': operator.invert,
+        u'!': lambda value: int(not value)
+    }
+
+
+def get_compound_operators():
+    binary_operators = get_binary_operators()
+    return dict([(u'%s=' % key, binary_operators[key]) for key in
+                 [u'+', u'-', u'*', u'/', u'%', u'<<', u'>>', u'&', u'|',
+                  u'^']])
+
+
+class InputOutputStub():
+    '''
+    Stands in for the Arduino board: digital and analog inputs are read from
+    the given dictionaries (pin -> value, or pin -> function of the current
+    time in milliseconds) and every output is recorded in the events list.
+    '''
+    def __init__(self, digital_inputs=None, analog_inputs=None):
+        self.digital_inputs = digital_inputs if digital_inputs is not None\
+            else {}
+        self.analog_inputs = analog_inputs if analog_inputs is not None\
+            else {}
+        self.pin_modes = {}
+        self.digital_outputs = {}
+        self.analog_outputs = {}
+        self.events = []
+        self.time = 0
+
+    def get_functions(self):
+        return {
+            u'pinMode': self.pin_mode,
+            u'digitalWrite': self.digital_write,
+            u'digitalRead': self.digital_read,
+            u'analogWrite': self.analog_write,
+            u'analogRead': self.analog_read,
+            u'delay': self.delay,
+            u'millis': self.millis
+        }
+
+    def read_input(self, inputs, pin):
+        value = inputs.get(pin, 0)
+        if callable(value):
+            return value(self.time)
+        return value
+
+    def pin_mode(self, pin, mode):
+        self.pin_modes[pin] = mode
+        return 0
+
+    def digital_write(self, pin, value):
+        self.digital_outputs[pin] = 1 if value else 0
+        self.events.append((self.time, u'digitalWrite', pin,
+                            self.digital_outputs[pin]))
+        return 0
+
+    def digital_read(self, pin):
+        return 1 if self.read_input(self.digital_inputs, pin) else 0
+
+    def analog_write(self, pin, value):
+        self.analog_outputs[pin] = value
+        self.events.append((self.time, u'analogWrite', pin, value))
+        return 0
+
+    def analog_read(self, pin):
+        return self.read_input(self.analog_inputs, pin)
+
+    def delay(self, milliseconds):
+        self.time += milliseconds
+        return 0
+
+    def millis(self):
+        return self.time
+
+
+class VirtualMachine():
+    '''
+    Executes the C3E printed by print_intermediary_code. Labels are resolved
+    to instruction indexes and every operand (variable, temporary or
+    constant) to a slot of a flat memory array before the execution starts.
+    Calls to the Arduino functions provided by the input/output stub are
+    answered by the stub, even if the sketch defines a placeholder body. The
+    (name, type, value) entries of the data image are loaded before the
+    definitions code runs. The parameters and local variables of each
+    function come from SymbolsTable.get_function_locals; without them, only
+    the temporaries are saved across recursive calls.
+    '''
+    def __init__(self, definitions_code, program_code, input_output=None,
+                 variable_types=None, data_image=None, function_locals=None):
+        self.input_output = input_output if input_output is not None\
+            else InputOutputStub()
+        self.variable_types = variable_types if variable_types is not None\
+            else {}
+        self.function_locals = function_locals\
+            if function_locals is not None else {}
+        self.slots = {}
+        self.memory = []
+        self.functions = {}
+        self.code = []
+        self.executed_instructions = 0
+        self.binary_operators = get_binary_operators()
+        self.unary_operators = get_unary_operators()
+        self.compound_operators = get_compound_operators()
+        self.assemble(parse_code(definitions_code), parse_code(program_code))
+        for name, _, value in data_image or []:
+            self.memory[self.get_slot(name)] = value
+
+    def get_slot(self, operand):
+        if operand not in self.slots:
+            self.slots[operand] = len(self.memory)
+            if is_constant(operand):
+                self.memory.append(float(operand) if '.' in operand
+                                   else int(operand))
+            else:
+                self.memory.append(0)
+        return self.slots[operand]
+
+    def assemble(self, definitions_instructions, program_instructions):
+        # Each function's locals and temporaries get a contiguous range of
+        # slots, so that a recursive call can save and restore them.
+        self.local_ranges = {}
+        for name, start, end in find_functions(program_instructions):
+            first_slot = len(self.memory)
+            function_locals = self.function_locals.get(name, ())
+            for instruction in program_instructions[start:end]:
+                for operand in [instruction.result, instruction.argument1,
+                                instruction.argument2]:
+                    if operand and (is_temporary_variable(operand) or
+                                    operand in function_locals):
+                        self.get_slot(operand)
+            self.local_ranges[name] = (first_slot, len(self.memory))
+        labels = {}
+        for instructions in [definitions_instructions, program_instructions]:
+            for instruction in instructions:
+                if instruction.kind == 'label':
+                    labels[instruction.target] = len(self.code)
+                else:
+                    self.code.extend(self.assemble_instruction(instruction))
+            # The definitions code stops before the first function, and a
+            # function called from outside returns to the last instruction.
+            self.code.append((HALT,))
+        self.return_index = len(self.code) - 1
+        builtin_functions = self.input_output.get_functions()
+        for index, assembled in enumerate(self.code):
+            if assembled[0] in [GOTO, IF_FALSE, IF_TRUE, IF_COMPARE]:
+                if assembled[-1] not in labels:
+                    raise ExecutionError(u'Label "%s" not found' %
+                                         (assembled[-1]))
+                self.code[index] = assembled[:-1] + (labels[assembled[-1]],)
+            elif assembled[0] == JUMP_TABLE:
+                for target in assembled[2]:
+                    if target not in labels:
+                        raise ExecutionError(u'Label "%s" not found' %
+                                             (target))
+                self.code[index] = (JUMP_TABLE, assembled[1],
+                                    [labels[target]
+                                     for target in assembled[2]])
+            elif assembled[0] == CALL:
+                name = assembled[2]
+                if name in builtin_functions:
+                    self.code[index] = (CALL_BUILTIN, assembled[1],
+                                        builtin_functions[name],
+                                        assembled[3])
+                elif name in labels:
+                    self.code[index] = (CALL, assembled[1], labels[name],
+                                        assembled[3],
+                                        self.local_ranges[name])
+                else:
+                    raise ExecutionError(u'Function "%s" not found' % (name))
+        for name in labels:
+            if name in self.local_ranges:
+                self.functions[name] = (labels[name], self.local_ranges[name])
+
+    def assemble_instruction(self, instruction):
+        kind = instruction.kind
+        if kind == 'goto':
+            return [(GOTO, instruction.target)]
+        elif kind == 'if_false':
+            return [(IF_FALSE, self.get_slot(instruction.argument1),
+                     instruction.target)]
+        elif kind == 'if_true':
+            return [(IF_TRUE, self.get_slot(instruction.argument1),
+                     instruction.target)]
+        elif kind == 'if_compare':
+            return [(IF_COMPARE,
+                     self.binary_operators[instruction.operator],
+                     self.get_slot(instruction.argument1),
+                     self.get_slot(instruction.argument2),
+                     instruction.target)]
+        elif kind == 'jump_table':
+            return [(JUMP_TABLE, self.get_slot(instruction.argument1),
+                     instruction.targets)]
+        elif kind == 'param':
+            return [(PARAM, self.get_slot(instruction.argument1))]
+        elif kind == 'return':
+            return [(RETURN, self.get_slot(instruction.argument1))]
+        elif kind == 'call':
+            assembled = [(CALL, self.get_slot(instruction.result),
+                          instruction.argument1, int(instruction.argument2))]
+        elif kind == 'load_parameter':
+            assembled = [(LOAD_PARAMETER, self.get_slot(instruction.result),
+                          int(instruction.argument1))]
+        elif kind == 'copy':
+            assembled = [(COPY, self.get_slot(instruction.result),
+                          self.get_slot(instruction.argument1))]
+        elif kind == 'compound':
+            result_slot = self.get_slot(instruction.result)
+            assembled = [(BINARY, result_slot,
+                          self.compound_operators[instruction.operator],
+                          result_slot, self.get_slot(instruction.argument1))]
+        elif kind == 'unary':
+            assembled = [(UNARY, self.get_slot(instruction.result),
+                          self.unary_operators[instruction.operator],
+                          self.get_slot(instruction.argument1))]
+        else:
+            assembled = [(BINARY, self.get_slot(instruction.result),
+                          self.binary_operators[instruction.operator],
+                          self.get_slot(instruction.argument1),
+                          self.get_slot(instruction.argument2))]
+        # Stores into integral variables drop the fractional part, as the
+        # implicit conversion of the compiled program would.
+        if get_type_category(self.variable_types.get(instruction.result))\
+                in ['int', 'unsigned']:
+            assembled.append((TRUNCATE, self.get_slot(instruction.result)))
+        return assembled
+
+    def get_variable(self, name):
+        return self.memory[self.slots[name]]
+
+    def get_variables(self):
+        return dict([(name, self.memory[slot])
+                     for name, slot in self.slots.items()
+                     if not is_constant(name) and
+                     not is_temporary_variable(name)])
+
+    def run(self, loop_iterations=1, max_instructions=None):
+        self.execute(0, max_instructions)
+        if u'setup' in self.functions:
+            self.call(u'setup', max_instructions=max_instructions)
+        if u'loop' in self.functions:
+            for iteration in xrange(loop_iterations):
+                self.call(u'loop', max_instructions=max_instructions)
+
+    def call(self, name, arguments=None, max_instructions=None):
+        if name not in self.functions:
+            raise ExecutionError(u'Function "%s" not found' % (name))
+        entry, local_range = self.functions[name]
+        return self.execute(entry, max_instructions, arguments or [],
+                            local_range)
+
+    def execute(self, pc, max_instructions=None, arguments=None,
+                local_range=None):
+        code = self.code
+        memory = self.memory
+        frames = [(self.return_index, None, [], None, None)]
+        active_functions = {}
+        if local_range is not None:
+            active_functions[local_range] = 1
+        pending_arguments = []
+        arguments = arguments if arguments is not None else []
+        executed = 0
+        limit = max_instructions if max_instructions is not None\
+            else float('inf')
+        try:
+            while True:
+                instruction = code[pc]
+                pc += 1
+                executed += 1
+                opcode = instruction[0]
+                if opcode == BINARY:
+                    memory[instruction[1]] = instruction[2](
+                        memory[instruction[3]], memory[instruction[4]])
+                elif opcode == COPY:
+                    memory[instruction[1]] = memory[instruction[2]]
+                elif opcode == IF_FALSE:
+                    if not memory[instruction[1]]:
+                        pc = instruction[2]
+                elif opcode == IF_TRUE:
+                    if memory[instruction[1]]:
+                        pc = instruction[2]
+                        # It closes the do-while loops
+                        if executed >= limit:
+                            raise ExecutionError(
+                                u'Instruction limit reached')
+                elif opcode == IF_COMPARE:
+                    if instruction[1](memory[instruction[2]],
+                                      memory[instruction[3]]):
+                        pc = instruction[4]
+                        if executed >= limit:
+                            raise ExecutionError(
+                                u'Instruction limit reached')
+                elif opcode == GOTO:
+                    pc = instruction[1]
+                    if executed >= limit:
+                        raise ExecutionError(u'Instruction limit reached')
+                elif opcode == JUMP_TABLE:
+                    pc = instruction[2][int(memory[instruction[1]])]
+                    if executed >= limit:
+                        raise ExecutionError(u'Instruction limit reached')
+                elif opcode == TRUNCATE:
+                    memory[instruction[1]] = int(memory[instruction[1]])
+                elif opcode == UNARY:
+                    memory[instruction[1]] = instruction[2](
+                        memory[instruction[3]])
+                elif opcode == PARAM:
+                    pending_arguments.append(memory[instruction[1]])
+                elif opcode == LOAD_PARAMETER:
+                    memory[instruction[1]] = arguments[instruction[2]]
+                elif opcode == CALL:
+                    count = instruction[3]
+                    callee_range = instruction[4]
+                    saved_locals = None
+                    if active_functions.get(callee_range):
+                        saved_locals = memory[
+                            callee_range[0]:callee_range[1]]
+                    active_functions[callee_range] =\
+                        active_functions.get(callee_range, 0) + 1
+                    frames.append((pc, instruction[1], arguments,
+                                   callee_range, saved_locals))
+                    if count:
+                        arguments = pending_arguments[-count:]
+                        del pending_arguments[-count:]
+                    else:
+                        arguments = []
+                    pc = instruction[2]
+                    if executed >= limit:
+                        raise ExecutionError(u'Instruction limit reached')
+                elif opcode == CALL_BUILTIN:
+                    count = instruction[3]
+                    if count:
+                        builtin_arguments = pending_arguments[-count:]
+                        del pending_arguments[-count:]
+                    else:
+                        builtin_arguments = []
+                    memory[instruction[1]] = instruction[2](
+                        *builtin_arguments)
+                elif opcode == RETURN:
+                    value = memory[instruction[1]]
+                    pc, result_slot, arguments, callee_range, saved_locals =\
+                        frames.pop()
+                    if callee_range is not None:
+                        active_functions[callee_range] -= 1
+                        if saved_locals is not None:
+                            memory[callee_range[0]:callee_range[1]] =\
+                                saved_locals
+                    if result_slot is None:
+                        self.executed_instructions += executed
+                        return value
+                    memory[result_slot] = value
+                else:
+                    self.executed_instructions += executed
+                    return None
+        except ZeroDivisionError:
+            self.executed_instructions += executed
+            raise ExecutionError(u'Division by zero')
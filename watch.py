@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Watch mode: compiles every sketch in a directory tree, then compiles again
+each sketch whose contents change, or the contents of a header it includes,
+printing the results as they finish. The changes come from inotify where it
+is available, and from polling the modification times otherwise.
+
+Usage: python watch.py [directory] [--workers=N] [program.py options]
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import functools
+import hashlib
+import multiprocessing
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from compile_server import ignore_interrupt, run_program
+from preprocessor import find_included_files
+
+SKETCH_EXTENSIONS = ['.c', '.ino']
+HEADER_EXTENSIONS = ['.h', '.hpp']
+DEBOUNCE_DELAY = 0.2
+POLLING_INTERVAL = 0.5
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |\
+    IN_CREATE | IN_DELETE
+INOTIFY_EVENT = 'iIII'
+
+
+def is_sketch(path):
+    return os.path.splitext(path)[1] in SKETCH_EXTENSIONS
+
+
+def is_header(path):
+    return os.path.splitext(path)[1] in HEADER_EXTENSIONS
+
+
+def find_sketches(directory, headers=False):
+    sketches = []
+    for root, _, names in os.walk(directory):
+        sketches.extend(os.path.join(root, name) for name in names
+                        if is_sketch(name) or (headers and is_header(name)))
+    return sorted(sketches)
+
+
+class InotifyWatcher():
+    def __init__(self, directory):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        self.file_descriptor = self.libc.inotify_init()
+        if self.file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.directories = {}
+        for root, _, _ in os.walk(directory):
+            self.add_directory(root)
+
+    def add_directory(self, directory):
+        watch_descriptor = self.libc.inotify_add_watch(
+            self.file_descriptor, directory, INOTIFY_MASK)
+        if watch_descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+        self.directories[watch_descriptor] = directory
+
+    def wait(self, timeout=None):
+        '''
+        Returns the paths of the sketches and headers that changed, or an
+        empty set if nothing changed before the timeout.
+        '''
+        try:
+            readable = select.select([self.file_descriptor], [], [],
+                                     timeout)[0]
+        except select.error as exception:
+            if exception.args[0] == errno.EINTR:
+                return set()
+            raise
+        if not readable:
+            return set()
+        data = os.read(self.file_descriptor, 64 * 1024)
+        changed_paths = set()
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _, length = struct.unpack_from(
+                INOTIFY_EVENT, data, offset)
+            offset += struct.calcsize(INOTIFY_EVENT)
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if watch_descriptor not in self.directories:
+                continue
+            path = os.path.join(self.directories[watch_descriptor], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for root, _, _ in os.walk(path):
+                        self.add_directory(root)
+                    changed_paths.update(find_sketches(path))
+            elif is_sketch(name) or is_header(name):
+                changed_paths.add(path)
+        return changed_paths
+
+
+class PollingWatcher():
+    def __init__(self, directory):
+        self.directory = directory
+        self.versions = self.get_versions()
+
+    def get_versions(self):
+        versions = {}
+        for path in find_sketches(self.directory, True):
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            versions[path] = (status.st_mtime, status.st_size)
+        return versions
+
+    def wait(self, timeout=None):
+        start = time.time()
+        while True:
+            versions = self.get_versions()
+            changed_paths = set(
+                path for path in set(versions) | set(self.versions)
+                if versions.get(path) != self.versions.get(path))
+            self.versions = versions
+            if changed_paths:
+                return changed_paths
+            if timeout is not None and time.time() - start >= timeout:
+                return set()
+            time.sleep(POLLING_INTERVAL if timeout is None else
+                       min(POLLING_INTERVAL, timeout))
+
+
+def get_watcher(directory):
+    try:
+        return InotifyWatcher(directory)
+    except (AttributeError, OSError):
+        # No inotify on this platform
+        return PollingWatcher(directory)
+
+
+class Watch():
+    def __init__(self, directory, options, workers=None):
+        self.directory = directory
+        self.options = options
+        self.pool = multiprocessing.Pool(workers, ignore_interrupt)
+        self.output_lock = threading.Lock()
+        self.include_paths = [option[2:] for option in options
+                              if option.startswith('-I')]
+        # Hashes of the sketches and headers compiled
+        self.hashes = {}
+        # Headers included by each sketch
+        self.dependencies = {}
+        self.watcher = get_watcher(directory)
+
+    def get_hash(self, path):
+        try:
+            with open(path, 'rb') as sketch_file:
+                return hashlib.sha1(sketch_file.read()).hexdigest()
+        except IOError:
+            return None
+
+    def print_result(self, path, result):
+        output, _ = result
+        with self.output_lock:
+            print '==> %s <==' % (path)
+            sys.stdout.write(output.encode('utf-8')
+                             if isinstance(output, unicode) else output)
+            sys.stdout.flush()
+
+    def update_hash(self, path):
+        '''
+        Returns whether the contents of the file changed since the last call.
+        '''
+        file_hash = self.get_hash(path)
+        changed = self.hashes.get(path) != file_hash
+        if file_hash is None:
+            self.hashes.pop(path, None)
+        else:
+            self.hashes[path] = file_hash
+        return changed
+
+    def compile(self, paths):
+        changed_headers = set(path for path in paths
+                              if is_header(path) and self.update_hash(path))
+        sketches = set(path for path in paths if is_sketch(path))
+        sketches.update(sketch for sketch, headers in
+                        self.dependencies.items() if headers & changed_headers)
+        for path in sorted(sketches):
+            sketch_hash = self.get_hash(path)
+            if sketch_hash is None:
+                self.dependencies.pop(path, None)
+                if self.hashes.pop(path, None):
+                    with self.output_lock:
+                        print '==> %s <==' % (path)
+                        print 'Removed.'
+                continue
+            # Saved without changes, and so were its headers
+            if self.hashes.get(path) == sketch_hash and\
+                    not self.dependencies[path] & changed_headers:
+                continue
+            self.hashes[path] = sketch_hash
+            self.dependencies[path] = find_included_files(
+                path, self.include_paths)
+            for header in self.dependencies[path]:
+                if header not in self.hashes:
+                    self.hashes[header] = self.get_hash(header)
+            self.pool.apply_async(
+                run_program, ([path] + self.options, os.getcwd()),
+                callback=functools.partial(self.print_result, path))
+
+    def run(self):
+        self.compile(find_sketches(self.directory))
+        while True:
+            changed_paths = self.watcher.wait()
+            # Wait for the burst of saves to end
+            while True:
+                more_changed_paths = self.watcher.wait(DEBOUNCE_DELAY)
+                if not more_changed_paths:
+                    break
+                changed_paths |= more_changed_paths
+            self.compile(changed_paths)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def main(arguments):
+    directories = [argument for argument in arguments
+                   if not argument.startswith('-')]
+    options = [argument for argument in arguments
+               if argument.startswith('-') and
+               not argument.startswith('--workers=')]
+    workers = None
+    for argument in arguments:
+        if argument.startswith('--workers='):
+            workers = int(argument[len('--workers='):])
+    if len(directories) > 1:
+        print 'Usage: python watch.py [directory] [--workers=N]'\
+            ' [program.py options]'
+        sys.exit(1)
+    directory = os.path.abspath(directories[0] if directories else '.')
+    watch = Watch(directory, options, workers)
+    try:
+        watch.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watch.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])